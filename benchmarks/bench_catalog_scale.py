@@ -0,0 +1,301 @@
+"""
+Sinh catalog tiếng Việt giả lập (nhóm sản phẩm nhiều phiên bản, thuộc tính, danh mục, embedding ảnh
+ngẫu nhiên) ở nhiều kích thước, nạp qua đường nạp dữ liệu, rồi đo độ trễ (p50/p95/p99) và bộ nhớ
+của tìm kiếm văn bản, tìm kiếm ảnh (kNN) và _build_product_context khi catalog lớn dần.
+
+Hai backend:
+- memory (mặc định): đọc file catalog sinh ra theo khối như script nạp (iter_catalog_chunks),
+  ghi snapshot catalog rồi dựng chỉ mục BM25 trong bộ nhớ và chỉ mục ảnh (giống SEARCH_BACKEND=memory,
+  IMAGE_SEARCH_BACKEND=local). Không cần Elasticsearch.
+- es: đẩy vào index "catalog_bench_<số sản phẩm>" của Elasticsearch cục bộ bằng _bulk_chunk của
+  elastic_search_push_data, đo truy vấn của build_search_body và kNN, xóa index khi xong (trừ --keep).
+
+Chạy từ thư mục gốc của project:
+    python -m benchmarks.bench_catalog_scale --sizes 100000 300000 1000000
+    python -m benchmarks.bench_catalog_scale --backend es --sizes 100000 --queries 200
+1 triệu sản phẩm với vector 512 chiều float32 cần khoảng 2 GB cho ma trận embedding;
+dùng --embedding-dtype int8 hoặc --dim nhỏ hơn nếu máy ít bộ nhớ.
+"""
+import argparse
+import gc
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import requests
+
+from src.config.settings import PAGE_SIZE
+from src.services.image_index import ImageIndex
+from src.services.local_search import CatalogIndex
+from src.services.response_service import _build_product_context
+from src.services.search_service import ELASTIC_HOST, SOURCE_PROFILES, build_search_body
+from src.utils.catalog_loader import CATALOG_COLUMNS, iter_catalog_chunks, dataframe_records
+from src.utils.catalog_snapshot import CatalogSnapshot, write_snapshot
+
+# (danh mục, tên gốc, thương hiệu, kiểu thuộc tính, khoảng giá)
+FAMILIES = [
+    ("Máy hàn", ["Máy hàn điện tử", "Máy hàn thiếc", "Trạm hàn", "Máy hàn khò"], ["Quick", "Hakko", "Yihua", "Sugon"], "model", (350000, 8500000)),
+    ("Mỏ hàn", ["Mỏ hàn nhiệt", "Mũi hàn", "Tay hàn"], ["Quick", "Hakko", "Goot"], "tip", (30000, 900000)),
+    ("Kính hiển vi", ["Kính hiển vi soi mạch", "Kính hiển vi 3 mắt", "Kính lúp điện tử"], ["Relife", "Amtast", "Kaisi"], "zoom", (900000, 25000000)),
+    ("Tô vít", ["Bộ tô vít", "Tô vít đa năng", "Tua vít từ tính"], ["Mechanic", "Qianli", "Baku"], "size", (25000, 650000)),
+    ("Đèn", ["Đèn kính hiển vi", "Đèn LED soi mạch", "Đèn lúp kẹp bàn"], ["Relife", "Mechanic"], "color", (80000, 1200000)),
+    ("Nguồn", ["Nguồn đa năng", "Nguồn tổ ong", "Bộ nguồn sửa điện thoại"], ["Mastech", "Longwei", "Sugon"], "voltage", (450000, 6500000)),
+    ("Đồng hồ đo", ["Đồng hồ vạn năng", "Ampe kìm", "Máy hiện sóng cầm tay"], ["Fluke", "Uni-T", "Kyoritsu"], "model", (150000, 12000000)),
+    ("Phụ kiện", ["Thiếc hàn", "Nhựa thông", "Keo tản nhiệt", "Băng dính chịu nhiệt"], ["Mechanic", "Relife", "Amaoe"], "weight", (10000, 350000)),
+    ("Máy khò", ["Máy khò nhiệt", "Máy khò từ", "Máy khò mini"], ["Quick", "Sugon", "Atten"], "power", (650000, 7800000)),
+    ("Dụng cụ sửa điện thoại", ["Bộ tách màn hình", "Kẹp main", "Dao cạo keo", "Nhíp gắp linh kiện"], ["Mechanic", "Relife", "Qianli"], "size", (20000, 2500000)),
+]
+PROPERTY_VALUES = {
+    "model": lambda rng: f"{rng.choice(['T', 'S', 'A', 'M', 'X'])}{rng.integers(100, 9999)}{rng.choice(['', 'D', 'P', 'Pro', 'Plus'])}",
+    "tip": lambda rng: f"Mũi {rng.choice(['dao', 'nhọn', 'dẹt', 'cong', 'vát'])} {rng.choice(['900M', 'T12', 'C210', 'K'])}",
+    "zoom": lambda rng: f"{rng.choice([7, 10, 20, 45, 90])}X-{rng.choice([45, 90, 180, 300])}X",
+    "size": lambda rng: f"Cỡ {rng.choice(['0.6', '0.8', '1.2', '1.5', '2.0', 'PH00', 'PH0', 'T2', 'T5'])}",
+    "color": lambda rng: f"Màu {rng.choice(['trắng', 'đen', 'vàng', 'đỏ', 'xanh'])}",
+    "voltage": lambda rng: f"{rng.choice([15, 30, 60])}V {rng.choice([2, 3, 5, 10])}A",
+    "weight": lambda rng: f"{rng.choice([10, 50, 100, 200, 500])}g",
+    "power": lambda rng: f"{rng.choice([300, 700, 1000, 1200])}W",
+}
+SPEC_SENTENCES = [
+    "Thân máy bằng hợp kim chịu nhiệt, tản nhiệt nhanh.",
+    "Màn hình LED hiển thị nhiệt độ, điều chỉnh chính xác từng độ.",
+    "Phù hợp cho thợ sửa chữa điện thoại, laptop và mạch điện tử.",
+    "Bảo hành chính hãng, hỗ trợ đổi mới trong 7 ngày nếu lỗi nhà sản xuất.",
+    "Thiết kế gọn nhẹ, dễ mang theo khi đi làm dịch vụ.",
+    "Tương thích với đa số phụ kiện thay thế trên thị trường.",
+]
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def rss_mb() -> float:
+    """Bộ nhớ thường trú hiện tại của tiến trình (MB); Linux đọc /proc, nơi khác dùng đỉnh ru_maxrss."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def generate_catalog(count: int, dim: int, directory: str, seed: int = 0, chunk_rows: int = 50000):
+    """
+    Ghi catalog `count` dòng ra catalog.csv (đúng cột CATALOG_COLUMNS) và embedding ra embeddings.npy
+    (memmap). Mỗi nhóm sản phẩm có 1-6 phiên bản cùng tên, khác thuộc tính; embedding của các phiên bản
+    là vector của nhóm cộng nhiễu nhỏ (cùng một ảnh chụp lại), đã chuẩn hóa.
+    Trả về (đường dẫn csv, ma trận embedding memmap, danh sách truy vấn văn bản mẫu).
+    """
+    rng = np.random.default_rng(seed)
+    csv_path = os.path.join(directory, "catalog.csv")
+    embeddings = np.lib.format.open_memmap(os.path.join(directory, "embeddings.npy"), mode="w+", dtype=np.float32, shape=(count, dim))
+    queries, written, group = [], 0, 0
+    while written < count:
+        rows, vectors = [], []
+        while len(rows) < chunk_rows and written + len(rows) < count:
+            category, names, brands, kind, (low, high) = FAMILIES[rng.integers(len(FAMILIES))]
+            brand = str(rng.choice(brands))
+            name = f"{rng.choice(names)} {brand} {PROPERTY_VALUES['model'](rng)}"
+            base_price = float(rng.integers(low // 1000, high // 1000)) * 1000
+            base_vector = rng.standard_normal(dim).astype(np.float32)
+            group += 1
+            variants = min(int(rng.integers(1, 7)), count - written - len(rows))
+            for variant in range(variants):
+                properties = PROPERTY_VALUES[kind](rng) if variants > 1 or rng.random() < 0.5 else "0"
+                code = f"SP{group:07d}{variant:02d}"
+                rows.append({
+                    "product_code": code,
+                    "product_name": name,
+                    "category": category,
+                    "properties": properties,
+                    "lifecare_price": f"{base_price * (1 + 0.1 * variant):,.0f}",
+                    "trademark": brand,
+                    "guarantee": str(rng.choice(["3 tháng", "6 tháng", "12 tháng", "Không bảo hành"])),
+                    "inventory": int(rng.choice([0, 0, 1, 2, 5, 10, 30, 100])),
+                    "specifications": " ".join(rng.choice(SPEC_SENTENCES, size=3, replace=False)),
+                    "avatar_images": f"https://cdn.example.vn/products/{code}.jpg",
+                    "link_product": f"https://example.vn/san-pham/{code.lower()}",
+                })
+                vector = base_vector + rng.standard_normal(dim).astype(np.float32) * 0.05
+                vectors.append(vector / np.linalg.norm(vector))
+            if len(queries) < 1000 and rng.random() < 0.05:
+                short_name = " ".join(name.split()[:2 + int(rng.integers(0, 2))])
+                query = {"product_name": short_name, "category": category}
+                if properties != "0" and rng.random() < 0.3:
+                    query["properties"] = properties.split()[-1]
+                queries.append(query)
+        frame = pd.DataFrame(rows, columns=CATALOG_COLUMNS)
+        frame.to_csv(csv_path, mode="a" if written else "w", header=not written, index=False)
+        embeddings[written:written + len(rows)] = np.asarray(vectors, dtype=np.float32)
+        written += len(rows)
+    embeddings.flush()
+    return csv_path, embeddings, queries
+
+
+def make_image_queries(embeddings: np.ndarray, count: int, noise: float, seed: int = 1) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(embeddings), min(count, len(embeddings)), replace=False)
+    queries = np.asarray(embeddings[np.sort(rows)], dtype=np.float32)
+    return queries + rng.normal(0, noise / np.sqrt(queries.shape[1]), queries.shape).astype(np.float32)
+
+
+def summarize(latencies) -> dict:
+    return {"p50": percentile(latencies, 0.5), "p95": percentile(latencies, 0.95), "p99": percentile(latencies, 0.99)}
+
+
+def measure_context(pages) -> dict:
+    """Độ trễ _build_product_context (ms) trên các trang kết quả thật của lần đo tìm kiếm văn bản."""
+    latencies = []
+    for page in pages:
+        start = time.perf_counter()
+        _build_product_context(page, include_specs=True)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return summarize(latencies) if latencies else {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+
+
+def run_memory(csv_path, embeddings, text_queries, image_queries, args, directory) -> dict:
+    gc.collect()
+    base_rss = rss_mb()
+    start = time.perf_counter()
+    records = []
+    for df in iter_catalog_chunks(csv_path, args.chunk_rows):
+        records.extend(dataframe_records(df))
+    path = write_snapshot(records, embeddings, embedding_dtype=args.embedding_dtype, directory=os.path.join(directory, "snapshots"))
+    ingest_seconds = time.perf_counter() - start
+    del records
+    gc.collect()
+
+    start = time.perf_counter()
+    snapshot = CatalogSnapshot(path)
+    text_index = CatalogIndex(snapshot)
+    image_index = ImageIndex(snapshot, args.embedding_dtype)
+    build_seconds = time.perf_counter() - start
+    gc.collect()
+    memory = rss_mb() - base_rss
+
+    text, pages = [], []
+    for query in text_queries:
+        start = time.perf_counter()
+        products, _ = text_index.search(size=PAGE_SIZE, **query)
+        text.append((time.perf_counter() - start) * 1000)
+        pages.append(products)
+    print(f"  Văn bản: {sum(1 for page in pages if page)}/{len(pages)} truy vấn có kết quả.")
+
+    knn, found = [], 0
+    for query in image_queries:
+        start = time.perf_counter()
+        products = [snapshot[row] for row, _ in image_index.search(query, 1, 0.97)]
+        knn.append((time.perf_counter() - start) * 1000)
+        found += bool(products)
+    print(f"  kNN: {found}/{len(image_queries)} truy vấn ảnh tìm thấy sản phẩm.")
+
+    return {
+        "ingest_seconds": ingest_seconds, "build_seconds": build_seconds,
+        "memory_mb": memory, "snapshot_mb": os.path.getsize(path) / 1024 / 1024,
+        "text": summarize(text), "knn": summarize(knn), "context": measure_context(pages),
+    }
+
+
+def run_es(csv_path, embeddings, text_queries, image_queries, args) -> dict:
+    # Import muộn: module nạp dữ liệu kết nối Elasticsearch ngay khi import
+    import elastic_search_push_data as ingest
+
+    index = f"catalog_bench_{len(embeddings)}"
+    start = time.perf_counter()
+    ingest.create_index_with_embedding_mapping(index)
+    serving = ingest.apply_bulk_load_profile(index)
+    offset = 0
+    for df in iter_catalog_chunks(csv_path, args.chunk_rows):
+        records = dataframe_records(df)
+        vectors = embeddings[offset:offset + len(records)].tolist()
+        _, errors = ingest._bulk_chunk(index, records, vectors, bulk_profile=True)
+        if errors:
+            print(f"  {len(errors)} văn bản lỗi, ví dụ: {errors[0]}")
+        offset += len(records)
+    ingest.restore_serving_profile(index, serving)
+    ingest_seconds = time.perf_counter() - start
+    size = ingest.index_size_report(index)
+
+    session = requests.Session()
+    url = f"{ELASTIC_HOST}/{index}/_search"
+
+    def timed(body):
+        start = time.perf_counter()
+        response = session.post(url, json=body, timeout=30)
+        response.raise_for_status()
+        return (time.perf_counter() - start) * 1000, response.json()
+
+    try:
+        text, pages = [], []
+        for query in text_queries:
+            elapsed, data = timed(build_search_body(size=PAGE_SIZE, **query))
+            text.append(elapsed)
+            pages.append([hit["_source"] for hit in data["hits"]["hits"]])
+        knn = []
+        for query in image_queries:
+            body = {
+                "knn": {"field": "image_embedding", "query_vector": query.tolist(), "k": 1, "num_candidates": 100,
+                        "filter": {"bool": {"must_not": [{"term": {"deleted": True}}]}}},
+                "min_score": 0.97, "size": 1, "_source": SOURCE_PROFILES["image"],
+            }
+            knn.append(timed(body)[0])
+    finally:
+        if not args.keep:
+            ingest.es_client.indices.delete(index=index)
+
+    return {
+        "ingest_seconds": ingest_seconds, "build_seconds": 0.0,
+        "memory_mb": float("nan"), "snapshot_mb": size["store_bytes"] / 1024 / 1024,
+        "text": summarize(text), "knn": summarize(knn), "context": measure_context(pages),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark tìm kiếm trên catalog giả lập lớn dần")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100000, 300000, 1000000])
+    parser.add_argument("--backend", choices=["memory", "es"], default="memory")
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--embedding-dtype", choices=["float32", "int8"], default="float32")
+    parser.add_argument("--queries", type=int, default=300, help="Số truy vấn văn bản và số truy vấn ảnh mỗi kích thước")
+    parser.add_argument("--noise", type=float, default=0.05, help="Nhiễu thêm vào embedding khi tạo truy vấn ảnh")
+    parser.add_argument("--chunk-rows", type=int, default=50000, help="Số dòng mỗi khối khi sinh / đọc catalog")
+    parser.add_argument("--keep", action="store_true", help="Giữ lại index Elasticsearch sau khi đo")
+    parser.add_argument("--workdir", default=None, help="Thư mục lưu catalog sinh ra (mặc định thư mục tạm, xóa khi xong)")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        directory = args.workdir or tempfile.mkdtemp(prefix="catalog_bench_")
+        directory = os.path.join(directory, str(size)) if args.workdir else directory
+        os.makedirs(directory, exist_ok=True)
+        try:
+            start = time.perf_counter()
+            csv_path, embeddings, text_queries = generate_catalog(size, args.dim, directory, chunk_rows=args.chunk_rows)
+            text_queries = (text_queries * (args.queries // max(1, len(text_queries)) + 1))[:args.queries]
+            image_queries = make_image_queries(embeddings, args.queries, args.noise)
+            print(f"Đã sinh {size} sản phẩm trong {time.perf_counter() - start:.1f}s.")
+            runner = run_memory if args.backend == "memory" else run_es
+            extra = (directory,) if args.backend == "memory" else ()
+            result = runner(csv_path, embeddings, text_queries, image_queries, args, *extra)
+            result["size"] = size
+            results.append(result)
+            del embeddings
+        finally:
+            if not args.workdir:
+                shutil.rmtree(directory, ignore_errors=True)
+
+    print(f"\nbackend {args.backend}, {args.dim} chiều ({args.embedding_dtype}), {args.queries} truy vấn mỗi loại; độ trễ ms p50/p95/p99")
+    print(f"{'sản phẩm':>10} {'nạp s':>7} {'dựng s':>7} {'RAM MB':>8} {'file MB':>8} "
+          f"{'văn bản':>22} {'kNN':>22} {'context':>22}")
+    for r in results:
+        cells = [f"{r[k]['p50']:.2f}/{r[k]['p95']:.2f}/{r[k]['p99']:.2f}" for k in ("text", "knn", "context")]
+        print(f"{r['size']:>10} {r['ingest_seconds']:>7.1f} {r['build_seconds']:>7.1f} {r['memory_mb']:>8.0f} "
+              f"{r['snapshot_mb']:>8.0f} {cells[0]:>22} {cells[1]:>22} {cells[2]:>22}")
+
+
+if __name__ == "__main__":
+    main()
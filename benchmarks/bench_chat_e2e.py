@@ -0,0 +1,374 @@
+"""
+Benchmark đầu-cuối của /chat không cần Gemini hay Elasticsearch: LLM và tìm kiếm được thay bằng
+backend giả (benchmarks.fake_backends) có độ trễ ngẫu nhiên cấu hình được, rồi nhiều hội thoại
+theo kịch bản chạy đồng thời qua ứng dụng FastAPI (gọi ASGI trực tiếp trong tiến trình).
+
+Mỗi hội thoại: hỏi sản phẩm -> xem thêm -> đặt mua -> xác nhận -> gửi tên, SĐT, địa chỉ.
+Báo cáo:
+- thông lượng (lượt chat/s, hội thoại/s) và độ trễ p50/p95/p99 của từng bước kịch bản;
+- p50/p95/p99 theo từng giai đoạn (intent, filter, evaluation, generation, ..., search): thời gian
+  chạy và thời gian chờ luồng trống của asyncio.to_thread;
+- tranh chấp khóa (chat_history_lock, bot_state_lock, khóa của health_service...): số lần phải chờ, tổng thời gian chờ.
+Dùng làm mốc so sánh trước / sau mỗi thay đổi hiệu năng (--json ghi kết quả ra file).
+
+Chạy từ thư mục gốc của project:
+    python -m benchmarks.bench_chat_e2e --sessions 200 --concurrency 50
+    python -m benchmarks.bench_chat_e2e --llm-ms 800 --llm-sigma 0.5 --llm-error-rate 0.02 --search-ms 30
+    python -m benchmarks.bench_chat_e2e --search memory --catalog-size 20000 --json cache/bench_chat_e2e.json
+"""
+import os
+
+# settings.py cần khóa Gemini lúc import; backend giả không dùng đến
+os.environ.setdefault("GEMINI_API_KEY", '["bench"]')
+
+import argparse
+import asyncio
+import contextlib
+import json
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List
+from urllib.parse import urlencode
+
+from src.main import app
+from src import main
+from src.api import routes
+from src.services import health_service, prefetch_service, search_service
+from src.utils import turn_context
+from src.utils.logging_setup import flush_logs
+from benchmarks.fake_backends import (
+    FakeGeminiModel, FakeSearch, LatencyModel, generate_products, install_fake_llm,
+    install_memory_search, make_intent, register_intent,
+)
+
+STEPS = ["browse", "more", "purchase", "confirm", "customer_info"]
+
+# Thời gian theo giai đoạn: tên -> danh sách giây
+_run_times: Dict[str, List[float]] = defaultdict(list)
+_wait_times: Dict[str, List[float]] = defaultdict(list)
+_times_lock = threading.Lock()
+
+# Tên hàm chạy qua asyncio.to_thread -> tên giai đoạn trong báo cáo
+STAGE_NAMES = {
+    "analyze_intent_and_extract_entities": "intent",
+    "filter_products_with_ai": "filter",
+    "evaluate_and_choose_product": "evaluation",
+    "evaluate_purchase_confirmation": "confirmation",
+    "extract_customer_info": "customer_info",
+    "generate_llm_response": "generation",
+    "get_image_embedding": "image_embedding",
+}
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def _record(stage: str, run: float, wait: float = None):
+    with _times_lock:
+        _run_times[stage].append(run)
+        if wait is not None:
+            _wait_times[stage].append(wait)
+
+
+class ContentionLock:
+    """
+    Thay threading.Lock để đo tranh chấp: thử lấy khóa không chờ trước, chỉ khi khóa đang bị giữ
+    mới tính là một lần tranh chấp và cộng thời gian chờ.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.acquires = 0
+        self.contended = 0
+        self.wait_seconds = 0.0
+        self.max_wait = 0.0
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        if self._lock.acquire(False):
+            with self._stats_lock:
+                self.acquires += 1
+            return True
+        if not blocking:
+            return False
+        start = time.perf_counter()
+        acquired = self._lock.acquire(True, timeout)
+        waited = time.perf_counter() - start
+        with self._stats_lock:
+            self.contended += 1
+            self.wait_seconds += waited
+            self.max_wait = max(self.max_wait, waited)
+            if acquired:
+                self.acquires += 1
+        return acquired
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def install_instrumentation() -> List[ContentionLock]:
+    """Đo asyncio.to_thread theo giai đoạn và thay các khóa dùng chung bằng ContentionLock."""
+    original_to_thread = asyncio.to_thread
+
+    async def timed_to_thread(func, *args, **kwargs):
+        stage = STAGE_NAMES.get(getattr(func, "__name__", ""), getattr(func, "__name__", "other"))
+        submitted = time.perf_counter()
+
+        def run():
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _record(stage, time.perf_counter() - started, started - submitted)
+
+        return await original_to_thread(run)
+
+    asyncio.to_thread = timed_to_thread
+
+    def timed_search(search):
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await search(*args, **kwargs)
+            finally:
+                _record("search", time.perf_counter() - start)
+        return wrapper
+
+    routes.search_products = timed_search(routes.search_products)
+    prefetch_service.search_products = timed_search(prefetch_service.search_products)
+
+    locks = []
+    for name, module, attribute in [
+        ("chat_history_lock", routes, "chat_history_lock"),
+        ("bot_state_lock", routes, "bot_state_lock"),
+        ("health_service", health_service, "_lock"),
+        ("search_stats", search_service, "_stats_lock"),
+        ("turn_stats", turn_context, "_stats_lock"),
+    ]:
+        lock = ContentionLock(name)
+        setattr(module, attribute, lock)
+        if attribute == "chat_history_lock":
+            main.chat_history_lock = lock
+        locks.append(lock)
+    return locks
+
+
+def build_script(session: int, products: List[Dict]) -> List[tuple]:
+    """Năm lượt của một hội thoại; ý định của từng câu được đăng ký cho LLM giả."""
+    product = products[(session * 7) % len(products)]
+    item = {"product_name": product["product_name"], "category": product["category"], "properties": "", "quantity": 1}
+    messages = [
+        ("browse", f"shop có {product['product_name']} không", make_intent([item])),
+        ("more", "còn mẫu nào khác không", make_intent([item])),
+        ("purchase", f"lấy cho anh 1 cái {product['product_name']}", make_intent([item], is_purchase_intent=True)),
+        ("confirm", "ok chốt đơn cho anh", make_intent()),
+        ("customer_info", f"Nguyễn Văn {session}, 09{session:08d}, số {session} ngõ 117 Thái Hà, Hà Nội", make_intent()),
+    ]
+    for _, message, intent in messages:
+        register_intent(message, intent)
+    return [(step, message) for step, message, _ in messages]
+
+
+async def post_chat(session_id: str, message: str):
+    """Gọi POST /chat trực tiếp qua giao diện ASGI của app (không qua mạng). Trả về (mã HTTP, JSON)."""
+    body = json.dumps({"message": message}).encode("utf-8")
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/chat", "raw_path": b"/chat", "root_path": "",
+        "query_string": urlencode({"session_id": session_id}).encode(),
+        "headers": [(b"host", b"bench"), (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 0), "server": ("bench", 80),
+    }
+    done = asyncio.Event()
+    sent_body = False
+    status, chunks = None, []
+
+    async def receive():
+        nonlocal sent_body
+        if not sent_body:
+            sent_body = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        # Client không ngắt kết nối cho tới khi nhận xong câu trả lời
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                done.set()
+
+    await app(scope, receive, send)
+    raw = b"".join(chunks)
+    return status, json.loads(raw) if raw else None
+
+
+async def run_conversation(session: int, script: List[tuple], turn_times: Dict[str, List[float]], outcome: Dict, think_ms: float):
+    session_id = f"bench-{session}"
+    for step, message in script:
+        start = time.perf_counter()
+        status, response = await post_chat(session_id, message)
+        turn_times[step].append(time.perf_counter() - start)
+        if status != 200:
+            outcome["http_errors"] += 1
+            return
+        if step == "customer_info" and response.get("customer_info"):
+            outcome["orders"] += 1
+        if think_ms:
+            await asyncio.sleep(think_ms / 1000)
+    outcome["completed"] += 1
+
+
+async def run_benchmark(args, products: List[Dict]) -> Dict:
+    scripts = [build_script(session, products) for session in range(args.sessions)]
+    turn_times: Dict[str, List[float]] = defaultdict(list)
+    outcome = {"completed": 0, "orders": 0, "http_errors": 0}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited(session):
+        async with semaphore:
+            await run_conversation(session, scripts[session], turn_times, outcome, args.think_ms)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(limited(session) for session in range(args.sessions)))
+    elapsed = time.perf_counter() - start
+    turns = sum(len(values) for values in turn_times.values())
+    return {
+        "elapsed_seconds": elapsed,
+        "turns": turns,
+        "turns_per_second": turns / elapsed if elapsed else 0.0,
+        "conversations_per_second": outcome["completed"] / elapsed if elapsed else 0.0,
+        **outcome,
+        "turn_times": turn_times,
+    }
+
+
+def summarize(values: List[float]) -> Dict:
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "p50_ms": percentile(values, 0.50) * 1000,
+        "p95_ms": percentile(values, 0.95) * 1000,
+        "p99_ms": percentile(values, 0.99) * 1000,
+        "max_ms": max(values) * 1000,
+    }
+
+
+def print_table(title: str, rows: Dict[str, Dict]):
+    print(f"\n{title}")
+    print(f"{'':<16} {'số lần':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, stats in rows.items():
+        if stats.get("count"):
+            print(f"{name:<16} {stats['count']:>7} {stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f} {stats['max_ms']:>9.1f}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark đầu-cuối /chat với LLM và tìm kiếm giả.")
+    parser.add_argument("--sessions", type=int, default=200, help="Số hội thoại theo kịch bản")
+    parser.add_argument("--concurrency", type=int, default=50, help="Số hội thoại chạy đồng thời")
+    parser.add_argument("--think-ms", type=float, default=0, help="Thời gian khách đọc câu trả lời giữa hai lượt")
+    parser.add_argument("--llm-ms", type=float, default=600, help="Trung vị độ trễ LLM mặc định (ms)")
+    parser.add_argument("--llm-sigma", type=float, default=0.35, help="Độ phân tán log-normal của độ trễ LLM")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Tỉ lệ lệnh gọi LLM bị lỗi")
+    parser.add_argument("--intent-ms", type=float, help="Trung vị riêng cho prompt phân tích ý định (mặc định --llm-ms)")
+    parser.add_argument("--filter-ms", type=float, help="Trung vị riêng cho prompt lọc sản phẩm")
+    parser.add_argument("--evaluate-ms", type=float, help="Trung vị riêng cho prompt đánh giá / xác nhận / bóc tách")
+    parser.add_argument("--generation-ms", type=float, help="Trung vị riêng cho prompt sinh câu trả lời")
+    parser.add_argument("--search", choices=["fake", "memory"], default="fake",
+                        help="fake: tìm kiếm giả có độ trễ; memory: chỉ mục trong bộ nhớ thật trên catalog giả")
+    parser.add_argument("--search-ms", type=float, default=25, help="Trung vị độ trễ tìm kiếm giả (ms)")
+    parser.add_argument("--search-error-rate", type=float, default=0.0)
+    parser.add_argument("--catalog-size", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="Giữ log của ứng dụng (mặc định bị ẩn khi chạy)")
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON để so sánh giữa các lần chạy")
+    args = parser.parse_args()
+
+    def latency(median, error_rate=args.llm_error_rate, seed_offset=0):
+        return LatencyModel(args.llm_ms if median is None else median, args.llm_sigma, error_rate, args.seed + seed_offset)
+
+    evaluate = latency(args.evaluate_ms, seed_offset=3)
+    model = FakeGeminiModel(
+        {
+            "intent": latency(args.intent_ms, seed_offset=1),
+            "filter": latency(args.filter_ms, seed_offset=2),
+            "evaluate": evaluate, "confirm": evaluate, "customer_info": evaluate,
+            "generation": latency(args.generation_ms, seed_offset=4),
+        },
+        latency(None, seed_offset=5),
+    )
+    install_fake_llm(model)
+    products = generate_products(args.catalog_size, args.seed)
+    fake_search = None
+    if args.search == "fake":
+        fake_search = FakeSearch(products, LatencyModel(args.search_ms, 0.5, args.search_error_rate, args.seed + 6))
+        fake_search.install()
+    else:
+        install_memory_search(products)
+    locks = install_instrumentation()
+
+    print(f"{args.sessions} hội thoại x {len(STEPS)} lượt, {args.concurrency} đồng thời, LLM ~{args.llm_ms:.0f}ms, "
+          f"tìm kiếm {args.search}" + (f" ~{args.search_ms:.0f}ms" if args.search == "fake" else f" ({len(products)} sản phẩm)")
+          + f", pool luồng mặc định {min(32, (os.cpu_count() or 1) + 4)} luồng")
+    output = sys.stdout if args.verbose else open(os.devnull, "w")
+    with contextlib.redirect_stdout(output):
+        result = asyncio.run(run_benchmark(args, products))
+        flush_logs()
+
+    print(f"\nXong trong {result['elapsed_seconds']:.2f}s: {result['turns']} lượt ({result['turns_per_second']:.1f} lượt/s), "
+          f"{result['completed']} hội thoại ({result['conversations_per_second']:.2f}/s), "
+          f"{result['orders']} đơn hàng, {result['http_errors']} lỗi HTTP.")
+    steps = {step: summarize(result["turn_times"].get(step, [])) for step in STEPS}
+    stages = {stage: summarize(values) for stage, values in sorted(_run_times.items())}
+    waits = {stage: summarize(values) for stage, values in sorted(_wait_times.items())}
+    print_table("Độ trễ theo bước kịch bản (cả lượt chat):", steps)
+    print_table("Thời gian chạy theo giai đoạn:", stages)
+    print_table("Thời gian chờ luồng trống (asyncio.to_thread):", waits)
+
+    print(f"\n{'khóa':<20} {'lần lấy':>9} {'phải chờ':>9} {'tổng chờ ms':>12} {'max chờ ms':>11}")
+    lock_rows = {}
+    for lock in locks:
+        lock_rows[lock.name] = {"acquires": lock.acquires, "contended": lock.contended,
+                                "wait_ms": lock.wait_seconds * 1000, "max_wait_ms": lock.max_wait * 1000}
+        print(f"{lock.name:<20} {lock.acquires:>9} {lock.contended:>9} {lock.wait_seconds * 1000:>12.2f} {lock.max_wait * 1000:>11.2f}")
+
+    llm_calls = dict(model.calls)
+    print(f"\nLệnh gọi LLM giả: {llm_calls}, lỗi: {dict(model.errors)}")
+    if fake_search:
+        print(f"Truy vấn tìm kiếm giả: {fake_search.calls}, lỗi: {fake_search.errors}")
+    health = health_service.get_health_stats()
+    print(f"Degraded: {health.get('degraded')}, số lượt degraded: {health.get('degraded_turns')}")
+
+    if args.json:
+        report = {
+            "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config": {key: value for key, value in vars(args).items() if key != "json"},
+            **{key: value for key, value in result.items() if key != "turn_times"},
+            "steps": steps, "stages": stages, "thread_wait": waits, "locks": lock_rows,
+            "llm_calls": llm_calls, "degraded_turns": health.get("degraded_turns"),
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Đã ghi kết quả vào {args.json}")
+
+
+if __name__ == "__main__":
+    main_cli()
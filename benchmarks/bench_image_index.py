@@ -0,0 +1,103 @@
+"""
+Đo recall và độ trễ của chỉ mục ảnh trong bộ nhớ (IMAGE_SEARCH_BACKEND=local) với các cấu hình
+float32 / int8 / IVF, so với kết quả quét toàn bộ float32 (chuẩn) và với kNN của Elasticsearch.
+
+Truy vấn là embedding của chính các sản phẩm trong snapshot, cộng nhiễu nhỏ (giống ảnh khách
+chụp lại sản phẩm). Chạy từ thư mục gốc của project, cần snapshot catalog có embedding:
+    python -m benchmarks.bench_image_index --queries 200 --top-k 5 --nlist 256
+Thêm --with-es để đo cả kNN của Elasticsearch (cần Elasticsearch đã có dữ liệu).
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+import requests
+
+from src.services.image_index import ImageIndex
+from src.services.search_service import ELASTIC_HOST, INDEX_NAME
+from src.utils.catalog_snapshot import open_current_snapshot
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def make_queries(index: ImageIndex, count: int, noise: float, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(index.valid_rows, min(count, len(index.valid_rows)), replace=False)
+    vectors = index.matrix[rows].astype(np.float32)
+    if index.snapshot.embedding_scales is not None:
+        vectors *= index.snapshot.embedding_scales[rows, None]
+    scale = np.linalg.norm(vectors, axis=1, keepdims=True) / np.sqrt(vectors.shape[1])
+    return vectors + rng.normal(0, noise, vectors.shape).astype(np.float32) * scale
+
+
+def run_local(name: str, index: ImageIndex, queries: np.ndarray, truth: list, top_k: int) -> dict:
+    latencies, recalls = [], []
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        hits = index.search(query, top_k)
+        latencies.append((time.perf_counter() - start) * 1e6)
+        recalls.append(len({row for row, _ in hits} & expected) / len(expected))
+    start = time.perf_counter()
+    index.search_batch(queries, top_k)
+    batch_us = (time.perf_counter() - start) * 1e6 / len(queries)
+    return {"name": name, "recall": statistics.mean(recalls), "p50": percentile(latencies, 0.5),
+            "p99": percentile(latencies, 0.99), "batch": batch_us}
+
+
+def run_es(index: ImageIndex, queries: np.ndarray, truth: list, top_k: int) -> dict:
+    codes = [index.snapshot.string("product_code", row) for row in range(len(index.snapshot))]
+    latencies, recalls = [], []
+    for query, expected in zip(queries, truth):
+        body = {"knn": {"field": "image_embedding", "query_vector": query.tolist(), "k": top_k, "num_candidates": 100},
+                "size": top_k, "_source": ["product_code"]}
+        start = time.perf_counter()
+        response = requests.post(f"{ELASTIC_HOST}/{INDEX_NAME}/_search", json=body, timeout=30)
+        latencies.append((time.perf_counter() - start) * 1e6)
+        response.raise_for_status()
+        found = {str(hit["_source"].get("product_code")) for hit in response.json()["hits"]["hits"]}
+        recalls.append(len(found & {codes[row] for row in expected}) / len(expected))
+    return {"name": "elasticsearch", "recall": statistics.mean(recalls), "p50": percentile(latencies, 0.5),
+            "p99": percentile(latencies, 0.99), "batch": float("nan")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark chỉ mục ảnh trong bộ nhớ")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--noise", type=float, default=0.05, help="Độ lệch chuẩn nhiễu tương đối thêm vào truy vấn")
+    parser.add_argument("--nlist", type=int, default=0, help="Số cụm IVF (0 = bỏ qua cấu hình IVF)")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16])
+    parser.add_argument("--with-es", action="store_true", help="Đo cả kNN của Elasticsearch")
+    args = parser.parse_args()
+
+    snapshot = open_current_snapshot()
+    if snapshot is None or snapshot.embeddings is None:
+        raise SystemExit("Chưa có snapshot catalog chứa embedding (chạy elastic_search_push_data.py trước).")
+
+    exact = ImageIndex(snapshot, "float32")
+    queries = make_queries(exact, args.queries, args.noise)
+    truth = [{row for row, _ in hits} for hits in exact.search_batch(queries, args.top_k)]
+
+    results = [run_local("float32", exact, queries, truth, args.top_k)]
+    results.append(run_local("int8", ImageIndex(snapshot, "int8"), queries, truth, args.top_k))
+    if args.nlist:
+        for dtype in ("float32", "int8"):
+            ivf = ImageIndex(snapshot, dtype, nlist=args.nlist)
+            for nprobe in args.nprobe:
+                ivf.nprobe = nprobe
+                results.append(run_local(f"{dtype} ivf{args.nlist}/{nprobe}", ivf, queries, truth, args.top_k))
+    if args.with_es:
+        results.append(run_es(exact, queries, truth, args.top_k))
+
+    print(f"{len(exact.valid_rows)} ảnh, {exact.matrix.shape[1]} chiều, {len(queries)} truy vấn, top-{args.top_k}")
+    print(f"{'cấu hình':<22} {'recall':>7} {'p50 µs':>10} {'p99 µs':>10} {'batch µs/q':>11}")
+    for r in results:
+        print(f"{r['name']:<22} {r['recall']:>7.1%} {r['p50']:>10.0f} {r['p99']:>10.0f} {r['batch']:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
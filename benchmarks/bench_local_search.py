@@ -0,0 +1,106 @@
+"""
+Kiểm tra độ tương đồng kết quả (parity) và so sánh độ trễ giữa chỉ mục tìm kiếm
+trong bộ nhớ (SEARCH_BACKEND=memory) và Elasticsearch, trên cùng file catalog.
+
+Chạy từ thư mục gốc của project (cần Elasticsearch đã nạp đúng file catalog này):
+    python -m benchmarks.bench_local_search --catalog dulieu_1208.xlsx --repeat 20
+Chỉ đo chỉ mục trong bộ nhớ, không cần Elasticsearch:
+    python -m benchmarks.bench_local_search --local-only
+
+Trả về mã lỗi 1 nếu độ trùng khớp top-k trung bình thấp hơn --min-overlap.
+"""
+import argparse
+import statistics
+import sys
+import time
+
+import requests
+
+from src.config.settings import PAGE_SIZE
+from src.services.local_search import load_catalog_index
+from src.services.search_service import ELASTIC_HOST, INDEX_NAME, build_search_body
+from benchmarks.bench_source_profiles import SAMPLE_QUERIES
+
+# Mỗi truy vấn mẫu chạy ở cả chế độ thường và chế độ strict của "xem thêm"
+VARIANTS = [
+    {},
+    {"strict_category": True},
+    {"strict_category": True, "strict_properties": True},
+]
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def local_codes(index, query: dict, variant: dict) -> list:
+    products, _ = index.search(size=PAGE_SIZE, **query, **variant)
+    return [str(p.get("product_code")) for p in products]
+
+
+def es_codes(query: dict, variant: dict) -> list:
+    body = build_search_body(size=PAGE_SIZE, source_profile="detail", **query, **variant)
+    response = requests.post(f"{ELASTIC_HOST}/{INDEX_NAME}/_search", json=body, timeout=30)
+    response.raise_for_status()
+    return [str(hit["_source"].get("product_code")) for hit in response.json()["hits"]["hits"]]
+
+
+def check_parity(index) -> float:
+    overlaps = []
+    print(f"{'truy vấn':<40} {'biến thể':<28} {'top1':>5} {'overlap':>8}")
+    for query in SAMPLE_QUERIES:
+        for variant in VARIANTS:
+            local = local_codes(index, query, variant)
+            remote = es_codes(query, variant)
+            if not local and not remote:
+                overlap = 1.0
+            else:
+                overlap = len(set(local) & set(remote)) / max(len(local), len(remote))
+            top1 = bool(local and remote and local[0] == remote[0]) or (not local and not remote)
+            overlaps.append(overlap)
+            label = ", ".join(f"{k}={v}" for k, v in query.items())
+            flags = ",".join(k.replace("strict_", "") for k in variant) or "-"
+            print(f"{label[:40]:<40} {flags:<28} {'ok' if top1 else 'x':>5} {overlap:>8.0%}")
+    return statistics.mean(overlaps)
+
+
+def measure(fn, repeat: int) -> dict:
+    times = []
+    for _ in range(repeat):
+        for query in SAMPLE_QUERIES:
+            for variant in VARIANTS:
+                start = time.perf_counter()
+                fn(query, variant)
+                times.append((time.perf_counter() - start) * 1000)
+    return {"p50": percentile(times, 0.5), "p95": percentile(times, 0.95), "p99": percentile(times, 0.99)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parity và benchmark chỉ mục tìm kiếm trong bộ nhớ")
+    parser.add_argument("--catalog", default=None, help="File catalog xlsx (mặc định LOCAL_CATALOG_PATH)")
+    parser.add_argument("--repeat", type=int, default=10, help="Số lần lặp lại bộ truy vấn mẫu")
+    parser.add_argument("--min-overlap", type=float, default=0.8, help="Ngưỡng trùng khớp top-k trung bình")
+    parser.add_argument("--local-only", action="store_true", help="Chỉ đo chỉ mục trong bộ nhớ")
+    args = parser.parse_args()
+
+    index = load_catalog_index(args.catalog)
+
+    results = {"memory": measure(lambda q, v: local_codes(index, q, v), args.repeat)}
+    mean_overlap = None
+    if not args.local_only:
+        mean_overlap = check_parity(index)
+        results["elasticsearch"] = measure(es_codes, args.repeat)
+
+    print(f"\n{'backend':<14} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, r in results.items():
+        print(f"{name:<14} {r['p50']:>9.3f} {r['p95']:>9.3f} {r['p99']:>9.3f}")
+
+    if mean_overlap is not None:
+        print(f"\nTrùng khớp top-{PAGE_SIZE} trung bình: {mean_overlap:.1%} (ngưỡng {args.min_overlap:.0%})")
+        if mean_overlap < args.min_overlap:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+So sánh kích thước phản hồi và thời gian decode JSON của các source profile
+trong search_service với việc lấy toàn bộ _source (kể cả image_embedding).
+
+Chạy từ thư mục gốc của project (cần Elasticsearch đã có dữ liệu):
+    python -m benchmarks.bench_source_profiles --repeat 20
+"""
+import argparse
+import json
+import statistics
+import time
+
+import requests
+
+from src.config.settings import PAGE_SIZE
+from src.services.search_service import ELASTIC_HOST, INDEX_NAME, SOURCE_PROFILES, build_search_body
+
+SAMPLE_QUERIES = [
+    {"product_name": "máy hàn", "category": "máy hàn"},
+    {"product_name": "kính hiển vi", "category": "kính hiển vi"},
+    {"product_name": "máy khò", "category": "máy khò", "properties": "8512P"},
+    {"product_name": "tô vít", "category": "tô vít"},
+    {"product_name": "đèn kính hiển vi", "category": "đèn"},
+]
+
+
+def run_profile(profile: str, repeat: int) -> dict:
+    sizes, decode_times, total_times = [], [], []
+    for _ in range(repeat):
+        for query in SAMPLE_QUERIES:
+            if profile == "full":
+                body = build_search_body(size=PAGE_SIZE, **query)
+                body.pop("_source")
+            else:
+                body = build_search_body(size=PAGE_SIZE, source_profile=profile, **query)
+
+            start = time.perf_counter()
+            response = requests.post(f"{ELASTIC_HOST}/{INDEX_NAME}/_search", json=body, timeout=30)
+            response.raise_for_status()
+            raw = response.content
+            decode_start = time.perf_counter()
+            json.loads(raw)
+            end = time.perf_counter()
+
+            sizes.append(len(raw))
+            decode_times.append((end - decode_start) * 1000)
+            total_times.append((end - start) * 1000)
+
+    return {
+        "profile": profile,
+        "avg_bytes": statistics.mean(sizes),
+        "avg_decode_ms": statistics.mean(decode_times),
+        "p50_total_ms": statistics.median(total_times),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark source projection profiles")
+    parser.add_argument("--repeat", type=int, default=10, help="Số lần lặp lại bộ truy vấn mẫu")
+    args = parser.parse_args()
+
+    results = [run_profile("full", args.repeat)]
+    results += [run_profile(profile, args.repeat) for profile in SOURCE_PROFILES]
+
+    baseline = results[0]["avg_bytes"] or 1
+    print(f"{'profile':<10} {'bytes/resp':>12} {'% full':>8} {'decode ms':>10} {'p50 ms':>8}")
+    for r in results:
+        print(f"{r['profile']:<10} {r['avg_bytes']:>12.0f} {r['avg_bytes'] / baseline:>8.1%} {r['avg_decode_ms']:>10.3f} {r['p50_total_ms']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Kiểm tra thứ hạng của chỉ mục trong bộ nhớ (SEARCH_BACKEND=memory) khớp với Elasticsearch
+trên một bộ truy vấn cố định: với mỗi truy vấn và mỗi biến thể strict, top-N mã sản phẩm
+của hai backend phải giống nhau và cùng thứ tự.
+
+Chạy từ thư mục gốc của project (cần Elasticsearch đã nạp đúng file catalog này):
+    python -m benchmarks.check_search_parity --catalog dulieu_1208.xlsx --top 3
+
+In các truy vấn lệch thứ hạng và trả về mã lỗi 1 nếu có ít nhất một truy vấn lệch.
+"""
+import argparse
+import sys
+
+from src.services.local_search import load_catalog_index
+from benchmarks.bench_local_search import VARIANTS, es_codes, local_codes
+from benchmarks.bench_source_profiles import SAMPLE_QUERIES
+
+# Bộ truy vấn cố định: truy vấn mẫu của benchmark cộng các dạng chỉ có tên, chỉ có danh mục,
+# có thuộc tính và truy vấn không khớp sản phẩm nào
+PARITY_QUERIES = SAMPLE_QUERIES + [
+    {"product_name": "mỏ hàn"},
+    {"product_name": "thiếc hàn"},
+    {"product_name": "nhíp"},
+    {"category": "máy khò"},
+    {"product_name": "máy hàn", "properties": "936"},
+    {"product_name": "tủ lạnh"},
+]
+
+
+def check(index, top: int) -> list:
+    """Trả về danh sách (truy vấn, biến thể, top local, top ES) của các trường hợp lệch thứ hạng."""
+    mismatches = []
+    for query in PARITY_QUERIES:
+        for variant in VARIANTS:
+            local = local_codes(index, query, variant)[:top]
+            remote = es_codes(query, variant)[:top]
+            if local != remote:
+                mismatches.append((query, variant, local, remote))
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kiểm tra thứ hạng chỉ mục trong bộ nhớ khớp Elasticsearch")
+    parser.add_argument("--catalog", default=None, help="File catalog xlsx (mặc định LOCAL_CATALOG_PATH)")
+    parser.add_argument("--top", type=int, default=3, help="Số kết quả đầu phải trùng thứ tự")
+    args = parser.parse_args()
+
+    index = load_catalog_index(args.catalog)
+    mismatches = check(index, args.top)
+    total = len(PARITY_QUERIES) * len(VARIANTS)
+
+    for query, variant, local, remote in mismatches:
+        label = ", ".join(f"{k}={v}" for k, v in query.items())
+        flags = ",".join(k.replace("strict_", "") for k in variant) or "-"
+        print(f"LỆCH  {label} [{flags}]\n      memory: {local}\n      es:     {remote}")
+    print(f"{total - len(mismatches)}/{total} truy vấn khớp thứ hạng top-{args.top}.")
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Dịch vụ embedding ảnh giả lập, cùng giao diện với dịch vụ thật:
+    POST /embed        form image_url=...             -> {"embedding": [...]}
+    POST /embed_batch  JSON {"image_urls": [...]}     -> {"embeddings": [...]}
+
+Vector là ngẫu nhiên nhưng cố định theo URL (cùng URL luôn ra cùng vector), đã chuẩn hóa.
+Dùng để đo thông lượng của client embedding / script nạp dữ liệu mà không cần GPU:
+    python -m benchmarks.embed_stub_server --port 8100 --latency-ms 50
+    EMBED_API_URL=http://localhost:8100/embed EMBED_API_BATCH_URL=http://localhost:8100/embed_batch python elastic_search_push_data.py
+"""
+import argparse
+import asyncio
+import hashlib
+import random
+from typing import List
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Form
+from pydantic import BaseModel
+
+app = FastAPI(title="Embed stub")
+settings = {"dim": 512, "latency_ms": 0.0, "error_rate": 0.0}
+
+
+class BatchRequest(BaseModel):
+    image_urls: List[str]
+
+
+def fake_embedding(image_url: str) -> List[float]:
+    seed = int.from_bytes(hashlib.sha256(image_url.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(settings["dim"]).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+async def _simulate_work(images: int):
+    # Độ trễ cố định mỗi request cộng phần nhỏ theo số ảnh, giống một model chạy theo lô
+    if settings["latency_ms"]:
+        await asyncio.sleep(settings["latency_ms"] * (1 + 0.1 * (images - 1)) / 1000)
+
+
+@app.post("/embed")
+async def embed(image_url: str = Form(...)):
+    await _simulate_work(1)
+    if random.random() < settings["error_rate"]:
+        return {"error": "Không xử lý được ảnh (giả lập)"}
+    return {"embedding": fake_embedding(image_url)}
+
+
+@app.post("/embed_batch")
+async def embed_batch(request: BatchRequest):
+    await _simulate_work(len(request.image_urls))
+    return {"embeddings": [
+        None if random.random() < settings["error_rate"] else fake_embedding(url) for url in request.image_urls
+    ]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dịch vụ embedding ảnh giả lập")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Độ trễ giả lập cho mỗi request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Tỉ lệ ảnh trả về lỗi")
+    args = parser.parse_args()
+    settings.update(dim=args.dim, latency_ms=args.latency_ms, error_rate=args.error_rate)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
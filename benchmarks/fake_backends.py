@@ -0,0 +1,247 @@
+"""
+Backend giả cho benchmark đầu-cuối: mô hình Gemini giả (độ trễ ngẫu nhiên theo phân phối log-normal,
+trả JSON dựng sẵn theo từng loại prompt) và tìm kiếm sản phẩm giả trên catalog sinh ngẫu nhiên.
+Không cần khóa API, mạng hay Elasticsearch.
+
+Cài vào ứng dụng bằng install_fake_llm(...) và FakeSearch(...).install(); các hàm gốc được thay
+trực tiếp trên module đã import chúng (routes, prefetch_service, intent_service, response_service).
+"""
+import asyncio
+import json
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from src.config.settings import PAGE_SIZE
+from src.services import intent_service, response_service, llm_service, prefetch_service, search_service, local_search
+from src.services.search_service import SearchHits, SOURCE_PROFILES
+from src.api import routes
+from benchmarks.bench_catalog_scale import FAMILIES, PROPERTY_VALUES, SPEC_SENTENCES
+
+# Câu trả lời tư vấn dựng sẵn (độ dài gần với câu trả lời thật)
+CANNED_ANSWER = (
+    "Dạ, bên em hiện có các mẫu anh/chị tham khảo ạ. Sản phẩm chính hãng, bảo hành đầy đủ, "
+    "anh/chị cần em tư vấn thêm về thông số hay đặt hàng thì báo em nhé ạ. /-heart"
+)
+
+# Ý định dựng sẵn theo đúng câu của khách, do kịch bản benchmark đăng ký trước khi chạy
+SCRIPTED_INTENTS: Dict[str, Dict] = {}
+
+_INTENT_QUERY = re.compile(r'Câu hỏi mới nhất của khách hàng: "(.*)"\s*$', re.MULTILINE)
+_CUSTOMER_TEXT = re.compile(r'Văn bản: "(.*)"')
+
+
+def register_intent(query: str, intent: Dict):
+    SCRIPTED_INTENTS[query] = intent
+
+
+def make_intent(products: Optional[List[Dict]] = None, **flags) -> Dict:
+    """Kết quả phân tích ý định đủ các trường như LLM thật trả về; `flags` ghi đè cờ mặc định."""
+    intent = {
+        "needs_search": bool(products),
+        "is_purchase_intent": False,
+        "is_add_to_order_intent": False,
+        "wants_images": False,
+        "wants_specs": False,
+        "wants_human_agent": False,
+        "wants_store_info": False,
+        "wants_warranty_service": False,
+        "is_negative": False,
+        "is_bank_transfer": False,
+        "human_handover_required": False,
+        "search_params": {"products": products or []},
+    }
+    intent.update(flags)
+    return intent
+
+
+class LatencyModel:
+    """Độ trễ log-normal quanh trung vị `median_ms` (độ phân tán `sigma`) và tỉ lệ lỗi `error_rate`."""
+
+    def __init__(self, median_ms: float, sigma: float = 0.35, error_rate: float = 0.0, seed: Optional[int] = None):
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+    def sample(self):
+        """(độ trễ tính bằng giây, có lỗi hay không)."""
+        if self.median_ms <= 0:
+            return 0.0, False
+        with self._lock:
+            latency = self.median_ms * float(np.exp(self._rng.normal(0.0, self.sigma))) / 1000
+            failed = self.error_rate > 0 and float(self._rng.random()) < self.error_rate
+        return latency, failed
+
+
+class FakeGeminiResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeGeminiModel:
+    """
+    Thay genai.GenerativeModel: nhận biết loại prompt qua câu mở đầu của nó, ngủ (chặn luồng như
+    lệnh gọi HTTP thật) theo LatencyModel của loại đó rồi trả JSON / văn bản dựng sẵn.
+    """
+
+    # (loại prompt, đoạn văn bản nhận diện), xét theo thứ tự
+    PROMPT_KINDS = [
+        ("intent", "AI phân tích truy vấn"),
+        ("customer_info", "bóc tách thông tin"),
+        ("evaluate", "chuyên phân tích và chọn lựa sản phẩm"),
+        ("confirm", "XÁC NHẬN"),
+        ("filter", "chuyên gia bán hàng thông thái"),
+    ]
+
+    def __init__(self, latencies: Dict[str, LatencyModel], default_latency: LatencyModel, filter_keep: int = 5):
+        self.latencies = latencies
+        self.default_latency = default_latency
+        self.filter_keep = filter_keep
+        self.calls = defaultdict(int)
+        self.errors = defaultdict(int)
+
+    def classify(self, prompt: str) -> str:
+        for kind, marker in self.PROMPT_KINDS:
+            if marker in prompt:
+                return kind
+        return "generation"
+
+    def generate_content(self, prompt, **kwargs) -> FakeGeminiResponse:
+        kind = self.classify(prompt)
+        latency, failed = self.latencies.get(kind, self.default_latency).sample()
+        self.calls[kind] += 1
+        time.sleep(latency)
+        if failed:
+            self.errors[kind] += 1
+            raise RuntimeError(f"Lỗi giả lập của LLM ({kind})")
+        return FakeGeminiResponse(self._respond(kind, prompt))
+
+    def _respond(self, kind: str, prompt: str) -> str:
+        if kind == "intent":
+            match = _INTENT_QUERY.search(prompt)
+            query = match.group(1) if match else ""
+            intent = SCRIPTED_INTENTS.get(query) or intent_service.analyze_intent_locally(query)
+            return json.dumps(intent, ensure_ascii=False)
+        if kind == "customer_info":
+            # Kịch bản gửi "tên, số điện thoại, địa chỉ"
+            match = _CUSTOMER_TEXT.search(prompt)
+            parts = [part.strip() for part in (match.group(1) if match else "").split(",", 2)]
+            parts += [None] * (3 - len(parts))
+            return json.dumps({"name": parts[0], "phone": parts[1], "address": parts[2]}, ensure_ascii=False)
+        if kind == "evaluate":
+            return json.dumps({"type": "PERFECT_MATCH", "score": 1.0, "index": 0, "reason": None})
+        if kind == "confirm":
+            return json.dumps({"decision": "CONFIRM"})
+        if kind == "filter":
+            return json.dumps({"indices": list(range(self.filter_keep))})
+        return CANNED_ANSWER
+
+
+def install_fake_llm(model: FakeGeminiModel):
+    """Mọi lệnh gọi Gemini (phân tích ý định, lọc, đánh giá, xác nhận, bóc tách, trả lời) đi vào `model`."""
+    for module in (llm_service, intent_service, response_service):
+        module.get_gemini_model = lambda: model
+
+
+def generate_products(count: int, seed: int = 0) -> List[Dict]:
+    """Catalog giả `count` sản phẩm (đủ cột catalog), mọi sản phẩm còn hàng để kịch bản mua luôn chốt được."""
+    rng = np.random.default_rng(seed)
+    products, group = [], 0
+    while len(products) < count:
+        category, names, brands, kind, (low, high) = FAMILIES[rng.integers(len(FAMILIES))]
+        brand = str(rng.choice(brands))
+        name = f"{rng.choice(names)} {brand} {PROPERTY_VALUES['model'](rng)}"
+        price = float(rng.integers(low // 1000, high // 1000)) * 1000
+        group += 1
+        for variant in range(min(int(rng.integers(1, 5)), count - len(products))):
+            code = f"SP{group:07d}{variant:02d}"
+            products.append({
+                "product_code": code,
+                "product_name": name,
+                "category": category,
+                "properties": PROPERTY_VALUES[kind](rng),
+                "lifecare_price": price * (1 + 0.1 * variant),
+                "trademark": brand,
+                "guarantee": "12 tháng",
+                "inventory": int(rng.integers(1, 50)),
+                "specifications": " ".join(rng.choice(SPEC_SENTENCES, size=2, replace=False)),
+                "avatar_images": f"https://cdn.example.vn/products/{code}.jpg",
+                "link_product": f"https://example.vn/san-pham/{code}",
+            })
+    return products
+
+
+class FakeSearch:
+    """
+    Thay search_products / search_products_by_image / close_search_cursor của search_service:
+    ngủ (không chặn event loop, như truy vấn Elasticsearch bất đồng bộ) theo LatencyModel rồi trả về
+    SearchHits. Sản phẩm trùng tên đứng trước, phần còn lại lấp theo danh mục (truy vấn strict của
+    "xem thêm" lấp theo thứ tự ngược, để trang đầu của nó có sản phẩm khách chưa xem); phân trang bằng
+    search_after là vị trí trong danh sách, tối đa `max_pages` trang.
+    """
+
+    def __init__(self, products: List[Dict], latency: LatencyModel, max_pages: int = 3):
+        self.products = products
+        self.latency = latency
+        self.max_pages = max_pages
+        self.by_name = defaultdict(list)
+        self.by_category = defaultdict(list)
+        for product in products:
+            self.by_name[product["product_name"].lower()].append(product)
+            self.by_category[product["category"].lower()].append(product)
+        self.calls = 0
+        self.errors = 0
+
+    def _matches(self, product_name: str, category: str, strict: bool) -> List[Dict]:
+        exact = self.by_name.get((product_name or "").lower(), [])
+        related = self.by_category.get((category or "").lower()) or self.products
+        limit = PAGE_SIZE * self.max_pages
+        related = related[-limit:][::-1] if strict else related[:limit]
+        return (exact + [p for p in related if p not in exact])[:limit]
+
+    async def search_products(self, product_name: str = None, category: str = None, properties: str = None, cursor: Optional[Dict] = None,
+                              size: int = PAGE_SIZE, strict_properties: bool = False, strict_category: bool = False,
+                              source_profile: str = "listing", deadline=None, paginate: bool = False) -> SearchHits:
+        latency, failed = self.latency.sample()
+        self.calls += 1
+        await asyncio.sleep(latency)
+        if failed:
+            self.errors += 1
+            raise search_service.SearchUnavailableError("Lỗi giả lập của Elasticsearch")
+        matches = self._matches(product_name, category, strict_category or strict_properties)
+        offset = (cursor or {}).get("search_after") or [0]
+        start = offset[0]
+        fields = SOURCE_PROFILES[source_profile]
+        page = [{field: product.get(field) for field in fields} for product in matches[start:start + size]]
+        next_cursor = {"pit_id": None, "search_after": [start + size]} if start + size < len(matches) else None
+        return SearchHits(page, int(latency * 1000), latency * 1000, next_cursor)
+
+    async def search_products_by_image(self, image_embedding: list, top_k: int = 1, min_similarity: float = 0.97, deadline=None) -> SearchHits:
+        latency, _ = self.latency.sample()
+        self.calls += 1
+        await asyncio.sleep(latency)
+        fields = SOURCE_PROFILES["image"]
+        return SearchHits([{field: product.get(field) for field in fields} for product in self.products[:top_k]], int(latency * 1000), latency * 1000)
+
+    async def close_search_cursor(self, cursor: Optional[Dict]):
+        return None
+
+    def install(self):
+        routes.search_products = self.search_products
+        routes.search_products_by_image = self.search_products_by_image
+        routes.close_search_cursor = self.close_search_cursor
+        prefetch_service.search_products = self.search_products
+        prefetch_service.close_search_cursor = self.close_search_cursor
+
+
+def install_memory_search(products: List[Dict]):
+    """Dùng đường tìm kiếm thật trong bộ nhớ (SEARCH_BACKEND=memory) trên catalog giả, không nạp lại từ file."""
+    search_service.SEARCH_BACKEND = "memory"
+    local_search.LOCAL_RELOAD_CHECK_SECONDS = float("inf")
+    local_search._index = local_search.CatalogIndex(products, version="bench")
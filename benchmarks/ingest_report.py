@@ -0,0 +1,54 @@
+"""
+Tổng hợp các báo cáo nạp dữ liệu (INGEST_REPORT_PATH, mỗi lần nạp toàn bộ một dòng JSON) theo
+profile nạp và kiểu index vector: tốc độ nạp và dung lượng index, để so sánh bulk / mặc định,
+hnsw / int8_hnsw, và các giá trị m / ef_construction.
+
+Chạy từ thư mục gốc của project:
+    INDEX_NUMBER_OF_REPLICAS=0 INGEST_BULK_PROFILE=false python elastic_search_push_data.py --restart
+    IMAGE_VECTOR_INDEX_TYPE=int8_hnsw python elastic_search_push_data.py --restart
+    python -m benchmarks.ingest_report
+"""
+import argparse
+import json
+import os
+import statistics
+from collections import defaultdict
+
+
+def load_reports(path: str):
+    reports = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                reports.append(json.loads(line))
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="So sánh tốc độ nạp và dung lượng index theo profile")
+    parser.add_argument("--path", default=os.environ.get("INGEST_REPORT_PATH", "cache/ingest_reports.jsonl"))
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        print(f"Chưa có báo cáo nạp nào ở '{args.path}'.")
+        return
+    groups = defaultdict(list)
+    for report in load_reports(args.path):
+        vector = report.get("vector_index_type") or "mặc định"
+        if report.get("hnsw_m") or report.get("ef_construction"):
+            vector += f" m={report.get('hnsw_m') or '-'} ef={report.get('ef_construction') or '-'}"
+        groups[(report.get("profile", "default"), vector)].append(report)
+
+    print(f"{'profile':<10}{'vector':<28}{'lần':>5}{'dòng/s':>10}{'MB':>10}{'byte/văn bản':>14}{'segment':>9}")
+    for (profile, vector), reports in sorted(groups.items()):
+        rate = statistics.median(r["rows_per_second"] for r in reports)
+        size = statistics.median(r["store_bytes"] for r in reports)
+        per_doc = [r["store_bytes"] / r["docs"] for r in reports if r.get("docs")]
+        per_doc = statistics.median(per_doc) if per_doc else 0
+        segments = statistics.median(r["segments"] for r in reports)
+        print(f"{profile:<10}{vector:<28}{len(reports):>5}{rate:>10.1f}{size / 1024 / 1024:>10.1f}{per_doc:>14.0f}{segments:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
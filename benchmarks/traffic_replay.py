@@ -0,0 +1,206 @@
+"""
+Phân tích và chạy lại traffic đã ghi bằng TRAFFIC_CAPTURE_ENABLED (src/services/traffic_capture.py).
+
+- Xem cơ cấu traffic (tỉ lệ từng nhánh: tìm mới, xem thêm, mua hàng, ảnh...; số lượt mỗi hội thoại;
+  p50/p95 từng bước theo số liệu đã ghi):
+    python -m benchmarks.traffic_replay --summary
+- Chuyển file JSONL sang Parquet (gọn hơn để lưu / phân tích):
+    python -m benchmarks.traffic_replay --export-parquet cache/traffic_capture.parquet
+- Chạy lại các hội thoại vào một instance đang chạy, nhanh gấp --speedup lần so với thời gian thật,
+  giữ thứ tự các lượt trong từng session (lượt sau chỉ gửi khi lượt trước đã có câu trả lời):
+    python -m benchmarks.traffic_replay --url http://localhost:8008 --speedup 20 --concurrency 64
+
+Tin nhắn thông tin khách hàng đã bị ẩn khi ghi được thay bằng thông tin giả; lượt gửi ảnh chỉ được chạy
+lại khi có --image-url (ảnh gốc chỉ còn mã băm). Báo cáo độ trễ p50/p95/p99 theo nhánh đã ghi,
+phân bố lỗi và độ trễ so với lịch gửi (nếu lớn, máy chạy replay không theo kịp tốc độ yêu cầu).
+"""
+import argparse
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import pandas as pd
+import requests
+
+CUSTOMER_INFO_PLACEHOLDER = "Nguyễn Văn A, 0900000000, số 1 Thái Hà, Đống Đa, Hà Nội"
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def load_capture(path: str) -> List[Dict]:
+    """Các lượt đã ghi (JSONL hoặc Parquet), sắp theo thời gian."""
+    if path.endswith(".parquet"):
+        records = pd.read_parquet(path).to_dict("records")
+        for record in records:
+            record["stages"] = json.loads(record.pop("stages_json") or "{}")
+    else:
+        records = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    return sorted(records, key=lambda record: record["ts"])
+
+
+def export_parquet(records: List[Dict], path: str):
+    df = pd.DataFrame([{**{k: v for k, v in record.items() if k != "stages"}, "stages_json": json.dumps(record.get("stages") or {})} for record in records])
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    df.to_parquet(path, index=False)
+    print(f"Đã ghi {len(df)} lượt vào {path} ({os.path.getsize(path) / 1024:.0f} KB).")
+
+
+def group_sessions(records: List[Dict]) -> Dict[str, List[Dict]]:
+    sessions = defaultdict(list)
+    for record in records:
+        sessions[record["session"]].append(record)
+    return sessions
+
+
+def print_summary(records: List[Dict]):
+    sessions = group_sessions(records)
+    duration = records[-1]["ts"] - records[0]["ts"] if len(records) > 1 else 0
+    turns_per_session = [len(turns) for turns in sessions.values()]
+    print(f"{len(records)} lượt, {len(sessions)} hội thoại trong {duration / 60:.1f} phút "
+          f"({len(records) / duration if duration else 0:.2f} lượt/s trung bình).")
+    print(f"Lượt mỗi hội thoại: p50 {percentile(turns_per_session, 0.5)}, p95 {percentile(turns_per_session, 0.95)}, max {max(turns_per_session)}")
+
+    def shares(title, counter):
+        print(f"\n{title}")
+        for key, count in counter.most_common():
+            print(f"  {str(key):<24} {count:>8} {count / len(records):>7.1%}")
+
+    shares("Nhánh xử lý:", Counter(record.get("branch") for record in records))
+    shares("Kết quả:", Counter(record.get("outcome") for record in records))
+    print(f"\nCó ảnh: {sum(1 for r in records if r.get('image')):.0f} lượt, degraded: {sum(1 for r in records if r.get('degraded'))} lượt, "
+          f"đơn hàng: {sum(1 for r in records if r.get('has_purchase'))}")
+
+    stages = defaultdict(list)
+    for record in records:
+        for name, ms in (record.get("stages") or {}).items():
+            stages[name].append(ms)
+        stages["total"].append(record.get("total_ms", 0))
+    print(f"\n{'bước':<16} {'số lần':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, values in sorted(stages.items()):
+        print(f"{name:<16} {len(values):>8} {percentile(values, 0.5):>9.1f} {percentile(values, 0.95):>9.1f} {percentile(values, 0.99):>9.1f}")
+
+
+_local = threading.local()
+
+
+def _post(url: str, session_id: str, payload: Dict, timeout: float):
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = _local.session = requests.Session()
+    response = session.post(f"{url}/chat", params={"session_id": session_id}, json=payload, timeout=timeout)
+    return response.status_code
+
+
+async def replay(records: List[Dict], args) -> Dict:
+    sessions = group_sessions(records)
+    if args.max_sessions:
+        sessions = dict(list(sessions.items())[:args.max_sessions])
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=args.concurrency))
+    t0 = min(turns[0]["ts"] for turns in sessions.values())
+    run_id = time.strftime("%H%M%S")
+    results = []
+    skipped = Counter()
+    start = time.perf_counter()
+
+    async def run_session(key: str, turns: List[Dict]):
+        session_id = f"replay-{run_id}-{key}"
+        for record in turns:
+            payload = {"message": record.get("query") or "", "model_choice": record.get("model_choice") or "gemini"}
+            if record.get("redacted"):
+                payload["message"] = CUSTOMER_INFO_PLACEHOLDER
+            if record.get("image"):
+                if not args.image_url:
+                    skipped["image"] += 1
+                    continue
+                payload["image_url"] = args.image_url
+            if not payload["message"] and not payload.get("image_url"):
+                skipped["empty"] += 1
+                continue
+            scheduled = (record["ts"] - t0) / args.speedup
+            delay = scheduled - (time.perf_counter() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            sent = time.perf_counter()
+            try:
+                status = await asyncio.to_thread(_post, args.url, session_id, payload, args.timeout)
+                error = None if status == 200 else f"HTTP {status}"
+            except requests.RequestException as e:
+                error = type(e).__name__
+            results.append({
+                "branch": record.get("branch"), "latency": time.perf_counter() - sent,
+                "lag": sent - start - scheduled, "error": error,
+            })
+
+    await asyncio.gather(*(run_session(key, turns) for key, turns in sessions.items()))
+    return {"elapsed": time.perf_counter() - start, "results": results, "skipped": skipped, "sessions": len(sessions)}
+
+
+def print_replay_report(report: Dict):
+    results = report["results"]
+    if not results:
+        print("Không có lượt nào được gửi.")
+        return
+    elapsed = report["elapsed"]
+    errors = Counter(r["error"] for r in results if r["error"])
+    print(f"\nĐã gửi {len(results)} lượt của {report['sessions']} hội thoại trong {elapsed:.1f}s ({len(results) / elapsed:.1f} lượt/s), "
+          f"bỏ qua: {dict(report['skipped']) or 0}.")
+    print(f"Lỗi: {sum(errors.values())} ({sum(errors.values()) / len(results):.1%}) {dict(errors)}")
+    lags = [r["lag"] for r in results]
+    print(f"Trễ so với lịch gửi: p50 {percentile(lags, 0.5) * 1000:.0f}ms, p95 {percentile(lags, 0.95) * 1000:.0f}ms")
+
+    by_branch = defaultdict(list)
+    for r in results:
+        if not r["error"]:
+            by_branch[str(r["branch"])].append(r["latency"])
+            by_branch["(tất cả)"].append(r["latency"])
+    print(f"\n{'nhánh':<24} {'số lượt':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for branch, values in sorted(by_branch.items(), key=lambda item: -len(item[1])):
+        print(f"{branch:<24} {len(values):>8} {percentile(values, 0.5) * 1000:>9.0f} "
+              f"{percentile(values, 0.95) * 1000:>9.0f} {percentile(values, 0.99) * 1000:>9.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Phân tích / chạy lại traffic chat đã ghi.")
+    parser.add_argument("--capture", default=os.environ.get("TRAFFIC_CAPTURE_PATH", "cache/traffic_capture.jsonl"),
+                        help="File đã ghi (.jsonl hoặc .parquet)")
+    parser.add_argument("--summary", action="store_true", help="Chỉ in cơ cấu traffic, không gửi request")
+    parser.add_argument("--export-parquet", help="Ghi file đã ghi ra Parquet rồi thoát")
+    parser.add_argument("--url", default="http://localhost:8008", help="Địa chỉ instance nhận traffic chạy lại")
+    parser.add_argument("--speedup", type=float, default=1.0, help="Chạy nhanh gấp bao nhiêu lần thời gian thật")
+    parser.add_argument("--concurrency", type=int, default=64, help="Số request đồng thời tối đa")
+    parser.add_argument("--max-sessions", type=int, default=0, help="Chỉ chạy lại N hội thoại đầu (0 = tất cả)")
+    parser.add_argument("--image-url", help="URL ảnh dùng thay cho ảnh của các lượt gửi ảnh")
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    records = load_capture(args.capture)
+    if not records:
+        print(f"Không có lượt nào trong '{args.capture}'.")
+        return
+    if args.export_parquet:
+        export_parquet(records, args.export_parquet)
+        return
+    if args.summary:
+        print_summary(records)
+        return
+    print(f"Chạy lại {len(records)} lượt từ '{args.capture}' vào {args.url}, nhanh gấp {args.speedup:g} lần.")
+    print_replay_report(asyncio.run(replay(records, args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,31 @@
 import os
+import sys
 import pandas as pd
 from elasticsearch import Elasticsearch
-from elasticsearch.helpers import bulk
+from elasticsearch.helpers import bulk, streaming_bulk, parallel_bulk, scan
 import warnings
 import requests
 import io
 import google.generativeai as genai
 from PIL import Image
 import json
+import queue
 import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from src.utils.catalog_loader import (
+    load_catalog_records, CATALOG_COLUMNS, iter_catalog_chunks, dataframe_records, count_catalog_rows, catalog_fingerprint,
+    normalize_catalog_value, record_content_hash
+)
+from src.utils.catalog_snapshot import SnapshotWriter, write_snapshot, open_current_snapshot, publish_updated_snapshot
+from src.utils.embedding_client import EmbeddingClient
+from src.utils.embedding_store import EmbeddingStore, image_content_hash
+from src.utils.ingest_checkpoint import IngestCheckpoint
+from src.utils.inventory_feed import load_inventory_feed, diff_inventory, load_synced_state, save_synced_state
+from src.utils.progress import ProgressReport
+import numpy as np
 
 load_dotenv()
 
@@ -17,8 +33,56 @@ warnings.filterwarnings("ignore", category=UserWarning)
 
 # Sử dụng biến môi trường cho ELASTIC_HOST, với giá trị mặc định là localhost
 ELASTIC_HOST = os.environ.get("ELASTIC_HOST", "http://localhost:9200")
-INDEX_NAME = "products_news"
+# Tên alias mà chatbot tìm kiếm (search_service.INDEX_NAME); mỗi lần nạp toàn bộ tạo một index
+# "<alias>-<thời điểm>" rồi chuyển alias sang index mới khi đã kiểm tra xong
+INDEX_NAME = os.environ.get("ELASTIC_INDEX", "products_news")
 XLSX_FILE_PATH = "dulieu_1208.xlsx"
+# Index lưu phiên bản catalog; chatbot xóa cache tìm kiếm khi phiên bản đổi
+CATALOG_META_INDEX = os.environ.get("CATALOG_META_INDEX", "catalog_meta")
+# Kiểu lưu embedding trong snapshot catalog: "float32" hoặc "int8" (nhỏ hơn 4 lần)
+SNAPSHOT_EMBEDDING_DTYPE = os.environ.get("CATALOG_SNAPSHOT_EMBEDDING_DTYPE", "float32")
+# Số ảnh được tạo embedding song song khi nạp dữ liệu, và số ảnh tối đa cùng lúc từ một host ảnh
+INGEST_EMBED_WORKERS = int(os.environ.get("INGEST_EMBED_WORKERS", "16"))
+INGEST_PER_HOST_CONCURRENCY = int(os.environ.get("INGEST_PER_HOST_CONCURRENCY", "8"))
+# Nạp theo luồng: số dòng nguồn mỗi khối (đọc + embed + checkpoint), số khối đã embed chờ đẩy lên ES
+INGEST_CHUNK_ROWS = int(os.environ.get("INGEST_CHUNK_ROWS", "500"))
+INGEST_PIPELINE_DEPTH = int(os.environ.get("INGEST_PIPELINE_DEPTH", "2"))
+# Kích thước mỗi request _bulk (số văn bản và byte); mỗi văn bản có vector 512 chiều (~10 KB JSON)
+INGEST_BULK_CHUNK_SIZE = int(os.environ.get("INGEST_BULK_CHUNK_SIZE", "250"))
+INGEST_BULK_MAX_BYTES = int(os.environ.get("INGEST_BULK_MAX_BYTES", str(10 * 1024 * 1024)))
+# > 1: đẩy song song bằng parallel_bulk; 1: streaming_bulk (có thử lại khi ES trả 429)
+INGEST_BULK_THREADS = int(os.environ.get("INGEST_BULK_THREADS", "2"))
+INGEST_CHECKPOINT_DIR = os.environ.get("INGEST_CHECKPOINT_DIR", "cache/ingest_checkpoint")
+# Kho embedding cục bộ theo URL / hash nội dung ảnh, dùng lại giữa các lần nạp: chỉ ảnh chưa từng thấy
+# mới gọi dịch vụ embedding ("" = tắt). Kiểu lưu "float16" (nhỏ gấp đôi) hoặc "float32"
+INGEST_EMBED_STORE_DIR = os.environ.get("INGEST_EMBED_STORE_DIR", "cache/embedding_store")
+INGEST_EMBED_STORE_DTYPE = os.environ.get("INGEST_EMBED_STORE_DTYPE", "float16")
+# Ảnh không có trong kho theo URL: tải ảnh để tính sha256, tìm theo nội dung trước khi gọi dịch vụ embedding
+INGEST_EMBED_STORE_HASH = os.environ.get("INGEST_EMBED_STORE_HASH", "true").lower() in ("1", "true", "yes")
+INGEST_EMBED_STORE_HASH_TIMEOUT = float(os.environ.get("INGEST_EMBED_STORE_HASH_TIMEOUT", "5"))
+# Profile nạp hàng loạt: trong lúc nạp tắt refresh, bỏ replica và dùng request _bulk lớn hơn;
+# nạp xong trả lại cấu hình phục vụ rồi force-merge
+INGEST_BULK_PROFILE = os.environ.get("INGEST_BULK_PROFILE", "true").lower() in ("1", "true", "yes")
+INGEST_LOAD_BULK_CHUNK_SIZE = int(os.environ.get("INGEST_LOAD_BULK_CHUNK_SIZE", "1000"))
+INGEST_LOAD_BULK_MAX_BYTES = int(os.environ.get("INGEST_LOAD_BULK_MAX_BYTES", str(50 * 1024 * 1024)))
+# Cấu hình phục vụ của index (áp dụng khi tạo index và sau khi nạp xong)
+INDEX_REFRESH_INTERVAL = os.environ.get("INDEX_REFRESH_INTERVAL", "1s")
+INDEX_NUMBER_OF_REPLICAS = int(os.environ.get("INDEX_NUMBER_OF_REPLICAS", "1"))
+INDEX_FORCE_MERGE_SEGMENTS = int(os.environ.get("INDEX_FORCE_MERGE_SEGMENTS", "1"))
+# Mapping image_embedding: kiểu chỉ mục vector ("" = mặc định của ES, "hnsw", "int8_hnsw", "int4_hnsw",
+# "flat", "int8_flat", ...) và tham số HNSW (0 = mặc định của ES)
+IMAGE_VECTOR_INDEX_TYPE = os.environ.get("IMAGE_VECTOR_INDEX_TYPE", "")
+IMAGE_VECTOR_HNSW_M = int(os.environ.get("IMAGE_VECTOR_HNSW_M", "0"))
+IMAGE_VECTOR_EF_CONSTRUCTION = int(os.environ.get("IMAGE_VECTOR_EF_CONSTRUCTION", "0"))
+# Báo cáo mỗi lần nạp toàn bộ (tốc độ, kích thước index, cấu hình), để so các profile với nhau
+INGEST_REPORT_PATH = os.environ.get("INGEST_REPORT_PATH", "cache/ingest_reports.jsonl")
+# Tồn kho / giá đã đồng bộ lần trước (dùng chung với tác vụ đồng bộ trong chatbot)
+INVENTORY_SYNC_STATE_PATH = os.environ.get("INVENTORY_SYNC_STATE_PATH", "cache/inventory_synced.parquet")
+# Số phiên bản index cũ giữ lại sau khi chuyển alias, để rollback tức thì
+REINDEX_KEEP_VERSIONS = int(os.environ.get("REINDEX_KEEP_VERSIONS", "2"))
+# Không chuyển alias nếu tỉ lệ văn bản lỗi vượt ngưỡng, hoặc index mới ít hơn index đang chạy quá tỉ lệ này
+REINDEX_MAX_FAILED_RATIO = float(os.environ.get("REINDEX_MAX_FAILED_RATIO", "0.01"))
+REINDEX_MAX_SHRINK_RATIO = float(os.environ.get("REINDEX_MAX_SHRINK_RATIO", "0.2"))
 
 try:
     es_client = Elasticsearch(hosts=[ELASTIC_HOST])
@@ -29,13 +93,13 @@ except (ValueError, ConnectionError) as e:
     print(f"Lỗi: {e}")
     exit()
 
-def create_index_with_embedding_mapping():
+def create_index_with_embedding_mapping(index_name):
     """
     Tạo index trong Elasticsearch với mapping mới, bao gồm trường dense_vector.
     """
-    if es_client.indices.exists(index=INDEX_NAME):
-        print(f"Index '{INDEX_NAME}' đã tồn tại. Xóa index cũ để tạo lại.")
-        es_client.indices.delete(index=INDEX_NAME)
+    if es_client.indices.exists(index=index_name):
+        print(f"Index '{index_name}' đã tồn tại. Xóa index cũ để tạo lại.")
+        es_client.indices.delete(index=index_name)
 
     mapping = {
         "properties": {
@@ -50,151 +114,669 @@ def create_index_with_embedding_mapping():
             "specifications": {"type": "text"},
             "avatar_images": {"type": "keyword"},
             "link_product": {"type": "keyword"},
-            "image_embedding": {
-                "type": "dense_vector",
-                "dims": 512 
-            }
+            # Nạp delta: hash nội dung của dòng nguồn, và đánh dấu sản phẩm đã bị xóa khỏi catalog (tombstone)
+            "content_hash": {"type": "keyword"},
+            "deleted": {"type": "boolean"},
+            "deleted_at": {"type": "date"},
+            "image_embedding": image_embedding_mapping()
         }
     }
+    settings = {"number_of_replicas": INDEX_NUMBER_OF_REPLICAS, "refresh_interval": INDEX_REFRESH_INTERVAL}
     
-    print(f"Tạo index mới '{INDEX_NAME}' với mapping cho vector...")
-    es_client.indices.create(index=INDEX_NAME, mappings=mapping)
+    print(f"Tạo index mới '{index_name}' với mapping cho vector...")
+    es_client.indices.create(index=index_name, mappings=mapping, settings=settings)
     print("Tạo index thành công.")
 
-def process_and_embed_data():
+def image_embedding_mapping():
+    """Mapping dense_vector cho image_embedding, kèm kiểu lượng tử hóa / tham số HNSW nếu được cấu hình."""
+    field = {"type": "dense_vector", "dims": 512}
+    index_options = {}
+    if IMAGE_VECTOR_INDEX_TYPE:
+        index_options["type"] = IMAGE_VECTOR_INDEX_TYPE
+    if "hnsw" in (IMAGE_VECTOR_INDEX_TYPE or "hnsw"):
+        if IMAGE_VECTOR_HNSW_M:
+            index_options["m"] = IMAGE_VECTOR_HNSW_M
+        if IMAGE_VECTOR_EF_CONSTRUCTION:
+            index_options["ef_construction"] = IMAGE_VECTOR_EF_CONSTRUCTION
+    if index_options:
+        # ES bắt buộc có "type" khi khai báo index_options
+        index_options.setdefault("type", "hnsw")
+        field.update(index=True, similarity="cosine", index_options=index_options)
+    return field
+
+def apply_bulk_load_profile(index_name):
+    """Tắt refresh và replica của index đang nạp; trả về cấu hình cũ để khôi phục."""
+    current = es_client.indices.get_settings(index=index_name)[index_name]["settings"]["index"]
+    serving = {
+        "refresh_interval": current.get("refresh_interval", INDEX_REFRESH_INTERVAL),
+        "number_of_replicas": int(current.get("number_of_replicas", INDEX_NUMBER_OF_REPLICAS)),
+    }
+    es_client.indices.put_settings(index=index_name, settings={"refresh_interval": "-1", "number_of_replicas": 0})
+    print(f"Index '{index_name}' chuyển sang profile nạp hàng loạt (refresh tắt, 0 replica).")
+    return serving
+
+def restore_serving_profile(index_name, serving):
+    """Trả lại refresh / replica phục vụ, refresh, force-merge và chờ các shard sẵn sàng."""
+    start = time.perf_counter()
+    es_client.indices.put_settings(index=index_name, settings=serving)
+    es_client.indices.refresh(index=index_name)
+    if INDEX_FORCE_MERGE_SEGMENTS:
+        es_client.options(request_timeout=3600).indices.forcemerge(index=index_name, max_num_segments=INDEX_FORCE_MERGE_SEGMENTS)
+    health = es_client.options(request_timeout=120).cluster.health(
+        index=index_name, wait_for_status="green" if serving["number_of_replicas"] == 0 else "yellow", timeout="60s"
+    )
+    print(f"Index '{index_name}' trở lại profile phục vụ (refresh {serving['refresh_interval']}, "
+          f"{serving['number_of_replicas']} replica, trạng thái {health.get('status')}) sau {time.perf_counter() - start:.1f}s.")
+
+def index_size_report(index_name):
+    """Số văn bản, số segment và dung lượng (byte) của index."""
+    stats = es_client.indices.stats(index=index_name, metric=["docs", "store", "segments"])["_all"]["primaries"]
+    return {
+        "docs": stats["docs"]["count"],
+        "segments": stats["segments"]["count"],
+        "store_bytes": stats["store"]["size_in_bytes"],
+    }
+
+def write_ingest_report(report):
+    print(f"Báo cáo nạp: {report['rows']} dòng trong {report['seconds']:.1f}s ({report['rows_per_second']:.1f} dòng/s), "
+          f"index {report['store_bytes'] / 1024 / 1024:.1f} MB, {report['segments']} segment "
+          f"[profile {report['profile']}, vector {report['vector_index_type'] or 'mặc định'}].")
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(INGEST_REPORT_PATH)), exist_ok=True)
+        with open(INGEST_REPORT_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(report, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"Không thể ghi báo cáo nạp: {e}")
+
+def new_index_name():
+    return f"{INDEX_NAME}-{time.strftime('%Y%m%d%H%M%S')}"
+
+def live_indices():
+    """Các index mà alias đang trỏ tới; hoặc [INDEX_NAME] nếu đó còn là index thật (trước khi dùng alias)."""
+    if es_client.indices.exists_alias(name=INDEX_NAME):
+        return sorted(es_client.indices.get_alias(name=INDEX_NAME).keys())
+    if es_client.indices.exists(index=INDEX_NAME):
+        return [INDEX_NAME]
+    return []
+
+def versioned_indices():
+    """Các index phiên bản "<alias>-<thời điểm>", cũ trước mới sau."""
+    response = es_client.indices.get(index=f"{INDEX_NAME}-*", allow_no_indices=True, ignore_unavailable=True)
+    return sorted(name for name in response.keys() if name[len(INDEX_NAME) + 1:].isdigit())
+
+def _count_live_documents(index_name):
+    query = {"bool": {"must_not": [{"term": {"deleted": True}}]}}
+    return es_client.count(index=index_name, query=query)["count"]
+
+def validate_new_index(index_name, rows, indexed, failed):
     """
-    Đọc dữ liệu từ XLSX, tải ảnh, tạo embedding và đẩy vào Elasticsearch.
+    Kiểm tra index vừa nạp trước khi chuyển alias: số văn bản thực có trong index, tỉ lệ lỗi,
+    và không ít hơn index đang phục vụ quá REINDEX_MAX_SHRINK_RATIO. Trả về (hợp lệ, lý do).
     """
-    try:
-        df = pd.read_excel(XLSX_FILE_PATH)
-        df.columns = [
-            'product_code', 'product_name', 'category', 'properties',
-            'lifecare_price', 'trademark', 'guarantee', 'inventory',
-            'specifications', 'avatar_images', 'link_product'
-        ]
-        df = df.dropna(subset=['product_code', 'product_name'])
-        df['inventory'] = pd.to_numeric(df['inventory'], errors='coerce').fillna(0).astype(int)
-        df['lifecare_price'] = pd.to_numeric(df['lifecare_price'].astype(str).str.replace(',', ''), errors='coerce').fillna(0).astype(float)
-        df = df.where(pd.notnull(df), None)
-    except FileNotFoundError:
-        print(f"Lỗi: Không tìm thấy file '{XLSX_FILE_PATH}'.")
+    es_client.indices.refresh(index=index_name)
+    count = es_client.count(index=index_name)["count"]
+    if not count:
+        return False, "index mới không có văn bản nào"
+    if count > indexed:
+        return False, f"index có {count} văn bản nhưng chỉ {indexed} văn bản được nạp thành công"
+    if rows and failed / rows > REINDEX_MAX_FAILED_RATIO:
+        return False, f"{failed}/{rows} văn bản lỗi (ngưỡng {REINDEX_MAX_FAILED_RATIO:.0%})"
+    live = [name for name in live_indices() if name != index_name]
+    if live:
+        live_count = _count_live_documents(live[0])
+        if count < live_count * (1 - REINDEX_MAX_SHRINK_RATIO):
+            return False, f"index mới có {count} văn bản, ít hơn nhiều so với {live_count} của '{live[0]}'"
+    return True, f"{count} văn bản"
+
+def swap_alias(index_name):
+    """
+    Chuyển alias sang `index_name` trong một lệnh _aliases (nguyên tử: không có lúc nào alias
+    không trỏ tới index nào). Lần đầu, index thật trùng tên alias bị thay thế trong cùng lệnh.
+    """
+    actions = [{"add": {"index": index_name, "alias": INDEX_NAME}}]
+    for old in live_indices():
+        if old == INDEX_NAME:
+            actions.append({"remove_index": {"index": old}})
+        elif old != index_name:
+            actions.append({"remove": {"index": old, "alias": INDEX_NAME}})
+    es_client.indices.update_aliases(actions=actions)
+    print(f"Alias '{INDEX_NAME}' đã chuyển sang '{index_name}'.")
+
+def prune_old_indices(keep=None):
+    """Giữ index đang chạy và `keep` phiên bản trước đó; xóa các phiên bản cũ hơn."""
+    keep = REINDEX_KEEP_VERSIONS if keep is None else keep
+    live = set(live_indices())
+    versions = versioned_indices()
+    if not live & set(versions):
         return
+    newest_live = max(live & set(versions))
+    older = [name for name in versions if name < newest_live and name not in live]
+    for name in older[:max(0, len(older) - keep)]:
+        es_client.indices.delete(index=name)
+        print(f"Đã xóa phiên bản index cũ '{name}'.")
 
-    actions = []
-    total_rows = len(df)
-    API_ENDPOINT = "https://embed.doiquanai.vn/embed"
-
-    for index, row in df.iterrows():
-        print(f"Đang xử lý dòng {index + 1}/{total_rows}: {row['product_name']}")
-        
-        doc = row.to_dict()
-        image_url = row['avatar_images']
-        embedding_vector = None
-
-        if isinstance(image_url, str) and image_url.startswith('http'):
-            try:
-                response = requests.post(API_ENDPOINT, data={"image_url": image_url}, timeout=15)
-                response.raise_for_status()
-                result = response.json()
-
-                # Kiểm tra có lỗi không
-                if "embedding" in result:
-                    embedding_vector = result["embedding"]
-                    print(" -> Tạo embedding cho ảnh thành công.")
-                else:
-                    print(" -> Lỗi từ API:", result.get("error", "Không rõ lỗi"))
-
-            except Exception as e:
-                print(f" -> Lỗi khi gửi ảnh đến API local: {e}")
-        
-        doc['image_embedding'] = embedding_vector
-        
-        action = {
-            "_index": INDEX_NAME,
-            "_id": row['product_code'],
-            "_source": doc
-        }
-        actions.append(action)
+def discard_unfinished_indices():
+    """Xóa các index phiên bản mới hơn index đang chạy: nạp dở, không qua kiểm tra, hoặc đã bị rollback."""
+    live = live_indices()
+    newest_live = max(live) if live and live != [INDEX_NAME] else ""
+    for name in versioned_indices():
+        if name > newest_live and name not in live:
+            es_client.indices.delete(index=name)
+            print(f"Đã xóa index nạp dở '{name}'.")
+
+def rollback_index():
+    """Chuyển alias về phiên bản index ngay trước phiên bản đang chạy, rồi dựng lại snapshot catalog từ index đó."""
+    live = live_indices()
+    candidates = [name for name in versioned_indices() if live and name < min(live)]
+    if not candidates:
+        print("Không có phiên bản index cũ để rollback.")
+        return False
+    target = candidates[-1]
+    swap_alias(target)
+    bump_catalog_version()
+    records, embeddings_by_code = [], {}
+    for hit in scan(es_client, query={"query": {"bool": {"must_not": [{"term": {"deleted": True}}]}}}, index=target, size=1000):
+        source = hit["_source"]
+        vector = source.pop("image_embedding", None)
+        record = {column: source.get(column) for column in CATALOG_COLUMNS}
+        record['product_code'] = str(hit["_id"])
+        records.append(record)
+        if vector:
+            embeddings_by_code[record['product_code']] = vector
+    emit_catalog_snapshot(records, embeddings_by_code)
+    return True
+
+def bump_catalog_version():
+    """
+    Ghi phiên bản catalog mới sau mỗi lần dữ liệu thay đổi để chatbot
+    bỏ các kết quả tìm kiếm đã cache.
+    """
+    version = time.strftime("%Y%m%d%H%M%S") + f"-{random.randint(0, 9999):04d}"
+    try:
+        es_client.index(
+            index=CATALOG_META_INDEX,
+            id=INDEX_NAME,
+            document={"index": INDEX_NAME, "version": version, "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S")},
+            refresh=True
+        )
+        print(f"Đã cập nhật phiên bản catalog: {version}")
+    except Exception as e:
+        print(f"Không thể ghi phiên bản catalog: {e}")
+
+def emit_catalog_snapshot(records, embeddings_by_code):
+    """
+    Ghi snapshot catalog dạng cột (mmap) cho các worker của chatbot:
+    các trường sản phẩm, tồn kho / giá và ma trận embedding ảnh.
+    """
+    vectors = [embeddings_by_code.get(str(r['product_code'])) for r in records]
+    dim = next((len(v) for v in vectors if v is not None), 0)
+    embeddings, has_embedding = None, None
+    if dim:
+        embeddings = np.zeros((len(records), dim), dtype=np.float32)
+        has_embedding = np.zeros(len(records), dtype=bool)
+        for i, vector in enumerate(vectors):
+            if vector is not None and len(vector) == dim:
+                embeddings[i] = vector
+                has_embedding[i] = True
+    write_catalog_snapshot(records, embeddings, has_embedding)
 
-    print(f"\nChuẩn bị index {len(actions)} sản phẩm...")
+def write_catalog_snapshot(records, embeddings, has_embedding):
     try:
-        success, failed = bulk(es_client, actions, raise_on_error=False)
-        print(f"Index thành công: {success} sản phẩm.")
-        if failed:
-            print(f"Index thất bại: {len(failed)} sản phẩm.")
-            for i, fail_info in enumerate(failed[:5]):
-                print(f"  Lỗi {i+1}: {fail_info['index']['error']}")
+        write_snapshot(records, embeddings, has_embedding, embedding_dtype=SNAPSHOT_EMBEDDING_DTYPE)
+    except OSError as e:
+        print(f"Không thể ghi snapshot catalog: {e}")
 
+def write_checkpoint_snapshot(checkpoint, rows_done):
+    """
+    Ghi snapshot catalog sau lần nạp toàn bộ, theo từng khối INGEST_CHUNK_ROWS dòng của file nguồn:
+    embedding của mỗi khối được chép từ file tạm của checkpoint (memmap), nên bộ nhớ chỉ giữ một khối.
+    """
+    embeddings, has_embedding = checkpoint.embeddings()
+    dim = embeddings.shape[1] if embeddings is not None else 0
+    writer = None
+    try:
+        writer = SnapshotWriter(dim, SNAPSHOT_EMBEDDING_DTYPE)
+        for df in iter_catalog_chunks(XLSX_FILE_PATH, INGEST_CHUNK_ROWS):
+            records = dataframe_records(df)
+            start, stop = writer.count, writer.count + len(records)
+            if stop > rows_done:
+                break
+            writer.append(records, embeddings[start:stop] if dim else None, has_embedding[start:stop] if dim else None)
+        else:
+            if writer.count == rows_done:
+                writer.commit()
+                return
+        print("File nguồn không khớp với checkpoint, bỏ qua ghi snapshot catalog.")
+        writer.abort()
+    except OSError as e:
+        if writer is not None:
+            writer.abort()
+        print(f"Không thể ghi snapshot catalog: {e}")
+
+def open_embedding_store():
+    """Kho embedding cục bộ (INGEST_EMBED_STORE_DIR), hoặc None nếu bị tắt / không mở được."""
+    if not INGEST_EMBED_STORE_DIR:
+        return None
+    try:
+        store = EmbeddingStore(INGEST_EMBED_STORE_DIR, dtype=INGEST_EMBED_STORE_DTYPE)
     except Exception as e:
-        print(f"Đã xảy ra lỗi khi index dữ liệu: {e}")
+        print(f"Không thể mở kho embedding '{INGEST_EMBED_STORE_DIR}': {e}")
+        return None
+    print(f"Kho embedding: {len(store)} vector ({store.snapshot()['dtype']}).")
+    return store
 
-def update_inventory_and_price():
+def embed_catalog_images(image_urls, client, store=None, stats=None):
     """
-    Cập nhật tồn kho và giá sản phẩm từ file XLSX vào Elasticsearch.
-    Chỉ cập nhật các trường 'inventory' và 'lifecare_price' dựa trên 'product_code'.
+    Tạo embedding cho ảnh đại diện của các sản phẩm bằng pool luồng có giới hạn
+    (INGEST_EMBED_WORKERS request đồng thời, INGEST_PER_HOST_CONCURRENCY mỗi host ảnh).
+    Nếu có kho embedding (`store`), ảnh đã thấy (theo URL, rồi theo sha256 nội dung) được lấy
+    từ kho, chỉ ảnh mới được gửi tới dịch vụ embedding và được ghi lại vào kho.
+    Trả về danh sách cùng thứ tự với `image_urls`, None cho dòng không có ảnh hoặc bị lỗi.
     """
+    targets = [i for i, url in enumerate(image_urls) if isinstance(url, str) and url.startswith('http')]
+    embeddings = [None] * len(image_urls)
+    if not targets:
+        return embeddings
+    stats = stats if stats is not None else {}
+    for key in ("url_hits", "content_hits", "embedded"):
+        stats.setdefault(key, 0)
+
+    content_hashes = {}
+    if store is not None:
+        for i, embedding in zip(targets, store.get_many([f"url:{image_urls[i]}" for i in targets])):
+            embeddings[i] = embedding
+        missing = [i for i in targets if embeddings[i] is None]
+        stats["url_hits"] += len(targets) - len(missing)
+        targets = missing
+        if targets and INGEST_EMBED_STORE_HASH:
+            with ThreadPoolExecutor(max_workers=INGEST_EMBED_WORKERS) as pool:
+                hashes = list(pool.map(lambda i: image_content_hash(image_urls[i], timeout=min(client.timeout, INGEST_EMBED_STORE_HASH_TIMEOUT)), targets))
+            content_hashes = {i: h for i, h in zip(targets, hashes) if h}
+            for i, embedding in zip(content_hashes, store.get_many([f"sha256:{h}" for h in content_hashes.values()])):
+                if embedding is not None:
+                    embeddings[i] = embedding
+                    store.alias(f"url:{image_urls[i]}", f"sha256:{content_hashes[i]}")
+                    stats["content_hits"] += 1
+            targets = [i for i in targets if embeddings[i] is None]
+    if not targets:
+        return embeddings
+
+    results = client.embed_many([image_urls[i] for i in targets], per_host_limit=INGEST_PER_HOST_CONCURRENCY)
+    for i, embedding in zip(targets, results):
+        embeddings[i] = embedding
+    stats["embedded"] += len(targets)
+    if store is not None:
+        store.put_many([
+            ([f"url:{image_urls[i]}", f"sha256:{content_hashes[i]}" if i in content_hashes else None], embeddings[i])
+            for i in targets if embeddings[i] is not None
+        ])
+    return embeddings
+
+def _embed_chunks(chunks, client, output, stop, store=None, store_stats=None):
+    """Luồng sản xuất: đọc khối nguồn, tạo embedding, đưa vào hàng đợi có giới hạn (giữ bộ nhớ phẳng)."""
     try:
-        df = pd.read_excel(XLSX_FILE_PATH)
-        df.columns = [
-            'product_code', 'product_name', 'category', 'properties',
-            'lifecare_price', 'trademark', 'guarantee', 'inventory',
-            'specifications', 'avatar_images', 'link_product'
-        ]
-        # Giữ lại các cột cần thiết
-        df = df[['product_code', 'lifecare_price', 'inventory']].copy()
-        df = df.dropna(subset=['product_code'])
-        
-        # Làm sạch dữ liệu
-        df['inventory'] = pd.to_numeric(df['inventory'], errors='coerce').fillna(0).astype(int)
-        df['lifecare_price'] = pd.to_numeric(df['lifecare_price'].astype(str).str.replace(',', ''), errors='coerce').fillna(0).astype(float)
+        for df in chunks:
+            if stop.is_set():
+                return
+            records = dataframe_records(df)
+            embeddings = embed_catalog_images([r.get('avatar_images') for r in records], client, store, store_stats)
+            output.put((records, embeddings))
+        output.put(None)
+    except BaseException as e:
+        output.put(e)
 
-    except FileNotFoundError:
+def _push_actions(actions, chunk_size=None, max_chunk_bytes=None):
+    """Đẩy các action lên ES theo luồng; trả về (số action thành công, danh sách lỗi)."""
+    options = {
+        "chunk_size": chunk_size or INGEST_BULK_CHUNK_SIZE,
+        "max_chunk_bytes": max_chunk_bytes or INGEST_BULK_MAX_BYTES,
+        "raise_on_error": False
+    }
+    if INGEST_BULK_THREADS > 1:
+        results = parallel_bulk(es_client, actions, thread_count=INGEST_BULK_THREADS, **options)
+    else:
+        results = streaming_bulk(es_client, actions, max_retries=3, initial_backoff=2, **options)
+    success, errors = 0, []
+    for ok, info in results:
+        if ok:
+            success += 1
+        else:
+            errors.append(info)
+    return success, errors
+
+def _bulk_chunk(index_name, records, embeddings, bulk_profile=False):
+    """Đẩy một khối sản phẩm (kèm embedding) lên index `index_name`."""
+    return _push_actions(
+        (
+            {
+                "_index": index_name,
+                "_id": record['product_code'],
+                "_source": dict(record, image_embedding=embedding, content_hash=record_content_hash(record))
+            }
+            for record, embedding in zip(records, embeddings)
+        ),
+        chunk_size=INGEST_LOAD_BULK_CHUNK_SIZE if bulk_profile else None,
+        max_chunk_bytes=INGEST_LOAD_BULK_MAX_BYTES if bulk_profile else None
+    )
+
+def process_and_embed_data(resume=True):
+    """
+    Đọc dữ liệu nguồn theo từng khối, tạo embedding ảnh song song và đẩy vào Elasticsearch theo luồng
+    (streaming_bulk / parallel_bulk). Sau mỗi khối đã được ES xác nhận thì lưu checkpoint, nên lần
+    chạy bị ngắt có thể chạy tiếp từ khối kế tiếp (resume=True) thay vì làm lại từ đầu.
+    Bộ nhớ chỉ giữ tối đa INGEST_PIPELINE_DEPTH khối, không phụ thuộc kích thước catalog.
+
+    Dữ liệu được nạp vào một index phiên bản mới trong khi chatbot vẫn tìm trên index cũ; chỉ khi
+    số văn bản hợp lệ thì alias INDEX_NAME mới được chuyển sang (validate_new_index, swap_alias).
+    """
+    if not os.path.exists(XLSX_FILE_PATH):
         print(f"Lỗi: Không tìm thấy file '{XLSX_FILE_PATH}'.")
         return
 
-    actions = []
-    total_rows = len(df)
+    fingerprint = catalog_fingerprint(XLSX_FILE_PATH)
+    checkpoint = IngestCheckpoint(INGEST_CHECKPOINT_DIR)
+    state = checkpoint.load(XLSX_FILE_PATH, fingerprint, INDEX_NAME) if resume else None
+    if state and state.get("target_index") and es_client.indices.exists(index=state["target_index"]):
+        print(f"Chạy tiếp từ checkpoint vào '{state['target_index']}': đã nạp {state['rows_done']} dòng "
+              f"({state['indexed']} thành công, {state['failed']} lỗi).")
+    else:
+        discard_unfinished_indices()
+        target_index = new_index_name()
+        create_index_with_embedding_mapping(target_index)
+        serving = apply_bulk_load_profile(target_index) if INGEST_BULK_PROFILE else None
+        checkpoint.start(XLSX_FILE_PATH, fingerprint, INDEX_NAME, target_index=target_index, serving_settings=serving)
+    target_index = checkpoint.state["target_index"]
+    # Profile nạp hàng loạt được lưu trong checkpoint để lần chạy tiếp vẫn khôi phục đúng cấu hình phục vụ
+    serving = checkpoint.state.get("serving_settings")
+    skip_rows = checkpoint.state["rows_done"]
 
-    for index, row in df.iterrows():
-        product_code = row['product_code']
-        print(f"Chuẩn bị cập nhật dòng {index + 1}/{total_rows}: {product_code}")
-        
-        action = {
-            "_op_type": "update",
-            "_index": INDEX_NAME,
-            "_id": product_code,
-            "doc": {
-                "inventory": row['inventory'],
-                "lifecare_price": row['lifecare_price']
+    progress = ProgressReport(max(0, count_catalog_rows(XLSX_FILE_PATH) - skip_rows), "Nạp dữ liệu", interval_seconds=10)
+    client = EmbeddingClient(max_concurrency=INGEST_EMBED_WORKERS)
+    store, store_stats = open_embedding_store(), {}
+    chunks = queue.Queue(maxsize=max(1, INGEST_PIPELINE_DEPTH))
+    stop = threading.Event()
+    producer = threading.Thread(
+        target=_embed_chunks,
+        args=(iter_catalog_chunks(XLSX_FILE_PATH, INGEST_CHUNK_ROWS, skip_rows), client, chunks, stop, store, store_stats),
+        daemon=True
+    )
+    producer.start()
+
+    shown_errors, image_failures = 0, 0
+    try:
+        while True:
+            item = chunks.get()
+            if item is None:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            records, embeddings = item
+            success, errors = _bulk_chunk(target_index, records, embeddings, bulk_profile=bool(serving))
+            checkpoint.append_chunk(embeddings, success, len(errors))
+            progress.update(ok=True, count=success)
+            progress.update(ok=False, count=len(errors))
+            image_failures += sum(
+                1 for record, embedding in zip(records, embeddings)
+                if embedding is None and str(record.get('avatar_images') or '').startswith('http')
+            )
+            for error in errors[:max(0, 5 - shown_errors)]:
+                print(f"  Lỗi index: {error}")
+            shown_errors += len(errors)
+    except Exception as e:
+        print(f"Đã xảy ra lỗi khi index dữ liệu: {e}")
+        print(f"Đã lưu checkpoint ở dòng {checkpoint.state['rows_done']}; chạy lại script để tiếp tục.")
+        return
+    finally:
+        stop.set()
+        client.close()
+
+    summary = progress.finish()
+    state = checkpoint.state
+    stats = client.snapshot()
+    print(f" -> Embedding: {stats['requests']} request, {stats['retries']} lần thử lại, "
+          f"trung bình {stats['avg_ms']:.0f} ms/request, {image_failures} ảnh lỗi.")
+    if store is not None:
+        print(f" -> Kho embedding: {store_stats.get('url_hits', 0)} ảnh lấy theo URL, {store_stats.get('content_hits', 0)} theo nội dung, "
+              f"{store_stats.get('embedded', 0)} ảnh mới gọi dịch vụ; kho có {len(store)} vector.")
+    print(f"Index thành công: {state['indexed']} sản phẩm.")
+    if state['failed']:
+        print(f"Index thất bại: {state['failed']} sản phẩm.")
+
+    if serving:
+        restore_serving_profile(target_index, serving)
+    write_ingest_report({
+        "index": target_index,
+        "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "rows": summary["done"],
+        "seconds": summary["seconds"],
+        "rows_per_second": summary["rows_per_second"],
+        "profile": "bulk" if serving else "default",
+        "bulk_chunk_size": INGEST_LOAD_BULK_CHUNK_SIZE if serving else INGEST_BULK_CHUNK_SIZE,
+        "vector_index_type": IMAGE_VECTOR_INDEX_TYPE,
+        "hnsw_m": IMAGE_VECTOR_HNSW_M,
+        "ef_construction": IMAGE_VECTOR_EF_CONSTRUCTION,
+        **index_size_report(target_index),
+    })
+
+    valid, reason = validate_new_index(target_index, state['rows_done'], state['indexed'], state['failed'])
+    if not valid:
+        print(f"Không chuyển alias sang '{target_index}': {reason}. Index cũ vẫn phục vụ bình thường.")
+        checkpoint.clear()
+        return
+    print(f"Index '{target_index}' hợp lệ ({reason}).")
+    swap_alias(target_index)
+    bump_catalog_version()
+    write_checkpoint_snapshot(checkpoint, state['rows_done'])
+    checkpoint.clear()
+    prune_old_indices()
+
+def _fetch_indexed_state():
+    """{product_code: _source không có vector} của mọi văn bản đang có trong index."""
+    query = {"query": {"match_all": {}}, "_source": {"excludes": ["image_embedding"]}}
+    return {str(hit["_id"]): hit["_source"] for hit in scan(es_client, query=query, index=INDEX_NAME, size=2000)}
+
+def _fetch_embeddings(codes):
+    """Embedding đang lưu trong index của các mã sản phẩm (dùng khi snapshot trước không có)."""
+    embeddings = {}
+    codes = list(codes)
+    for i in range(0, len(codes), 500):
+        response = es_client.mget(index=INDEX_NAME, ids=codes[i:i + 500], source_includes=["image_embedding"])
+        for doc in response["docs"]:
+            vector = doc.get("_source", {}).get("image_embedding") if doc.get("found") else None
+            if vector:
+                embeddings[str(doc["_id"])] = vector
+    return embeddings
+
+def sync_catalog_delta():
+    """
+    Nạp delta: so hash nội dung từng product_code trong file nguồn với văn bản đang index,
+    chỉ gửi cập nhật một phần cho các trường đã đổi, chỉ tạo lại embedding cho sản phẩm đổi
+    ảnh (avatar_images), thêm sản phẩm mới, và đánh dấu tombstone (deleted=true) cho sản phẩm
+    không còn trong nguồn. Index không bị xóa nên chatbot vẫn phục vụ bình thường trong lúc nạp.
+    """
+    if not os.path.exists(XLSX_FILE_PATH):
+        print(f"Lỗi: Không tìm thấy file '{XLSX_FILE_PATH}'.")
+        return
+    if not es_client.indices.exists(index=INDEX_NAME):
+        print(f"Index '{INDEX_NAME}' chưa có, chuyển sang nạp toàn bộ.")
+        process_and_embed_data(resume=False)
+        return
+
+    start = time.perf_counter()
+    records = [r for df in iter_catalog_chunks(XLSX_FILE_PATH, INGEST_CHUNK_ROWS) for r in dataframe_records(df)]
+    indexed = _fetch_indexed_state()
+    now = time.strftime("%Y-%m-%dT%H:%M:%S")
+
+    counts = {"new": 0, "changed": 0, "unchanged": 0, "revived": 0, "deleted": 0, "reembedded": 0}
+    pending = []  # (mã, action, URL ảnh cần tạo embedding hoặc None)
+    changed_images = set()
+    seen = set()
+    for record in records:
+        code = record['product_code']
+        seen.add(code)
+        digest = record_content_hash(record)
+        current = indexed.get(code)
+        if current is not None and current.get("content_hash") == digest and not current.get("deleted"):
+            counts["unchanged"] += 1
+            continue
+
+        image_url = record.get('avatar_images')
+        if current is None:
+            counts["new"] += 1
+            image_changed = True
+            action = {"_op_type": "index", "_index": INDEX_NAME, "_id": code,
+                      "_source": dict(record, content_hash=digest, deleted=False, image_embedding=None)}
+        else:
+            counts["changed"] += 1
+            doc = {
+                field: record.get(field) for field in CATALOG_COLUMNS
+                if field != 'product_code' and normalize_catalog_value(record.get(field)) != normalize_catalog_value(current.get(field))
             }
-        }
-        actions.append(action)
+            doc["content_hash"] = digest
+            if current.get("deleted"):
+                counts["revived"] += 1
+                doc.update(deleted=False, deleted_at=None)
+            image_changed = "avatar_images" in doc
+            if image_changed:
+                doc["image_embedding"] = None
+            action = {"_op_type": "update", "_index": INDEX_NAME, "_id": code, "doc": doc}
+        if image_changed:
+            changed_images.add(code)
+        embed_url = image_url if image_changed and isinstance(image_url, str) and image_url.startswith('http') else None
+        pending.append((code, action, embed_url))
+
+    tombstones = [
+        {"_op_type": "update", "_index": INDEX_NAME, "_id": code, "doc": {"deleted": True, "deleted_at": now}}
+        for code, current in indexed.items() if code not in seen and not current.get("deleted")
+    ]
+    counts["deleted"] = len(tombstones)
 
+    new_embeddings = {}
+    embed_targets = [(code, url) for code, _, url in pending if url]
+    if embed_targets:
+        client = EmbeddingClient(max_concurrency=INGEST_EMBED_WORKERS)
+        try:
+            vectors = embed_catalog_images([url for _, url in embed_targets], client, open_embedding_store())
+        finally:
+            client.close()
+        new_embeddings = {code: vector for (code, _), vector in zip(embed_targets, vectors) if vector is not None}
+        counts["reembedded"] = len(embed_targets)
+    for code, action, _ in pending:
+        if code in changed_images:
+            target = action["_source"] if action["_op_type"] == "index" else action["doc"]
+            target["image_embedding"] = new_embeddings.get(code)
+
+    actions = [action for _, action, _ in pending] + tombstones
+    print(f"Delta: {counts['new']} mới, {counts['changed']} thay đổi ({counts['revived']} bán lại), "
+          f"{counts['deleted']} bị xóa, {counts['unchanged']} không đổi; tạo lại {counts['reembedded']} embedding ảnh.")
     if not actions:
-        print("Không có dữ liệu hợp lệ để cập nhật.")
-        return
+        print(f"Catalog không thay đổi ({time.perf_counter() - start:.1f}s).")
+        return counts
+
+    success, errors = _push_actions(actions)
+    print(f"Cập nhật delta thành công: {success}/{len(actions)} thao tác ({time.perf_counter() - start:.1f}s).")
+    for i, error in enumerate(errors[:5]):
+        print(f"  Lỗi {i+1}: {error}")
 
-    print(f"\nChuẩn bị cập nhật {len(actions)} sản phẩm...")
+    if success:
+        bump_catalog_version()
+        # Snapshot mới: embedding của snapshot trước, thay bằng embedding vừa tạo cho sản phẩm đổi ảnh
+        previous = open_current_snapshot()
+        embeddings_by_code = previous.embeddings_by_code() if previous else {}
+        for code in changed_images:
+            embeddings_by_code.pop(code, None)
+        embeddings_by_code.update(new_embeddings)
+        missing = [
+            r['product_code'] for r in records
+            if r['product_code'] not in embeddings_by_code and r['product_code'] not in changed_images
+            and str(r.get('avatar_images') or '').startswith('http')
+        ]
+        if missing:
+            embeddings_by_code.update(_fetch_embeddings(missing))
+        emit_catalog_snapshot(records, embeddings_by_code)
+    counts["errors"] = len(errors)
+    return counts
+
+def update_inventory_and_price(feed_path=None):
+    """
+    Cập nhật tồn kho và giá từ feed (csv / parquet / json / jsonl, mặc định file XLSX catalog).
+    Feed được so vector hóa với trạng thái đã đồng bộ lần trước; chỉ các sản phẩm đổi
+    'inventory' hoặc 'lifecare_price' mới được gửi cập nhật một phần lên Elasticsearch.
+    """
+    feed_path = feed_path or XLSX_FILE_PATH
+    start = time.perf_counter()
     try:
-        success, failed = bulk(es_client, actions, raise_on_error=False)
-        print(f"Cập nhật thành công: {success} sản phẩm.")
-        if failed:
-            print(f"Cập nhật thất bại: {len(failed)} sản phẩm.")
-            for i, fail_info in enumerate(failed[:5]):
-                # In ra thông tin lỗi chi tiết
-                print(f"  Lỗi {i+1} với ID '{fail_info['update']['_id']}': {fail_info['update']['error']}")
+        current = load_inventory_feed(feed_path)
+    except FileNotFoundError:
+        print(f"Lỗi: Không tìm thấy file '{feed_path}'.")
+        return
+    previous = load_synced_state(INVENTORY_SYNC_STATE_PATH)
+    changed = diff_inventory(current, previous)
+    print(f"Feed có {len(current)} sản phẩm, {len(changed)} sản phẩm đổi tồn kho / giá.")
+    if changed.empty:
+        if previous is None:
+            save_synced_state(INVENTORY_SYNC_STATE_PATH, current, None, [])
+        print("Không có dữ liệu nào cần cập nhật.")
+        return
 
+    actions = (
+        {
+            "_op_type": "update",
+            "_index": INDEX_NAME,
+            "_id": code,
+            "doc": {"inventory": int(inventory), "lifecare_price": float(price)}
+        }
+        for code, inventory, price in zip(changed.index, changed['inventory'], changed['lifecare_price'])
+    )
+    try:
+        success, errors = _push_actions(actions)
     except Exception as e:
         print(f"Đã xảy ra lỗi khi cập nhật dữ liệu hàng loạt: {e}")
+        return
+
+    missing, failed = [], []
+    for error in errors:
+        item = error.get('update', {})
+        (missing if item.get('status') == 404 else failed).append(str(item.get('_id')))
+    save_synced_state(INVENTORY_SYNC_STATE_PATH, current, previous, failed)
+    print(f"Cập nhật thành công: {success} sản phẩm ({time.perf_counter() - start:.1f}s).")
+    if missing:
+        print(f"Không có trong index: {len(missing)} sản phẩm (ví dụ {', '.join(missing[:5])}).")
+    if failed:
+        print(f"Cập nhật thất bại: {len(failed)} sản phẩm, sẽ gửi lại ở lần đồng bộ sau.")
+        for i, error in enumerate(errors[:5]):
+            print(f"  Lỗi {i+1} với ID '{error['update']['_id']}': {error['update'].get('error')}")
+
+    if success:
+        bump_catalog_version()
+        # Snapshot mới với giá / tồn kho đã cập nhật, giữ nguyên embedding của snapshot trước
+        ok = changed[~changed.index.isin(missing + failed)]
+        try:
+            publish_updated_snapshot({
+                code: {"inventory": int(inventory), "lifecare_price": float(price)}
+                for code, inventory, price in zip(ok.index, ok['inventory'], ok['lifecare_price'])
+            })
+        except OSError as e:
+            print(f"Không thể ghi snapshot catalog: {e}")
 
 if __name__ == "__main__":
-    # --- Chạy lần đầu ---
-    print("Bắt đầu quá trình tạo index và đẩy dữ liệu mới...")
-    create_index_with_embedding_mapping()
-    process_and_embed_data()
-    print("\nQuá trình xử lý và index dữ liệu ban đầu đã hoàn tất.")
+    if "--rollback" in sys.argv:
+        # --- Quay lại phiên bản index trước ---
+        rollback_index()
+    elif "--delta" in sys.argv:
+        # --- Đồng bộ delta: chỉ gửi các sản phẩm thêm / đổi / bị xóa ---
+        print("Bắt đầu đồng bộ delta catalog...")
+        sync_catalog_delta()
+        print("\nQuá trình đồng bộ delta đã hoàn tất.")
+    else:
+        # --- Chạy lần đầu ---
+        print("Bắt đầu quá trình tạo index và đẩy dữ liệu mới...")
+        # Chạy lại sau khi bị ngắt sẽ tiếp tục từ checkpoint; thêm --restart để nạp lại từ đầu
+        process_and_embed_data(resume="--restart" not in sys.argv)
+        print("\nQuá trình xử lý và index dữ liệu ban đầu đã hoàn tất.")
 
     # --- Cập nhật hàng ngày ---
     # print("Bắt đầu quá trình cập nhật giá và tồn kho...")
-    # update_inventory_and_price()
-    # print("\nQuá trình cập nhật đã hoàn tất.")
\ No newline at end of file
+    # update_inventory_and_price()  # hoặc update_inventory_and_price("feeds/inventory.parquet")
+    # print("\nQuá trình cập nhật đã hoàn tất.")
+    # Trong chatbot, đặt INVENTORY_FEED_PATH để đồng bộ tồn kho / giá định kỳ (src/services/inventory_sync.py)
\ No newline at end of file
@@ -1,5 +1,7 @@
 from fastapi import HTTPException
-from typing import Dict, Any, List, Set
+from typing import Dict, Any, List, Set, Optional, Callable, Awaitable
+import asyncio
+import copy
 import threading
 import io
 import requests
@@ -8,25 +10,151 @@ import google.generativeai as genai
 from collections import defaultdict
 
 from src.models.schemas import ChatRequest, ChatResponse, ImageInfo, PurchaseItem, CustomerInfo, ControlBotRequest
-from src.services.intent_service import analyze_intent_and_extract_entities, extract_customer_info
-from src.services.search_service import search_products, search_products_by_image
-from src.services.response_service import generate_llm_response
+from src.services.intent_service import analyze_intent_and_extract_entities, analyze_intent_locally, extract_customer_info, extract_customer_info_locally
+from src.services.search_service import search_products, search_products_by_image, close_search_cursor, SearchUnavailableError
+from src.services.response_service import generate_llm_response, generate_templated_response
+from src.services.health_service import should_use_degraded_mode
+from src.services.image_embedding_service import get_image_embedding
+from src.services.prefetch_service import schedule_prefetch, take_prefetched, cancel_prefetch
 from src.utils.helpers import is_asking_for_more, format_history_text
-from src.config.settings import PAGE_SIZE
-from src.services.response_service import evaluate_and_choose_product, evaluate_purchase_confirmation, filter_products_with_ai
+from src.config.settings import DISCONNECT_POLL_INTERVAL, CHAT_DEADLINE_SECONDS, CHAT_DEADLINE_GRACE_SECONDS, STAGE_MIN_BUDGET
+from src.services.response_service import evaluate_and_choose_product, evaluate_and_choose_product_locally, evaluate_purchase_confirmation, evaluate_purchase_confirmation_locally, filter_products_with_ai
+from src.utils.turn_context import TurnContext, TurnCancelled, Deadline, set_current_turn, reset_current_turn, raise_if_cancelled, record_turn_completed, record_turn_cancelled, record_turn_deadline_exceeded, record_turn_failed, timed_stage, annotate_turn
+from src.services.traffic_capture import capture_turn
+from src.utils.metrics import Gauge, Histogram
+from src.utils.tracing import make_span, export_spans
+from src.utils.logging_setup import get_logger
 import time
+
+logger = get_logger(__name__)
 HANDOVER_TIMEOUT = 900
 
 chat_history: Dict[str, Dict[str, Any]] = {}
 chat_history_lock = threading.Lock()
+DEADLINE_EXCEEDED_REPLY = "Dạ, em xin lỗi, hệ thống đang phản hồi chậm, anh/chị vui lòng nhắn lại giúp em sau ít phút ạ."
+SEARCH_UNAVAILABLE_REPLY = "Dạ, em xin lỗi, hệ thống tra cứu sản phẩm đang tạm gián đoạn, anh/chị vui lòng nhắn lại giúp em sau ít phút ạ."
+# Số trang tối đa đọc trong một lượt "xem thêm" khi các trang chỉ gồm sản phẩm đã gửi
+MAX_MORE_PRODUCTS_PAGES = 5
+IMAGE_SEARCH_SKIPPED_REPLY = "Dạ, hệ thống đang hơi chậm nên em chưa xem kịp ảnh của mình, anh/chị cho em xin tên, thương hiệu hoặc model sản phẩm để em tra cứu ngay ạ."
 bot_running = True
 bot_state_lock = threading.Lock()
+TURN_SECONDS = Histogram("chat_turn_duration_seconds", "Thời gian xử lý một lượt chat", ["outcome", "branch"])
+TURNS_IN_FLIGHT = Gauge("chat_turns_in_flight", "Số lượt chat đang xử lý")
+# Giữ tham chiếu tới các tác vụ nền (đóng PIT, ...) để không bị thu hồi giữa chừng
+_background_tasks: Set[asyncio.Task] = set()
 
 def _get_product_key(product: Dict) -> str:
     """Tạo một key định danh duy nhất cho sản phẩm."""
     return f"{product.get('product_name', '')}::{product.get('properties', '')}"
 
-async def chat_endpoint(request: ChatRequest, session_id: str = "default") -> ChatResponse:
+def _run_in_background(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+def _discard_cursor(cursor: Optional[Dict]):
+    """Đóng point-in-time của cursor cũ ở chế độ nền."""
+    if cursor and cursor.get("pit_id"):
+        _run_in_background(close_search_cursor(cursor))
+
+async def chat_endpoint(request: ChatRequest, session_id: str = "default", is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+                        trace_id: Optional[str] = None, parent_span_id: Optional[str] = None) -> ChatResponse:
+    """
+    Xử lý một lượt chat. Nếu client ngắt kết nối giữa chừng, toàn bộ pipeline
+    (LLM, tìm kiếm) bị hủy và trạng thái session được giữ nguyên như trước lượt đó.
+    Mỗi lượt có một ngân sách thời gian (Deadline) truyền qua mọi bước; quá ngân sách
+    cộng thời gian ân hạn thì lượt bị cắt và trả về câu trả lời xin lỗi.
+    `trace_id` / `parent_span_id` (từ header traceparent) gắn span của lượt vào trace của client.
+    """
+    started_at = time.time()
+    start_ns = time.time_ns()
+    deadline = Deadline(CHAT_DEADLINE_SECONDS)
+    turn = TurnContext(session_id, deadline, trace_id, parent_span_id)
+    TURNS_IN_FLIGHT.inc()
+    context_token = set_current_turn(turn)
+    try:
+        pipeline = asyncio.create_task(_process_chat_turn(request, session_id, deadline))
+    finally:
+        reset_current_turn(context_token)
+
+    watcher = None
+    if is_disconnected is not None:
+        watcher = asyncio.create_task(_watch_disconnect(is_disconnected, turn, pipeline))
+
+    recorded = []
+
+    def capture(outcome: str, response: ChatResponse = None):
+        """Metric, span và bản ghi traffic của lượt khi đã có kết quả."""
+        recorded.append(outcome)
+        TURN_SECONDS.observe(time.time() - started_at, outcome=outcome, branch=turn.annotations.get("branch") or "none")
+        if turn.spans is not None:
+            attributes = {"outcome": outcome, "branch": turn.annotations.get("branch"), "degraded": bool(turn.annotations.get("degraded")), "tokens": turn.tokens_used}
+            root = make_span(turn.trace_id, turn.span_id, turn.parent_span_id, "chat_turn", start_ns, time.time_ns(), attributes, outcome != "completed")
+            export_spans([root] + turn.spans)
+        capture_turn(turn, session_id, request.message, request.model_choice, request.image_url, started_at, outcome, response)
+
+    try:
+        done, _ = await asyncio.wait({pipeline}, timeout=CHAT_DEADLINE_SECONDS + CHAT_DEADLINE_GRACE_SECONDS)
+        if not done:
+            turn.cancel()
+            pipeline.cancel()
+            record_turn_deadline_exceeded(turn)
+            logger.warning("Lượt chat của session %s vượt quá %ss, đã cắt.", session_id, CHAT_DEADLINE_SECONDS)
+            with chat_history_lock:
+                current_history = chat_history.get(session_id, {}).get("messages", []).copy()
+            capture("deadline_exceeded")
+            return ChatResponse(reply=DEADLINE_EXCEEDED_REPLY, history=current_history, human_handover_required=False)
+        try:
+            response = pipeline.result()
+        except SearchUnavailableError as e:
+            # Không trả lời "không có sản phẩm" khi thực ra là không tra cứu được; session giữ nguyên
+            logger.warning("Session %s: không thể tra cứu sản phẩm (%s).", session_id, e)
+            with chat_history_lock:
+                current_history = chat_history.get(session_id, {}).get("messages", []).copy()
+            response = ChatResponse(reply=SEARCH_UNAVAILABLE_REPLY, history=current_history, human_handover_required=False)
+            record_turn_failed(turn, "search_unavailable")
+            capture("search_unavailable", response)
+            return response
+        except Exception:
+            # Lỗi trong pipeline (kể cả HTTPException) vẫn được FastAPI trả về như trước, nhưng được ghi nhận riêng
+            record_turn_failed(turn, "error")
+            capture("error")
+            raise
+        record_turn_completed(turn)
+        capture("completed", response)
+        return response
+    except (asyncio.CancelledError, TurnCancelled):
+        if not turn.cancelled:
+            pipeline.cancel()
+            raise
+        record_turn_cancelled(turn)
+        capture("cancelled")
+        logger.info("Client của session %s đã ngắt kết nối. Đã hủy lượt chat (đã dùng ~%d token).", session_id, turn.tokens_used)
+        return ChatResponse(reply="", history=[], human_handover_required=False)
+    finally:
+        if not recorded:
+            # Lượt bị dừng mà không phải do client ngắt kết nối (ví dụ server tắt giữa chừng)
+            record_turn_failed(turn, "aborted")
+            capture("aborted")
+        TURNS_IN_FLIGHT.dec()
+        if watcher:
+            watcher.cancel()
+
+async def _watch_disconnect(is_disconnected: Callable[[], Awaitable[bool]], turn: TurnContext, pipeline: asyncio.Task):
+    """Theo dõi kết nối của client, hủy pipeline khi client bỏ đi."""
+    while not pipeline.done():
+        try:
+            if await is_disconnected():
+                turn.cancel()
+                pipeline.cancel()
+                return
+        except Exception as e:
+            logger.warning("Lỗi khi kiểm tra kết nối client: %s", e)
+            return
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+async def _process_chat_turn(request: ChatRequest, session_id: str, deadline: Deadline) -> ChatResponse:
     with bot_state_lock:
         if not bot_running:
             return ChatResponse(reply="", history=[], human_handover_required=False)
@@ -42,7 +170,7 @@ async def chat_endpoint(request: ChatRequest, session_id: str = "default") -> Ch
         session_data = chat_history.get(session_id, {
             "messages": [],
             "last_query": None,
-            "offset": 0,
+            "search_cursor": None,
             "shown_product_keys": set(),
             "state": None, 
             "pending_purchase_item": None,
@@ -51,8 +179,14 @@ async def chat_endpoint(request: ChatRequest, session_id: str = "default") -> Ch
             "collected_customer_info": {},
             "has_past_purchase": False,
             "pending_order": None # Thêm biến để theo dõi giỏ hàng
-        }).copy()
-        history = session_data["messages"][-8:].copy()
+        })
+        # Sao chép sâu: lượt chat chỉ ghi lại vào chat_history ở _update_chat_history,
+        # nên nếu bị hủy giữa chừng thì session vẫn nguyên vẹn.
+        session_data = copy.deepcopy(session_data)
+        history = session_data["messages"][-8:]
+
+    if session_data.get("state") in ("stop_bot", "human_chatting", "human_calling"):
+        annotate_turn(branch=session_data["state"])
 
     if session_data.get("state") == "stop_bot":
         _update_chat_history(session_id, user_query, "", session_data)
@@ -67,21 +201,30 @@ async def chat_endpoint(request: ChatRequest, session_id: str = "default") -> Ch
         _update_chat_history(session_id, user_query, response_text, session_data)
         return ChatResponse(reply=response_text, history=chat_history[session_id]["messages"].copy(), human_handover_required=False)
  
-    API_ENDPOINT = "https://embed.doiquanai.vn/embed"
+    # LLM quá tải: bỏ lọc AI, phân tích ý định, xác nhận đơn và bóc tách thông tin khách bằng từ khóa, trả lời theo mẫu
+    degraded = should_use_degraded_mode()
+    annotate_turn(degraded=degraded)
+    if degraded:
+        logger.info("Session %s: xử lý ở chế độ degraded.", session_id)
+
     if image_url:
-        print(f"Phát hiện hình ảnh từ URL: {image_url}, bắt đầu xử lý...")
+        logger.info("Phát hiện hình ảnh từ URL: %s, bắt đầu xử lý...", image_url)
+        annotate_turn(branch="image")
         try:
-            response = requests.post(API_ENDPOINT, data={"image_url": image_url}, timeout=15)
-            response.raise_for_status()
-            result = response.json()
-
-            if "embedding" in result:
-                embedding_vector = result["embedding"]
-                print(" -> Tạo embedding cho ảnh thành công.")
-            else:
-                print(" -> Lỗi từ API:", result.get("error", "Không rõ lỗi"))
-
-            retrieved_data = search_products_by_image(embedding_vector)
+            raise_if_cancelled()
+            with timed_stage("image_embedding"):
+                embedding_vector = await asyncio.to_thread(get_image_embedding, image_url, deadline)
+            if embedding_vector is None:
+                raise ValueError("Không tạo được embedding cho ảnh.")
+
+            with timed_stage("image_search"):
+                retrieved_data = await search_products_by_image(embedding_vector, deadline=deadline)
+            if retrieved_data.skipped:
+                # Không kịp tra cứu ảnh: không nói là không có sản phẩm, xin khách thông tin để tìm bằng văn bản
+                annotate_turn(image_search_skipped=retrieved_data.skipped)
+                response_text = IMAGE_SEARCH_SKIPPED_REPLY
+                _update_chat_history(session_id, user_query, response_text, session_data)
+                return ChatResponse(reply=response_text, history=chat_history[session_id]["messages"].copy(), human_handover_required=False)
             if not retrieved_data:
                 response_text="Dạ, em chưa nhận ra sản phẩm, anh/chị vui lòng cho em tên, thương hiệu hoặc model để tra cứu ạ."
                 _update_chat_history(session_id, user_query, response_text, session_data)
@@ -90,22 +233,34 @@ async def chat_endpoint(request: ChatRequest, session_id: str = "default") -> Ch
             if not user_query:
                 user_query = "Ảnh này là sản phẩm gì vậy shop?"
 
-            response_text = generate_llm_response(
-                user_query=user_query,
-                search_results=retrieved_data,
-                history=history,
-                model_choice=model_choice,
-                is_image_search=True
-            )
+            if degraded:
+                response_text = generate_templated_response(retrieved_data)
+            else:
+                with timed_stage("generation"):
+                    response_text = await asyncio.to_thread(
+                        generate_llm_response,
+                        user_query=user_query,
+                        search_results=retrieved_data,
+                        history=history,
+                        model_choice=model_choice,
+                        is_image_search=True,
+                        deadline=deadline
+                    )
             
             _update_chat_history(session_id, user_query, response_text, session_data)
             return ChatResponse(reply=response_text, history=chat_history[session_id]["messages"].copy(), human_handover_required=False)
 
+        except SearchUnavailableError:
+            raise
         except Exception as e:
-            print(f"Lỗi nghiêm trọng trong luồng xử lý ảnh: {e}")
+            logger.exception("Lỗi nghiêm trọng trong luồng xử lý ảnh: %s", e)
             return ChatResponse(reply="Dạ, em xin lỗi, đã có lỗi xảy ra khi xem hình ảnh của mình ạ.", history=history)
     
-    analysis_result = analyze_intent_and_extract_entities(user_query, history, model_choice)
+    with timed_stage("intent"):
+        if degraded:
+            analysis_result = analyze_intent_locally(user_query)
+        else:
+            analysis_result = await asyncio.to_thread(analyze_intent_and_extract_entities, user_query, history, model_choice, deadline)
 
     asking_for_more = is_asking_for_more(user_query)
 
@@ -113,6 +268,7 @@ async def chat_endpoint(request: ChatRequest, session_id: str = "default") -> Ch
     response_text = ""
 
     if user_query.strip().lower() == "/bot":
+        annotate_turn(branch="bot_command")
         session_data["state"] = None
         session_data["negativity_score"] = 0
         response_text = "Dạ, em có thể giúp gì tiếp cho anh/chị ạ?"
@@ -120,8 +276,13 @@ async def chat_endpoint(request: ChatRequest, session_id: str = "default") -> Ch
         return ChatResponse(reply=response_text, history=chat_history[session_id]["messages"].copy(), human_handover_required=False)
 
     if session_data.get("state") == "awaiting_purchase_confirmation":
+        annotate_turn(branch="purchase_confirmation")
         history_text = format_history_text(history, limit=4)
-        evaluation = evaluate_purchase_confirmation(user_query, history_text, model_choice)
+        with timed_stage("confirmation"):
+            if degraded:
+                evaluation = evaluate_purchase_confirmation_locally(user_query)
+            else:
+                evaluation = await asyncio.to_thread(evaluate_purchase_confirmation, user_query, history_text, model_choice, deadline)
         decision = evaluation.get("decision")
         if decision == "CONFIRM":
             collected_info = session_data.get("collected_customer_info", {})
@@ -205,8 +366,13 @@ async def chat_endpoint(request: ChatRequest, session_id: str = "default") -> Ch
                 _update_chat_history(session_id, user_query, response_text, session_data)
                 return ChatResponse(reply=response_text, history=chat_history[session_id]["messages"].copy())
         else:
+            annotate_turn(branch="customer_info")
             current_info = session_data.get("collected_customer_info", {})
-            extracted_info = extract_customer_info(user_query, model_choice)
+            with timed_stage("customer_info"):
+                if degraded:
+                    extracted_info = extract_customer_info_locally(user_query)
+                else:
+                    extracted_info = await asyncio.to_thread(extract_customer_info, user_query, model_choice, deadline)
 
             for key, value in extracted_info.items():
                 if value and not current_info.get(key):
@@ -277,10 +443,12 @@ async def chat_endpoint(request: ChatRequest, session_id: str = "default") -> Ch
     response_text = ""
 
     if analysis_result.get("is_add_to_order_intent"):
+        annotate_turn(branch="add_to_order")
         response_text = "Dạ vâng, anh/chị muốn mua thêm sản phẩm nào ạ?"
         session_data["last_query"] = None
 
     if analysis_result.get("is_bank_transfer"):
+        annotate_turn(branch="bank_transfer")
         response_text = "Dạ, anh/chị đợi chút, nhân viên bên em sẽ vào ngay ạ."
         session_data["state"] = "human_calling"
         session_data["handover_timestamp"] = time.time()
@@ -295,6 +463,7 @@ async def chat_endpoint(request: ChatRequest, session_id: str = "default") -> Ch
     if analysis_result.get("is_negative"):
         session_data["negativity_score"] += 1
         if session_data["negativity_score"] >= 3:
+            annotate_turn(branch="negative_handover")
             response_text = "Em đã báo nhân viên phụ trách, anh/chị vui lòng đợi để được hỗ trợ ngay ạ."
             session_data["state"] = "human_calling"
             session_data["handover_timestamp"] = time.time()
@@ -309,6 +478,7 @@ async def chat_endpoint(request: ChatRequest, session_id: str = "default") -> Ch
             )
 
     if analysis_result.get("wants_store_info"):
+        annotate_turn(branch="store_info")
         response_text = "Dạ, anh/chị có thể đến xem và mua hàng trực tiếp tại cửa hàng Hoàng Mai Mobile ở địa chỉ:\n👉 Số 8 ngõ 117 Thái Hà, Phường Trung Liệt, Quận Đống Đa, Hà Nội.\n👉 SĐT: 0982153333\n👉 Link google map: https://maps.app.goo.gl/HM9RTi64wpC1GgFp8?g_st=ic"
         map_image_url = "https://s3.hn-1.cloud.cmctelecom.vn/dangbai/hmstore.jpg"
         map_image = [
@@ -329,6 +499,7 @@ async def chat_endpoint(request: ChatRequest, session_id: str = "default") -> Ch
         )
     
     if analysis_result.get("wants_warranty_service"):
+        annotate_turn(branch="warranty")
         if session_data.get("has_past_purchase"):
             response_text = "Dạ anh/chị đợi chút, nhân viên phụ trách bảo hành bên em sẽ vào trả lời ngay ạ."
             session_data["state"] = "human_calling"
@@ -353,6 +524,7 @@ async def chat_endpoint(request: ChatRequest, session_id: str = "default") -> Ch
         )
     
     if analysis_result.get("wants_human_agent"):
+        annotate_turn(branch="human_agent")
         response_text = "Em đã báo nhân viên phụ trách, anh/chị vui lòng đợi để được hỗ trợ ngay ạ."
         session_data["state"] = "human_calling"
         session_data["handover_timestamp"] = time.time()
@@ -366,8 +538,12 @@ async def chat_endpoint(request: ChatRequest, session_id: str = "default") -> Ch
             has_negativity=False
         )
 
+    # Khách chuyển sang chủ đề khác: trang "xem thêm" đã tải trước không còn cần nữa
+    if not (asking_for_more and session_data.get("last_query")):
+        cancel_prefetch(session_id)
+
     if analysis_result.get("is_purchase_intent"):
-        
+        annotate_turn(branch="purchase")
 
         if "pending_order" not in session_data or session_data["pending_order"] is None:
             products_from_intent = analysis_result.get("search_params", {}).get("products", [])
@@ -399,14 +575,29 @@ async def chat_endpoint(request: ChatRequest, session_id: str = "default") -> Ch
 
 
                     best_evaluation = None
+                    # Trang đầu không mở PIT để dùng được cache kết quả (vòng mua hàng lặp lại cùng truy vấn
+                    # qua nhiều lượt); PIT chỉ được mở khi thực sự cần trang thứ hai
                     MAX_SEARCH_PAGES = 5 
+                    page_cursor = None
                     for page in range(MAX_SEARCH_PAGES):
-                        found_products = search_products(
-                            product_name=product_name_intent,
-                            category=item_intent.get("category"),
-                            properties=properties_intent,
-                            offset=page * PAGE_SIZE
-                        )
+                        # Trang trước đã là trang cuối
+                        if page > 0 and page_cursor is None:
+                            break
+                        # Không đủ thời gian cho thêm một trang tìm kiếm + đánh giá thì dừng với kết quả tốt nhất hiện có
+                        if page > 0 and not deadline.has(STAGE_MIN_BUDGET["evaluation"] + STAGE_MIN_BUDGET["generation"]):
+                            logger.info("Hết ngân sách thời gian, dừng duyệt thêm trang tìm kiếm.")
+                            break
+
+                        with timed_stage("search"):
+                            found_products = await search_products(
+                                product_name=product_name_intent,
+                                category=item_intent.get("category"),
+                                properties=properties_intent,
+                                cursor=page_cursor,
+                                source_profile="purchase",
+                                deadline=deadline
+                            )
+                        page_cursor = found_products.cursor
                         
                         previous_suggestion = None
                         if item.get("evaluation") and item["evaluation"].get("type") == "CLOSE_MATCH":
@@ -420,9 +611,17 @@ async def chat_endpoint(request: ChatRequest, session_id: str = "default") -> Ch
                         if not found_products and page > 0: break
 
                         # FIX: Pass the actual user_query to the evaluation function
-                        current_evaluation = evaluate_and_choose_product(
-                            query_for_evaluation, history_text, found_products, model_choice
-                        )
+                        with timed_stage("evaluation"):
+                            if degraded:
+                                # LLM quá tải: chọn theo từ khóa, không gọi LLM cho từng trang của từng sản phẩm
+                                suggestion_confirmed = bool(previous_suggestion) and evaluate_purchase_confirmation_locally(user_query)["decision"] == "CONFIRM"
+                                current_evaluation = evaluate_and_choose_product_locally(
+                                    product_name_intent, properties_intent, found_products, suggestion_confirmed
+                                )
+                            else:
+                                current_evaluation = await asyncio.to_thread(
+                                    evaluate_and_choose_product, query_for_evaluation, history_text, found_products, model_choice, deadline
+                                )
 
                         if current_evaluation.get("type") == "PERFECT_MATCH":
                             best_evaluation = current_evaluation
@@ -435,6 +634,10 @@ async def chat_endpoint(request: ChatRequest, session_id: str = "default") -> Ch
                             break
                         
                         if not found_products: break
+                        # Chế độ degraded: đánh giá theo từ khóa trên trang đầu là đủ, không đọc thêm trang
+                        if degraded: break
+
+                    _discard_cursor(page_cursor)
                     
                     item["evaluation"] = best_evaluation if best_evaluation else {"type": "NO_MATCH"}
                     
@@ -513,7 +716,8 @@ async def chat_endpoint(request: ChatRequest, session_id: str = "default") -> Ch
                         full_name = f"{suggested_prod.get('product_name')}" + (f" ({str(props).lower()})" if (props := suggested_prod.get('properties', 'N/A')) not in [0, '0', None, '', 'N/A'] else '')
                         # suggestion_messages.append(f"  - {full_name} - {eval_data['reason']}")
                         suggestion_messages.append(f"  - {full_name}")
-                    response_parts.append(f"Em tìm thấy một số sản phẩm gần giống anh chị nói, anh/chị xem có phải không ạ:\n{'\n'.join(suggestion_messages)}")
+                    suggestions_text = "\n".join(suggestion_messages)
+                    response_parts.append(f"Em tìm thấy một số sản phẩm gần giống anh chị nói, anh/chị xem có phải không ạ:\n{suggestions_text}")
 
 
             if not failed_items_list and confirmed_items:
@@ -529,16 +733,24 @@ async def chat_endpoint(request: ChatRequest, session_id: str = "default") -> Ch
             response_text = "Dạ, anh/chị muốn mua sản phẩm nào ạ?"
 
     elif asking_for_more and session_data.get("last_query"):
-        response_text, retrieved_data, product_images = _handle_more_products(
-            user_query, session_data, history, model_choice, analysis_result
+        annotate_turn(branch="more_products")
+        response_text, retrieved_data, product_images = await _handle_more_products(
+            session_id, user_query, session_data, history, model_choice, analysis_result, deadline, degraded
         )
     else:
+        annotate_turn(branch="new_query")
         session_data["shown_product_keys"] = set()
-        response_text, retrieved_data, product_images = _handle_new_query(
-            user_query, session_data, history, model_choice, analysis_result
+        response_text, retrieved_data, product_images = await _handle_new_query(
+            user_query, session_data, history, model_choice, analysis_result, deadline, degraded
         )
 
     _update_chat_history(session_id, user_query, response_text, session_data)
+
+    # Tải trước trang tiếp theo trong lúc khách đọc câu trả lời
+    if retrieved_data and session_data.get("last_query") and not analysis_result.get("is_purchase_intent"):
+        prefetch_history = format_history_text(history + [{"user": user_query, "bot": response_text}], limit=6)
+        schedule_prefetch(session_id, session_data["last_query"], session_data.get("search_cursor"), user_query, prefetch_history, filter_with_ai=not degraded)
+
     images = _process_images(analysis_result.get("wants_images", False), retrieved_data, product_images)
 
     action_data = None
@@ -571,7 +783,7 @@ async def control_bot_endpoint(request: ControlBotRequest, session_id: str):
             chat_history[session_id] = {
                 "messages": [],
                 "last_query": None,
-                "offset": 0,
+                "search_cursor": None,
                 "shown_product_keys": set(),
                 "state": None,
                 "pending_purchase_item": None,
@@ -581,7 +793,7 @@ async def control_bot_endpoint(request: ControlBotRequest, session_id: str):
                 "has_past_purchase": False,
                 "pending_order": None # Thêm biến để theo dõi giỏ hàng
             }
-            print(f"Đã tạo session mới: {session_id} thông qua control endpoint.")
+            logger.info("Đã tạo session mới: %s thông qua control endpoint.", session_id)
 
         command = request.command.lower()
         
@@ -616,7 +828,7 @@ async def human_chatting_endpoint(session_id: str):
             chat_history[session_id] = {
                 "messages": [],
                 "last_query": None,
-                "offset": 0,
+                "search_cursor": None,
                 "shown_product_keys": set(),
                 "state": None,
                 "pending_purchase_item": None,
@@ -627,7 +839,7 @@ async def human_chatting_endpoint(session_id: str):
                 "pending_order": None # Thêm biến để theo dõi giỏ hàng
             }
             message = f"Session {session_id} đã được tạo mới và chuyển sang trạng thái human_chatting."
-            print(f"Đã tạo session mới: {session_id} thông qua human_chatting endpoint.")
+            logger.info("Đã tạo session mới: %s thông qua human_chatting endpoint.", session_id)
         else:
             message = f"Bot cho session {session_id} đã chuyển sang trạng thái human_chatting."
 
@@ -635,38 +847,74 @@ async def human_chatting_endpoint(session_id: str):
         chat_history[session_id]["handover_timestamp"] = time.time()
         return {"status": "success", "message": message}
  
-def _handle_more_products(user_query: str, session_data: dict, history: list, model_choice: str, analysis: dict):
+async def _handle_more_products(session_id: str, user_query: str, session_data: dict, history: list, model_choice: str, analysis: dict, deadline: Deadline = None, degraded: bool = False):
     last_query = session_data["last_query"]
-    new_offset = session_data["offset"] + PAGE_SIZE
-
-    retrieved_data = search_products(
-        product_name=last_query["product_name"],
-        category=last_query["category"],
-        properties=last_query["properties"],
-        offset=new_offset,
-        strict_properties=True,
-        strict_category=True
-    )
+    cursor = session_data.get("search_cursor")
+    if cursor and cursor.get("exhausted"):
+        return "Dạ, hết rồi ạ.", [], []
 
-    history_text = format_history_text(history, limit=6)
-    retrieved_data = filter_products_with_ai(user_query, history_text, retrieved_data)
-    
+    with timed_stage("prefetch_wait"):
+        prefetched = await take_prefetched(session_id, last_query, cursor, deadline)
+
+    # Lần "xem thêm" đầu tiên chạy truy vấn chặt (strict) từ trang đầu dưới một PIT mới; các lần sau nối tiếp
+    # bằng cursor (PIT + search_after) nên các trang không chồng lấn nhau. Trang chỉ gồm sản phẩm đã gửi
+    # (trang đầu của truy vấn chặt thường trùng với kết quả tìm mới) thì đọc tiếp trang sau.
     shown_keys = session_data["shown_product_keys"]
-    new_products = [p for p in retrieved_data if _get_product_key(p) not in shown_keys]
+    new_products = []
+    for page in range(MAX_MORE_PRODUCTS_PAGES):
+        if page == 0 and prefetched is not None:
+            retrieved_data, page_cursor, already_filtered = prefetched
+        else:
+            if page > 0 and deadline and not deadline.has(STAGE_MIN_BUDGET["filter"] + STAGE_MIN_BUDGET["generation"]):
+                logger.info("Hết ngân sách thời gian, dừng duyệt thêm trang tìm kiếm.")
+                break
+            with timed_stage("search"):
+                retrieved_data = await search_products(
+                    product_name=last_query["product_name"],
+                    category=last_query["category"],
+                    properties=last_query["properties"],
+                    cursor=cursor,
+                    strict_properties=True,
+                    strict_category=True,
+                    source_profile="detail" if analysis["wants_specs"] else "listing",
+                    deadline=deadline,
+                    paginate=True
+                )
+            page_cursor = retrieved_data.cursor
+            already_filtered = False
 
-    if not new_products:
-        response_text = "Dạ, hết rồi ạ."
-        session_data["offset"] = new_offset
-        return response_text, [], []
+        if page_cursor:
+            cursor = page_cursor
+        else:
+            _discard_cursor(cursor)
+            cursor = {"exhausted": True}
 
+        candidates = [p for p in retrieved_data if _get_product_key(p) not in shown_keys]
+        if candidates and not degraded and not already_filtered:
+            history_text = format_history_text(history, limit=6)
+            with timed_stage("filter"):
+                candidates = await asyncio.to_thread(filter_products_with_ai, user_query, history_text, candidates, deadline)
+        new_products = candidates
+        if new_products or cursor.get("exhausted"):
+            break
 
+    if not new_products:
+        session_data["search_cursor"] = cursor
+        if cursor.get("exhausted"):
+            return "Dạ, hết rồi ạ.", [], []
+        return "Dạ, em chưa tìm thêm được mẫu nào phù hợp ạ. Anh/chị nhắn \"xem thêm\" để em tìm tiếp hoặc mô tả rõ hơn sản phẩm cần tìm giúp em nhé.", [], []
 
     for p in new_products:
         shown_keys.add(_get_product_key(p))
 
-    result = generate_llm_response(
-        user_query, new_products, history, analysis["wants_specs"], model_choice, True, analysis["wants_images"]
-    )
+    if degraded:
+        result = generate_templated_response(new_products, analysis["wants_specs"], True, analysis["wants_images"])
+    else:
+        with timed_stage("generation"):
+            result = await asyncio.to_thread(
+                generate_llm_response, user_query, new_products, history, analysis["wants_specs"], model_choice, True, analysis["wants_images"],
+                deadline=deadline
+            )
     
     product_images = []
     if analysis["wants_images"] and isinstance(result, dict):
@@ -677,11 +925,11 @@ def _handle_more_products(user_query: str, session_data: dict, history: list, mo
     else:
         response_text = result
 
-    session_data["offset"] = new_offset
+    session_data["search_cursor"] = cursor
     session_data["shown_product_keys"] = shown_keys
     return response_text, new_products, product_images
 
-def _handle_new_query(user_query: str, session_data: dict, history: list, model_choice: str, analysis: dict):
+async def _handle_new_query(user_query: str, session_data: dict, history: list, model_choice: str, analysis: dict, deadline: Deadline = None, degraded: bool = False):
     retrieved_data = []
     product_images = []
 
@@ -696,15 +944,19 @@ def _handle_new_query(user_query: str, session_data: dict, history: list, model_
             category_to_search = first_product.get("category", user_query)
             properties_to_search = first_product.get("properties")
 
-            retrieved_data = search_products(
-                product_name=product_name_to_search,
-                category=category_to_search,
-                properties=properties_to_search,
-                offset=0
-            )
+            with timed_stage("search"):
+                retrieved_data = await search_products(
+                    product_name=product_name_to_search,
+                    category=category_to_search,
+                    properties=properties_to_search,
+                    source_profile="detail" if analysis["wants_specs"] else "listing",
+                    deadline=deadline
+                )
 
-            history_text = format_history_text(history, limit=6)
-            retrieved_data = filter_products_with_ai(user_query, history_text, retrieved_data)
+            if not degraded:
+                history_text = format_history_text(history, limit=6)
+                with timed_stage("filter"):
+                    retrieved_data = await asyncio.to_thread(filter_products_with_ai, user_query, history_text, retrieved_data, deadline)
 
             # Cập nhật last_query theo cấu trúc cũ để _handle_more_products hoạt động
             session_data["last_query"] = {
@@ -712,18 +964,25 @@ def _handle_new_query(user_query: str, session_data: dict, history: list, model_
                 "category": category_to_search,
                 "properties": properties_to_search
             }
-            session_data["offset"] = 0
+            _discard_cursor(session_data.get("search_cursor"))
+            session_data["search_cursor"] = None
             session_data["shown_product_keys"] = {_get_product_key(p) for p in retrieved_data}
         else:
             # Fallback nếu không có sản phẩm nào được intent parser trả về
             session_data["last_query"] = None
-            session_data["offset"] = 0
+            _discard_cursor(session_data.get("search_cursor"))
+            session_data["search_cursor"] = None
             session_data["shown_product_keys"] = set()
 
 
-    result = generate_llm_response(
-        user_query, retrieved_data, history, analysis["wants_specs"], model_choice, analysis["needs_search"], analysis["wants_images"]
-    )
+    if degraded:
+        result = generate_templated_response(retrieved_data, analysis["wants_specs"], analysis["needs_search"], analysis["wants_images"])
+    else:
+        with timed_stage("generation"):
+            result = await asyncio.to_thread(
+                generate_llm_response, user_query, retrieved_data, history, analysis["wants_specs"], model_choice, analysis["needs_search"], analysis["wants_images"],
+                deadline=deadline
+            )
     
     if analysis["wants_images"] and isinstance(result, dict):
         response_text = result["answer"].strip()
@@ -736,13 +995,15 @@ def _handle_new_query(user_query: str, session_data: dict, history: list, model_
     return response_text, retrieved_data, product_images
 
 def _update_chat_history(session_id: str, user_query: str, response_text: str, session_data: dict):
-    with chat_history_lock:
+    # Lượt đã bị hủy thì không ghi gì vào session
+    raise_if_cancelled()
+    with timed_stage("history"), chat_history_lock:
         current_session = chat_history.get(session_id, {
-            "messages": [], "last_query": None, "offset": 0, "shown_product_keys": set(), "state": None, "pending_purchase_item": None, "handover_timestamp": None, "negativity_score": 0, "collected_customer_info": {}, "pending_order": None
+            "messages": [], "last_query": None, "search_cursor": None, "shown_product_keys": set(), "state": None, "pending_purchase_item": None, "handover_timestamp": None, "negativity_score": 0, "collected_customer_info": {}, "pending_order": None
         })
         current_session["messages"].append({"user": user_query, "bot": response_text})
         current_session["last_query"] = session_data.get("last_query")
-        current_session["offset"] = session_data.get("offset")
+        current_session["search_cursor"] = session_data.get("search_cursor")
         current_session["shown_product_keys"] = session_data.get("shown_product_keys", set())
         current_session["state"] = session_data.get("state")
         current_session["pending_purchase_item"] = session_data.get("pending_purchase_item")
@@ -9,6 +9,53 @@ load_dotenv()
 # Cấu hình chung
 PAGE_SIZE = 10
 
+# Chu kỳ (giây) kiểm tra client còn kết nối trong lúc xử lý một lượt chat
+DISCONNECT_POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_INTERVAL", "0.5"))
+
+# Ngân sách thời gian (giây) cho một lượt chat, chia sẻ qua mọi bước của pipeline
+CHAT_DEADLINE_SECONDS = float(os.getenv("CHAT_DEADLINE_SECONDS", "25"))
+# Thời gian cộng thêm trước khi cắt cứng một lượt chat đã hết ngân sách
+CHAT_DEADLINE_GRACE_SECONDS = float(os.getenv("CHAT_DEADLINE_GRACE_SECONDS", "2"))
+# Thời gian tối thiểu cần còn lại để mỗi bước chạy đường đầy đủ (gọi LLM),
+# nếu không đủ sẽ chuyển sang đường rẻ hơn / câu trả lời dự phòng
+STAGE_MIN_BUDGET = {
+    "intent": 3.0,
+    "customer_info": 2.0,
+    "filter": 4.0,
+    "evaluation": 3.0,
+    "confirmation": 2.0,
+    "generation": 3.0,
+}
+# Timeout tối đa (giây) cho từng loại lệnh gọi ra ngoài
+EMBED_API_TIMEOUT = 15
+# Cache embedding ảnh trên đĩa (theo URL, rồi theo hash nội dung ảnh)
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "cache/image_embeddings.sqlite3")
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "50000"))
+# Ảnh lớn hơn giới hạn này (byte) không được tải về để tính hash
+EMBED_IMAGE_MAX_BYTES = int(os.getenv("EMBED_IMAGE_MAX_BYTES", str(10 * 1024 * 1024)))
+# Số lệnh gọi dịch vụ embed chạy song song với việc tải ảnh để tính hash
+EMBED_CALL_WORKERS = int(os.getenv("EMBED_CALL_WORKERS", "8"))
+LMSTUDIO_TIMEOUT = 60
+
+# Chế độ degraded khi LLM quá tải: "auto" (theo số liệu), "on" (luôn bật), "off" (tắt)
+DEGRADED_MODE = os.getenv("DEGRADED_MODE", "auto").lower()
+# Cửa sổ thời gian (giây) để tính độ trễ và tỉ lệ lỗi của các lệnh gọi LLM
+DEGRADED_WINDOW_SECONDS = float(os.getenv("DEGRADED_WINDOW_SECONDS", "60"))
+DEGRADED_MIN_SAMPLES = int(os.getenv("DEGRADED_MIN_SAMPLES", "5"))
+DEGRADED_ENTER_ERROR_RATE = float(os.getenv("DEGRADED_ENTER_ERROR_RATE", "0.5"))
+DEGRADED_ENTER_P95_SECONDS = float(os.getenv("DEGRADED_ENTER_P95_SECONDS", "12"))
+DEGRADED_EXIT_ERROR_RATE = float(os.getenv("DEGRADED_EXIT_ERROR_RATE", "0.2"))
+DEGRADED_EXIT_P95_SECONDS = float(os.getenv("DEGRADED_EXIT_P95_SECONDS", "6"))
+# Khoảng thời gian (giây) giữa các lượt thăm dò chạy pipeline đầy đủ khi đang degraded
+DEGRADED_PROBE_INTERVAL = float(os.getenv("DEGRADED_PROBE_INTERVAL", "15"))
+
+# Tải trước (prefetch) trang kết quả tiếp theo sau mỗi câu trả lời về sản phẩm, cho các câu hỏi "xem thêm"
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "true").lower() in ("1", "true", "yes")
+# Kết quả tải trước cũ hơn thời gian này (giây) sẽ bị bỏ, tìm kiếm lại khi khách hỏi
+PREFETCH_TTL_SECONDS = float(os.getenv("PREFETCH_TTL_SECONDS", "120"))
+# Số session tối đa giữ kết quả tải trước cùng lúc
+PREFETCH_MAX_SESSIONS = int(os.getenv("PREFETCH_MAX_SESSIONS", "1000"))
+
 # API Keys
 api_keys = json.loads(os.getenv("GEMINI_API_KEY"))
 GEMINI_API_KEY = random.choice(api_keys)
@@ -1,11 +1,27 @@
-from fastapi import FastAPI, Query
+from fastapi import FastAPI, Query, Request, Response
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+import asyncio
 import threading
 import time
 
 from src.config.settings import APP_CONFIG, CORS_CONFIG
 from src.models.schemas import ChatRequest, ControlBotRequest
 from src.api.routes import chat_endpoint, chat_history, chat_history_lock, HANDOVER_TIMEOUT, control_bot_endpoint, human_chatting_endpoint, power_off_bot_endpoint
+from src.utils.turn_context import get_cancellation_stats
+from src.services.health_service import get_health_stats
+from src.services.search_service import get_search_stats, close_es_client, SEARCH_BACKEND, IMAGE_SEARCH_BACKEND
+from src.services.local_search import load_catalog_index
+from src.services.image_index import build_image_index
+from src.services.image_embedding_service import get_embedding_cache_stats
+from src.services.prefetch_service import get_prefetch_stats, cancel_all_prefetches
+from src.services.inventory_sync import start_inventory_sync, stop_inventory_sync, get_inventory_sync_stats
+from src.services.traffic_capture import get_traffic_capture_stats
+from src.utils.metrics import render_metrics
+from src.utils.tracing import parse_traceparent, new_trace_id, get_tracing_stats
+from src.utils.logging_setup import get_logger, get_logging_stats, flush_logs
+
+logger = get_logger(__name__)
 
 # Khởi tạo FastAPI app
 app = FastAPI(**APP_CONFIG)
@@ -18,7 +34,7 @@ def session_timeout_scanner():
     Quét và reset các session bị timeout trong một luồng nền.
     """
     while True:
-        print("Chạy tác vụ nền: Quét các session timeout...")
+        logger.debug("Chạy tác vụ nền: Quét các session timeout...")
         with chat_history_lock:
             current_time = time.time()
             sessions_to_reactivate = []
@@ -29,7 +45,7 @@ def session_timeout_scanner():
                         sessions_to_reactivate.append(session_id)
             
             for session_id in sessions_to_reactivate:
-                print(f"Session {session_id} đã quá hạn. Kích hoạt lại bot.")
+                logger.info("Session %s đã quá hạn. Kích hoạt lại bot.", session_id)
                 chat_history[session_id]["state"] = None
                 chat_history[session_id]["negativity_score"] = 0
                 chat_history[session_id]["messages"].append({
@@ -48,16 +64,46 @@ async def startup_event():
     """
     scanner_thread = threading.Thread(target=session_timeout_scanner, daemon=True)
     scanner_thread.start()
-    print("Đã khởi động tác vụ nền để quét session timeout.")
+    logger.info("Đã khởi động tác vụ nền để quét session timeout.")
+    if SEARCH_BACKEND == "memory":
+        # Nạp sẵn chỉ mục để lượt chat đầu tiên không phải chờ đọc file catalog
+        try:
+            await asyncio.to_thread(load_catalog_index)
+        except Exception as e:
+            # Chưa có chỉ mục thì lượt chat tìm bằng Elasticsearch; chỉ mục được thử nạp lại trong nền
+            logger.warning("Không nạp được chỉ mục trong bộ nhớ, tạm dùng Elasticsearch: %s", e)
+    if IMAGE_SEARCH_BACKEND == "local":
+        try:
+            await asyncio.to_thread(build_image_index)
+        except Exception as e:
+            # Chưa có chỉ mục ảnh thì tìm bằng kNN của Elasticsearch; chỉ mục được thử dựng lại trong nền
+            logger.warning("Không dựng được chỉ mục ảnh trong bộ nhớ, tạm dùng Elasticsearch: %s", e)
+    start_inventory_sync()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """
+    Hủy các tác vụ tải trước, dừng đồng bộ tồn kho, đóng pool kết nối Elasticsearch và ghi nốt log đang chờ.
+    """
+    cancel_all_prefetches()
+    await stop_inventory_sync()
+    await close_es_client()
+    await asyncio.to_thread(flush_logs)
 
 @app.post("/chat", summary="Gửi tin nhắn đến chatbot")
-async def chat(request: ChatRequest, session_id: str = Query("default", description="ID phiên chat")):
+async def chat(request: ChatRequest, http_request: Request, response: Response, session_id: str = Query("default", description="ID phiên chat")):
     """
     Endpoint chính để tương tác với chatbot.
     - **message**: Câu hỏi của người dùng.
     - **session_id**: ID phiên chat (mặc định là 'default')
+    Nếu client ngắt kết nối trước khi có câu trả lời, lượt chat sẽ bị hủy.
+    Header `traceparent` (W3C) nếu có sẽ được dùng làm trace cha; trace ID của lượt trả về ở header X-Trace-Id.
     """
-    return await chat_endpoint(request, session_id)
+    trace_id, parent_span_id = parse_traceparent(http_request.headers.get("traceparent"))
+    trace_id = trace_id or new_trace_id()
+    response.headers["X-Trace-Id"] = trace_id
+    return await chat_endpoint(request, session_id, is_disconnected=http_request.is_disconnected,
+                               trace_id=trace_id, parent_span_id=parent_span_id)
 
 @app.post("/control-bot", summary="Dừng hoặc tiếp tục bot cho một session")
 async def control_bot(request: ControlBotRequest, session_id: str = Query(..., description="ID phiên chat")):
@@ -84,6 +130,32 @@ async def power_off_bot(request: ControlBotRequest):
     """
     return await power_off_bot_endpoint(request)
 
+@app.get("/stats", summary="Thống kê vận hành của chatbot")
+async def stats():
+    """
+    Trả về các bộ đếm vận hành: số lượt chat bị hủy do client ngắt kết nối, số token
+    ước lượng đã tiết kiệm được, tình trạng LLM và chế độ degraded.
+    """
+    return {
+        "cancellation": get_cancellation_stats(),
+        "llm_health": get_health_stats(),
+        "search": get_search_stats(),
+        "prefetch": get_prefetch_stats(),
+        "image_embedding": get_embedding_cache_stats(),
+        "inventory_sync": get_inventory_sync_stats(),
+        "traffic_capture": get_traffic_capture_stats(),
+        "tracing": get_tracing_stats(),
+        "logging": get_logging_stats(),
+    }
+
+@app.get("/metrics", summary="Metric theo định dạng Prometheus")
+async def metrics():
+    """
+    Histogram thời gian từng bước của lượt chat, lệnh gọi LLM theo provider, took của Elasticsearch,
+    số lỗi và số việc đang chạy, theo định dạng văn bản của Prometheus. Số liệu tính riêng từng worker.
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("src.main:app", host="0.0.0.0", port=8008, reload=True)
\ No newline at end of file
@@ -0,0 +1,120 @@
+import threading
+import time
+from collections import deque
+from typing import Dict
+
+from src.config.settings import (
+    DEGRADED_MODE, DEGRADED_WINDOW_SECONDS, DEGRADED_MIN_SAMPLES,
+    DEGRADED_ENTER_ERROR_RATE, DEGRADED_ENTER_P95_SECONDS,
+    DEGRADED_EXIT_ERROR_RATE, DEGRADED_EXIT_P95_SECONDS, DEGRADED_PROBE_INTERVAL
+)
+from src.utils.metrics import Gauge
+from src.utils.logging_setup import get_logger
+
+logger = get_logger(__name__)
+
+# Các lệnh gọi LLM gần đây: (thời điểm, provider, độ trễ, thành công)
+_samples = deque()
+_lock = threading.Lock()
+_state = {
+    "degraded": False,
+    "degraded_since": None,
+    "last_probe": 0.0,
+    "times_entered": 0,
+    "degraded_turns": 0,
+    "probe_turns": 0,
+}
+Gauge("llm_degraded_mode", "1 khi bot đang chạy chế độ degraded", function=lambda: 1 if _state["degraded"] else 0)
+
+
+def record_llm_call(provider: str, latency: float, ok: bool):
+    """Ghi nhận kết quả của một lệnh gọi LLM."""
+    now = time.time()
+    with _lock:
+        _samples.append((now, provider, latency, ok))
+        _prune(now)
+
+
+def _prune(now: float):
+    while _samples and now - _samples[0][0] > DEGRADED_WINDOW_SECONDS:
+        _samples.popleft()
+
+
+def _window_metrics() -> Dict:
+    latencies = sorted(s[2] for s in _samples)
+    count = len(latencies)
+    errors = sum(1 for s in _samples if not s[3])
+    p95 = latencies[min(count - 1, int(count * 0.95))] if count else 0.0
+    return {
+        "samples": count,
+        "error_rate": errors / count if count else 0.0,
+        "p95_latency": p95,
+    }
+
+
+def _evaluate(now: float) -> bool:
+    """Cập nhật trạng thái degraded theo số liệu trong cửa sổ, có trễ (hysteresis) khi thoát."""
+    _prune(now)
+    metrics = _window_metrics()
+    if not _state["degraded"]:
+        if metrics["samples"] >= DEGRADED_MIN_SAMPLES and (
+            metrics["error_rate"] >= DEGRADED_ENTER_ERROR_RATE
+            or metrics["p95_latency"] >= DEGRADED_ENTER_P95_SECONDS
+        ):
+            _state["degraded"] = True
+            _state["degraded_since"] = now
+            _state["times_entered"] += 1
+            logger.warning("LLM quá tải (lỗi %.0f%%, p95 %.1fs). Chuyển sang chế độ degraded.", metrics['error_rate'] * 100, metrics['p95_latency'])
+    else:
+        # Chỉ thoát khi đã có số liệu mới (từ các lượt thăm dò) cho thấy provider ổn định trở lại
+        if metrics["samples"] > 0 and (
+            metrics["error_rate"] <= DEGRADED_EXIT_ERROR_RATE
+            and metrics["p95_latency"] <= DEGRADED_EXIT_P95_SECONDS
+        ):
+            _state["degraded"] = False
+            _state["degraded_since"] = None
+            logger.info("LLM đã ổn định trở lại. Thoát chế độ degraded.")
+    return _state["degraded"]
+
+
+def is_degraded() -> bool:
+    if DEGRADED_MODE == "on":
+        return True
+    if DEGRADED_MODE == "off":
+        return False
+    with _lock:
+        return _evaluate(time.time())
+
+
+def should_use_degraded_mode() -> bool:
+    """
+    Quyết định lượt chat hiện tại có chạy ở chế độ degraded hay không.
+    Trong chế độ degraded, định kỳ cho một lượt chạy pipeline đầy đủ để thăm dò
+    xem provider đã hồi phục chưa.
+    """
+    if not is_degraded():
+        return False
+    if DEGRADED_MODE == "on":
+        with _lock:
+            _state["degraded_turns"] += 1
+        return True
+    now = time.time()
+    with _lock:
+        if now - _state["last_probe"] >= DEGRADED_PROBE_INTERVAL:
+            _state["last_probe"] = now
+            _state["probe_turns"] += 1
+            return False
+        _state["degraded_turns"] += 1
+        return True
+
+
+def get_health_stats() -> Dict:
+    with _lock:
+        if DEGRADED_MODE == "auto":
+            _evaluate(time.time())
+        else:
+            _prune(time.time())
+        stats = dict(_state)
+        stats.update(_window_metrics())
+        stats["mode"] = DEGRADED_MODE
+        return stats
@@ -0,0 +1,127 @@
+import contextvars
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import requests
+
+from src.config.settings import EMBED_API_TIMEOUT, EMBED_CACHE_PATH, EMBED_CACHE_MAX_ENTRIES, EMBED_IMAGE_MAX_BYTES, EMBED_CALL_WORKERS
+from src.utils.embedding_cache import EmbeddingCache
+from src.utils.embedding_client import get_embedding_client
+from src.utils.logging_setup import get_logger
+from src.utils.turn_context import Deadline, raise_if_cancelled
+
+logger = get_logger(__name__)
+
+_cache: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {"requests": 0, "url_hits": 0, "content_hits": 0, "embed_calls": 0, "embed_errors": 0, "download_errors": 0}
+# Lệnh gọi dịch vụ embed chạy ở pool này, song song với việc tải ảnh để tính sha256
+_embed_pool = ThreadPoolExecutor(max_workers=EMBED_CALL_WORKERS, thread_name_prefix="image-embed")
+
+
+def _get_cache() -> Optional[EmbeddingCache]:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                try:
+                    _cache = EmbeddingCache(EMBED_CACHE_PATH, EMBED_CACHE_MAX_ENTRIES)
+                except Exception as e:
+                    logger.warning("Không thể mở cache embedding ảnh: %s", e)
+                    return None
+    return _cache
+
+
+def _count(key: str):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+def _timeout(deadline: Deadline = None) -> float:
+    return deadline.timeout(EMBED_API_TIMEOUT) if deadline else EMBED_API_TIMEOUT
+
+
+def _download_image(image_url: str, deadline: Deadline = None) -> Optional[bytes]:
+    try:
+        with requests.get(image_url, timeout=_timeout(deadline), stream=True) as response:
+            response.raise_for_status()
+            chunks, total = [], 0
+            for chunk in response.iter_content(64 * 1024):
+                total += len(chunk)
+                if total > EMBED_IMAGE_MAX_BYTES:
+                    return None
+                chunks.append(chunk)
+            return b"".join(chunks)
+    except Exception as e:
+        _count("download_errors")
+        # Thông báo lỗi của requests chứa URL ảnh của khách, chỉ ghi loại lỗi
+        logger.warning("Không tải được ảnh để tính hash: %s", type(e).__name__)
+        return None
+
+
+def _call_embed_api(image_url: str, deadline: Deadline = None) -> Optional[List[float]]:
+    raise_if_cancelled()
+    _count("embed_calls")
+    embedding = get_embedding_client().embed(
+        image_url, timeout=_timeout(deadline), budget=deadline.remaining() if deadline else None
+    )
+    if embedding is not None:
+        logger.debug("Tạo embedding cho ảnh thành công.")
+        return embedding
+    _count("embed_errors")
+    return None
+
+
+def get_image_embedding(image_url: str, deadline: Deadline = None) -> Optional[List[float]]:
+    """
+    Lấy embedding của ảnh, tra cache theo hai tầng trước khi dùng kết quả của dịch vụ embed:
+    1. theo URL ảnh;
+    2. theo sha256 của nội dung ảnh (khách thường gửi lại chính ảnh sản phẩm của shop qua một URL khác).
+    Chỉ dùng hash chính xác: hash cảm quan (ảnh xám) trùng nhau giữa các mẫu khác màu của cùng một sản phẩm.
+    Khi không trúng URL, lệnh gọi dịch vụ embed chạy song song với việc tải ảnh, nên ảnh mới không phải
+    chờ thêm một lượt tải; trúng sha256 thì trả về ngay không chờ dịch vụ.
+    """
+    _count("requests")
+    cache = _get_cache()
+    if cache is None:
+        return _call_embed_api(image_url, deadline)
+
+    url_key = f"url:{image_url}"
+    embedding = cache.get(url_key)
+    if embedding is not None:
+        _count("url_hits")
+        logger.debug("Embedding ảnh lấy từ cache (URL).")
+        return embedding
+
+    # Chạy trong bản sao context để lệnh gọi vẫn thấy lượt chat hiện tại (hủy, trace, ngân sách thời gian)
+    pending = _embed_pool.submit(contextvars.copy_context().run, _call_embed_api, image_url, deadline)
+    content_key = None
+    image_bytes = _download_image(image_url, deadline)
+    if image_bytes:
+        content_key = f"sha256:{hashlib.sha256(image_bytes).hexdigest()}"
+        embedding = cache.get(content_key)
+        if embedding is not None:
+            _count("content_hits")
+            logger.debug("Embedding ảnh lấy từ cache (sha256).")
+            cache.put([url_key, content_key], embedding)
+            return embedding
+
+    embedding = pending.result()
+    if embedding is not None:
+        cache.put([url_key, content_key], embedding)
+    return embedding
+
+
+def get_embedding_cache_stats() -> Dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    hits = stats["url_hits"] + stats["content_hits"]
+    stats["hit_rate"] = hits / stats["requests"] if stats["requests"] else 0.0
+    cache = _get_cache()
+    if cache is not None:
+        stats.update(cache.snapshot())
+    stats["client"] = get_embedding_client().snapshot()
+    return stats
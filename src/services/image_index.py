@@ -0,0 +1,239 @@
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.utils.catalog_snapshot import CatalogSnapshot, get_current_snapshot
+from src.utils.logging_setup import get_logger
+
+logger = get_logger(__name__)
+
+# Tìm kiếm ảnh trong tiến trình trên ma trận embedding của snapshot catalog (thay cho kNN của ES).
+# "float32": dùng thẳng ma trận trong snapshot (map chung giữa các worker);
+# "int8": lượng tử hóa theo dòng (dùng luôn nếu snapshot đã lưu int8), nhỏ hơn 4 lần.
+IMAGE_INDEX_DTYPE = os.environ.get("IMAGE_INDEX_DTYPE", "float32").lower()
+# Số cụm IVF; 0 = quét toàn bộ ma trận (chính xác). Nên bật khi catalog lớn (hàng trăm nghìn ảnh).
+IMAGE_INDEX_NLIST = int(os.environ.get("IMAGE_INDEX_NLIST", "0"))
+# Số cụm gần nhất được quét cho mỗi truy vấn khi bật IVF
+IMAGE_INDEX_NPROBE = int(os.environ.get("IMAGE_INDEX_NPROBE", "8"))
+# Chưa có chỉ mục (chưa có snapshot hoặc dựng lỗi): thử dựng lại trong nền tối đa mỗi chừng này giây
+IMAGE_INDEX_RETRY_SECONDS = float(os.environ.get("IMAGE_INDEX_RETRY_SECONDS", "30"))
+
+# Số dòng int8 được đổi sang float32 mỗi lần khi tính điểm, giới hạn bộ nhớ tạm
+_CHUNK_ROWS = 8192
+_KMEANS_ITERATIONS = 10
+_KMEANS_SAMPLE = 50000
+
+
+def _to_float(rows: np.ndarray) -> np.ndarray:
+    return rows if rows.dtype == np.float32 else rows.astype(np.float32)
+
+
+def _quantize_int8(matrix: np.ndarray) -> np.ndarray:
+    # Độ tương đồng cosine không phụ thuộc độ lớn của từng dòng nên không cần lưu scale
+    scales = np.abs(matrix).max(axis=1, keepdims=True) / 127.0
+    scales[scales == 0] = 1.0
+    return np.clip(np.rint(matrix / scales), -127, 127).astype(np.int8)
+
+
+class ImageIndex:
+    """
+    Chỉ mục kNN cosine trên ma trận embedding. Điểm trả về theo thang của ES
+    (cosine: (1 + cos) / 2) để giữ nguyên ý nghĩa của min_similarity.
+    """
+
+    def __init__(self, snapshot: CatalogSnapshot, dtype: str = "float32", nlist: int = 0, nprobe: int = 8):
+        start = time.perf_counter()
+        self.snapshot = snapshot
+        self.version = snapshot.version
+        matrix = snapshot.embeddings
+        if matrix is None:
+            raise ValueError("Snapshot catalog không có embedding ảnh.")
+        if dtype == "int8" and matrix.dtype != np.int8:
+            matrix = np.concatenate([_quantize_int8(_to_float(matrix[i:i + _CHUNK_ROWS])) for i in range(0, len(matrix), _CHUNK_ROWS)])
+        self.matrix = matrix
+        self.dtype = str(matrix.dtype)
+
+        norms = np.concatenate([np.linalg.norm(_to_float(matrix[i:i + _CHUNK_ROWS]), axis=1) for i in range(0, len(matrix), _CHUNK_ROWS)])
+        valid = snapshot.has_embedding & (norms > 0)
+        # Dòng không có embedding luôn bị loại (điểm -inf)
+        self.inverse_norms = np.where(valid, 1.0 / np.where(norms > 0, norms, 1.0), 0.0).astype(np.float32)
+        self.valid = valid
+        self.valid_rows = np.flatnonzero(valid)
+
+        self.nprobe = nprobe
+        self.centroids: Optional[np.ndarray] = None
+        self.lists: List[np.ndarray] = []
+        if nlist and len(self.valid_rows) > nlist:
+            self._train_ivf(nlist)
+        self.build_seconds = time.perf_counter() - start
+
+    def _normalized(self, rows: np.ndarray) -> np.ndarray:
+        return _to_float(self.matrix[rows]) * self.inverse_norms[rows, None]
+
+    def _train_ivf(self, nlist: int):
+        """K-means cầu (spherical) trên một mẫu dòng, rồi gán mọi dòng vào cụm gần nhất."""
+        rng = np.random.default_rng(0)
+        sample_rows = self.valid_rows
+        if len(sample_rows) > _KMEANS_SAMPLE:
+            sample_rows = np.sort(rng.choice(sample_rows, _KMEANS_SAMPLE, replace=False))
+        sample = self._normalized(sample_rows)
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)]
+        for _ in range(_KMEANS_ITERATIONS):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for cluster in range(nlist):
+                members = sample[assignment == cluster]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[cluster] = centroid / (np.linalg.norm(centroid) or 1.0)
+
+        assignments = np.empty(len(self.valid_rows), dtype=np.int64)
+        for i in range(0, len(self.valid_rows), _CHUNK_ROWS):
+            rows = self.valid_rows[i:i + _CHUNK_ROWS]
+            assignments[i:i + _CHUNK_ROWS] = np.argmax(self._normalized(rows) @ centroids.T, axis=1)
+        order = np.argsort(assignments, kind="stable")
+        boundaries = np.searchsorted(assignments[order], np.arange(nlist + 1))
+        self.centroids = centroids
+        self.lists = [self.valid_rows[order[boundaries[c]:boundaries[c + 1]]] for c in range(nlist)]
+
+    def _cosine(self, queries: np.ndarray, rows: Optional[np.ndarray]) -> np.ndarray:
+        """Cosine giữa các truy vấn đã chuẩn hóa (b x d) và các dòng (toàn bộ nếu rows=None) -> (b x n)."""
+        if rows is None:
+            if self.matrix.dtype == np.float32:
+                scores = queries @ self.matrix.T
+            else:
+                scores = np.concatenate(
+                    [queries @ _to_float(self.matrix[i:i + _CHUNK_ROWS]).T for i in range(0, len(self.matrix), _CHUNK_ROWS)],
+                    axis=1
+                )
+            scores *= self.inverse_norms
+            scores[:, ~self.valid] = -np.inf
+            return scores
+        return (queries @ _to_float(self.matrix[rows]).T) * self.inverse_norms[rows]
+
+    def search_batch(self, queries: np.ndarray, top_k: int = 1, min_similarity: float = 0.0) -> List[List[Tuple[int, float]]]:
+        """Tìm top_k cho nhiều truy vấn cùng lúc. Trả về, cho mỗi truy vấn, danh sách (dòng, điểm)."""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms > 0, norms, 1.0)
+
+        results = []
+        if self.centroids is None:
+            all_scores = self._cosine(queries, None)
+            candidate_sets = [None] * len(queries)
+        else:
+            probes = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :self.nprobe]
+            candidate_sets = [np.concatenate([self.lists[c] for c in probe]) for probe in probes]
+
+        for qi, query in enumerate(queries):
+            rows = candidate_sets[qi]
+            if rows is None:
+                scores = all_scores[qi]
+                rows = None
+            else:
+                if not len(rows):
+                    results.append([])
+                    continue
+                scores = self._cosine(query[None, :], rows)[0]
+            k = min(top_k, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+            top = top[np.argsort(-scores[top], kind="stable")]
+            hits = []
+            for position in top:
+                score = (1.0 + float(scores[position])) / 2.0
+                if score < min_similarity:
+                    break
+                hits.append((int(rows[position]) if rows is not None else int(position), score))
+            results.append(hits)
+        return results
+
+    def search(self, query: np.ndarray, top_k: int = 1, min_similarity: float = 0.0) -> List[Tuple[int, float]]:
+        return self.search_batch(np.asarray(query)[None, :], top_k, min_similarity)[0]
+
+
+_index: Optional[ImageIndex] = None
+_build_lock = threading.Lock()
+# Bảo vệ cờ "building" để chỉ một luồng dựng nền được khởi động
+_building_guard = threading.Lock()
+_state = {"building": False, "last_attempt": 0.0, "builds": 0, "queries": 0, "total_ms": 0.0}
+
+
+def build_image_index(snapshot: CatalogSnapshot = None) -> Optional[ImageIndex]:
+    """Dựng chỉ mục từ snapshot hiện tại rồi thay thế chỉ mục đang dùng bằng một phép gán."""
+    global _index
+    snapshot = snapshot or get_current_snapshot(refresh=True)
+    if snapshot is None or snapshot.embeddings is None:
+        logger.warning("Chưa có snapshot catalog chứa embedding ảnh, không thể dựng chỉ mục ảnh trong bộ nhớ.")
+        return None
+    with _build_lock:
+        index = ImageIndex(snapshot, IMAGE_INDEX_DTYPE, IMAGE_INDEX_NLIST, IMAGE_INDEX_NPROBE)
+        _index = index
+        _state["builds"] += 1
+        logger.info("Đã dựng chỉ mục ảnh trong bộ nhớ: %d ảnh, %s, %s cụm IVF (%.2fs).",
+                    len(index.valid_rows), index.dtype, len(index.lists) or 'không', index.build_seconds)
+        return index
+
+
+def _rebuild_in_background(snapshot: CatalogSnapshot = None):
+    try:
+        build_image_index(snapshot)
+    except Exception as e:
+        logger.warning("Không thể dựng lại chỉ mục ảnh: %s", e)
+    finally:
+        _state["building"] = False
+
+
+def _start_background_build(snapshot: CatalogSnapshot = None):
+    with _building_guard:
+        if _state["building"]:
+            return
+        _state["building"] = True
+    threading.Thread(target=_rebuild_in_background, args=(snapshot,), daemon=True).start()
+
+
+def get_image_index() -> Optional[ImageIndex]:
+    """
+    Chỉ mục ảnh hiện tại; snapshot đổi phiên bản thì dựng lại trong luồng nền. Chưa có chỉ mục thì bắt đầu
+    dựng trong luồng nền (thử lại tối đa mỗi IMAGE_INDEX_RETRY_SECONDS) và trả về None để tìm bằng Elasticsearch.
+    """
+    if _index is None:
+        now = time.monotonic()
+        if not _state["last_attempt"] or now - _state["last_attempt"] >= IMAGE_INDEX_RETRY_SECONDS:
+            _state["last_attempt"] = now
+            _start_background_build()
+        return None
+    snapshot = get_current_snapshot()
+    if snapshot is not None and snapshot.version != _index.version:
+        _start_background_build(snapshot)
+    return _index
+
+
+def search_images(image_embedding: list, top_k: int = 1, min_similarity: float = 0.97, fields: List[str] = None) -> Optional[Tuple[List[Dict], float]]:
+    """
+    Tìm sản phẩm có ảnh tương đồng; trả về (sản phẩm, thời gian ms), hoặc None khi chỉ mục chưa sẵn sàng.
+    Quét ma trận embedding tốn CPU nên cần gọi ngoài event loop (asyncio.to_thread).
+    """
+    index = get_image_index()
+    if index is None:
+        return None
+    start = time.perf_counter()
+    hits = index.search(np.asarray(image_embedding, dtype=np.float32), top_k, min_similarity)
+    products = []
+    for row, _ in hits:
+        product = index.snapshot[row]
+        products.append({field: product.get(field) for field in fields} if fields else product)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    _state["queries"] += 1
+    _state["total_ms"] += elapsed_ms
+    return products, elapsed_ms
+
+
+def get_image_index_stats() -> Dict:
+    stats = dict(_state)
+    stats["avg_ms"] = stats["total_ms"] / stats["queries"] if stats["queries"] else 0.0
+    if _index is not None:
+        stats.update(version=_index.version, images=int(len(_index.valid_rows)), dtype=_index.dtype,
+                     nlist=len(_index.lists), nprobe=_index.nprobe, build_seconds=_index.build_seconds)
+    return stats
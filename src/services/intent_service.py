@@ -2,12 +2,19 @@ import json
 import re
 from typing import Dict, Any
 
-from src.services.llm_service import get_gemini_model, get_lmstudio_response, get_openai_model
+from src.services.llm_service import get_gemini_model, get_lmstudio_response, get_openai_model, gemini_request_options, openai_request_options, track_llm_call
+from src.utils.turn_context import raise_if_cancelled, note_llm_usage, Deadline
+from src.utils.logging_setup import get_logger, log_payload
+from src.utils.helpers import PHONE_PATTERN
+from src.config.settings import STAGE_MIN_BUDGET, LMSTUDIO_TIMEOUT
 from google.generativeai.types import GenerationConfig
 
-def analyze_intent_and_extract_entities(user_query: str, history: list = None, model_choice: str = "gemini") -> Dict[str, Any]:
+logger = get_logger(__name__)
+
+def analyze_intent_and_extract_entities(user_query: str, history: list = None, model_choice: str = "gemini", deadline: Deadline = None) -> Dict[str, Any]:
     """
     Sử dụng một lệnh gọi LLM duy nhất để phân tích ý định của người dùng và trích xuất các thực thể cần thiết.
+    Nếu ngân sách thời gian của lượt chat không còn đủ, trả về kết quả phân tích dự phòng.
     """
     history_text = ""
     if history:
@@ -127,25 +134,33 @@ def analyze_intent_and_extract_entities(user_query: str, history: list = None, m
         "search_params": { "products": [{ "product_name": user_query, "category": user_query, "properties": "", "quantity": 1 }] }
     }
 
+    if deadline and not deadline.has(STAGE_MIN_BUDGET["intent"]):
+        logger.info("Không đủ thời gian để phân tích ý định bằng LLM (còn %.1fs), sử dụng fallback.", deadline.remaining())
+        return fallback_response
+
+    raise_if_cancelled()
     response_text = None
     try:
         if model_choice == "gemini":
             model = get_gemini_model()
             if model:
                 generation_config = GenerationConfig(response_mime_type="application/json")
-                response = model.generate_content(prompt, generation_config=generation_config)
+                with track_llm_call("gemini"):
+                    response = model.generate_content(prompt, generation_config=generation_config, request_options=gemini_request_options(deadline))
                 response_text = response.text
         elif model_choice == "lmstudio":
-            response_text = get_lmstudio_response(prompt)
+            response_text = get_lmstudio_response(prompt, timeout=deadline.timeout(LMSTUDIO_TIMEOUT) if deadline else LMSTUDIO_TIMEOUT)
         elif model_choice == "openai":
             openai = get_openai_model()
             if openai:
-                completion = openai.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[{"role": "user", "content": prompt}],
-                    response_format={"type": "json_object"},
-                    temperature=0.2
-                )
+                with track_llm_call("openai"):
+                    completion = openai.chat.completions.create(
+                        model="gpt-4o-mini",
+                        messages=[{"role": "user", "content": prompt}],
+                        response_format={"type": "json_object"},
+                        temperature=0.2,
+                        **openai_request_options(deadline)
+                    )
                 response_text = completion.choices[0].message.content
         else:
             return fallback_response
@@ -153,26 +168,56 @@ def analyze_intent_and_extract_entities(user_query: str, history: list = None, m
         if not response_text:
             return fallback_response
 
-        print("--- PHÂN TÍCH Ý ĐỊNH & THỰC THỂ ---")
-        print(f"Phản hồi thô từ LLM: {response_text}")
+        note_llm_usage(prompt, response_text)
+        log_payload(logger, "response", "Phân tích ý định & thực thể", response_text)
 
         json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
         if json_match:
             cleaned_response = json_match.group(0)
             data = json.loads(cleaned_response)
             if 'search_params' in data and 'products' in data['search_params']:
-                print(f"Kết quả phân tích: {data}")
-                print("-----------------------------------")
+                logger.debug("Kết quả phân tích ý định: %s", data)
                 return data
         
-        print("Không thể parse JSON từ phản hồi LLM, sử dụng fallback.")
+        logger.warning("Không thể parse JSON từ phản hồi LLM, sử dụng fallback.")
         return fallback_response
 
     except Exception as e:
-        print(f"Lỗi trong quá trình phân tích ý định bằng LLM ({model_choice}): {e}")
+        logger.warning("Lỗi trong quá trình phân tích ý định bằng LLM (%s): %s", model_choice, e)
         return fallback_response
     
-def extract_customer_info(user_input: str, model_choice: str = "gemini") -> Dict:
+def analyze_intent_locally(user_query: str) -> Dict[str, Any]:
+    """
+    Phân tích ý định bằng từ khóa, không gọi LLM. Dùng trong chế độ degraded khi LLM quá tải.
+    Không suy ra ý định mua hàng (cần AI đánh giá sản phẩm); khách vẫn nhận được link sản phẩm để đặt.
+    """
+    query = user_query.lower().strip()
+
+    def has_any(keywords):
+        return any(kw in query for kw in keywords)
+
+    wants_human_agent = has_any(["nhân viên", "người thật", "tư vấn trực tiếp", "gặp anh", "gặp chị"])
+    wants_store_info = not wants_human_agent and has_any(["địa chỉ", "ở đâu", "giờ mở cửa", "giờ làm việc", "hotline", "mua trực tiếp"])
+    wants_warranty_service = has_any(["bảo hành giúp", "cần bảo hành", "bị lỗi", "bị hỏng", "trục trặc"])
+    is_bank_transfer = has_any(["chuyển khoản", "stk", "số tài khoản", "banking"])
+    is_greeting = len(query.split()) <= 2 and has_any(["ok", "hi", "hello", "chào", "cảm ơn", "thanks", "uk", "vâng", "dạ"])
+    needs_search = not (is_greeting or wants_human_agent or wants_store_info or wants_warranty_service or is_bank_transfer)
+
+    return {
+        "needs_search": needs_search,
+        "is_purchase_intent": False,
+        "is_add_to_order_intent": False,
+        "wants_images": has_any(["ảnh", "hình", "photo"]),
+        "wants_specs": has_any(["thông số", "chi tiết", "cấu hình", "xuất xứ"]),
+        "wants_human_agent": wants_human_agent,
+        "wants_store_info": wants_store_info,
+        "wants_warranty_service": wants_warranty_service,
+        "is_negative": False,
+        "is_bank_transfer": is_bank_transfer,
+        "search_params": {"products": [{"product_name": user_query, "category": user_query, "properties": "", "quantity": 1}] if needs_search else []}
+    }
+
+def extract_customer_info(user_input: str, model_choice: str = "gemini", deadline: Deadline = None) -> Dict:
     """
     Sử dụng LLM để bóc tách Tên, SĐT, Địa chỉ từ một chuỗi văn bản.
     """
@@ -185,13 +230,45 @@ def extract_customer_info(user_input: str, model_choice: str = "gemini") -> Dict
 
     JSON:
     """
+    if deadline and not deadline.has(STAGE_MIN_BUDGET["customer_info"]):
+        logger.info("Không đủ thời gian để bóc tách thông tin khách hàng.")
+        return {}
+
+    raise_if_cancelled()
     try:
         model = get_gemini_model()
         if model:
-            response = model.generate_content(prompt)
+            with track_llm_call("gemini"):
+                response = model.generate_content(prompt, request_options=gemini_request_options(deadline))
+            note_llm_usage(prompt, response.text)
             json_text = re.search(r'\{.*\}', response.text, re.DOTALL).group(0)
             return json.loads(json_text)
         return {}
     except Exception as e:
-        print(f"Lỗi khi bóc tách thông tin khách hàng: {e}")
-        return {}
\ No newline at end of file
+        logger.warning("Lỗi khi bóc tách thông tin khách hàng: %s", e)
+        return {}
+
+# Từ thường mở đầu một địa chỉ; phần văn bản có các từ này (hoặc có chữ số) được coi là địa chỉ, không phải tên
+_ADDRESS_HINTS = ("số", "ngõ", "ngách", "hẻm", "kiệt", "đường", "phố", "phường", "xã", "quận", "huyện", "thị", "tỉnh", "tp", "thành phố", "thôn", "xóm", "ấp", "tổ")
+
+def extract_customer_info_locally(user_input: str) -> Dict:
+    """
+    Bóc tách Tên, SĐT, Địa chỉ không gọi LLM (chế độ degraded): SĐT theo mẫu số điện thoại, phần còn lại
+    tách theo dấu phẩy / xuống dòng; phần ngắn không có chữ số ở đầu là tên, các phần còn lại là địa chỉ.
+    Trường không nhận ra được để None, bot sẽ hỏi lại khách.
+    """
+    phone_match = PHONE_PATTERN.search(user_input or "")
+    phone = re.sub(r"[\s.\-]", "", phone_match.group(0)) if phone_match else None
+    text = PHONE_PATTERN.sub(",", user_input or "")
+    parts = [part.strip(" .:;-") for part in re.split(r"[,\n]", text)]
+    parts = [re.sub(r"^(?:tên|sđt|số điện thoại|địa chỉ|đc)\s*(?:là|:)?\s*", "", part, flags=re.IGNORECASE) for part in parts]
+    parts = [part for part in parts if part]
+
+    name = None
+    if parts:
+        first = parts[0]
+        looks_like_address = any(ch.isdigit() for ch in first) or first.lower().split()[0] in _ADDRESS_HINTS
+        if not looks_like_address and len(first.split()) <= 5:
+            name = parts.pop(0)
+    address = ", ".join(parts) if parts else None
+    return {"name": name, "phone": phone, "address": address}
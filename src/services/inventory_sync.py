@@ -0,0 +1,187 @@
+import asyncio
+import os
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+from elasticsearch.helpers import async_streaming_bulk
+
+from src.services.search_service import get_es_client, invalidate_search_cache, INDEX_NAME, CATALOG_META_INDEX
+from src.utils.catalog_snapshot import publish_updated_snapshot, read_current_pointer
+from src.utils.inventory_feed import load_inventory_feed, diff_inventory, load_synced_state, save_synced_state
+from src.utils.logging_setup import get_logger
+
+logger = get_logger(__name__)
+
+# Feed tồn kho / giá (csv, parquet, json, jsonl hoặc xlsx catalog); để trống thì không chạy đồng bộ nền
+INVENTORY_FEED_PATH = os.environ.get("INVENTORY_FEED_PATH", "")
+INVENTORY_SYNC_INTERVAL_SECONDS = float(os.environ.get("INVENTORY_SYNC_INTERVAL_SECONDS", "300"))
+# Tồn kho / giá đã gửi thành công lần trước, để chỉ gửi các dòng thay đổi
+INVENTORY_SYNC_STATE_PATH = os.environ.get("INVENTORY_SYNC_STATE_PATH", "cache/inventory_synced.parquet")
+# Chỉ một worker trên mỗi máy chạy đồng bộ (khóa file)
+INVENTORY_SYNC_LOCK_PATH = os.environ.get("INVENTORY_SYNC_LOCK_PATH", "cache/inventory_sync.lock")
+INVENTORY_SYNC_CHUNK_SIZE = int(os.environ.get("INVENTORY_SYNC_CHUNK_SIZE", "500"))
+
+_task: Optional[asyncio.Task] = None
+_lock_handle = None
+_stats = {
+    "runs": 0, "skipped": 0, "errors": 0, "feed_rows": 0, "changed": 0, "updated": 0, "missing": 0, "failed": 0,
+    "last_run": None, "last_duration_ms": 0.0, "last_error": None,
+}
+
+
+def _feed_mtime(path: str) -> Optional[float]:
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+async def _bump_catalog_version():
+    """Ghi phiên bản catalog mới để các worker khác bỏ cache kết quả tìm kiếm."""
+    version = time.strftime("%Y%m%d%H%M%S") + f"-{random.randint(0, 9999):04d}"
+    await get_es_client().index(
+        index=CATALOG_META_INDEX,
+        id=INDEX_NAME,
+        document={"index": INDEX_NAME, "version": version, "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S")},
+    )
+
+
+async def _push_updates(changed: pd.DataFrame) -> Tuple[List[str], List[str]]:
+    """
+    Gửi cập nhật một phần (inventory, lifecare_price) cho các dòng thay đổi.
+    Trả về (mã không có trong index, mã lỗi cần gửi lại lần sau).
+    """
+    def actions():
+        for code, inventory, price in zip(changed.index, changed['inventory'], changed['lifecare_price']):
+            yield {
+                "_op_type": "update",
+                "_index": INDEX_NAME,
+                "_id": code,
+                "doc": {"inventory": int(inventory), "lifecare_price": float(price)},
+            }
+
+    missing, failed = [], []
+    async for ok, info in async_streaming_bulk(
+        get_es_client(), actions(), chunk_size=INVENTORY_SYNC_CHUNK_SIZE, raise_on_error=False, max_retries=2
+    ):
+        if not ok:
+            item = info.get("update", {})
+            # Sản phẩm chưa được nạp vào index: gửi lại cũng không được, chờ lần nạp catalog sau
+            (missing if item.get("status") == 404 else failed).append(str(item.get("_id")))
+    return missing, failed
+
+
+async def sync_inventory_once(feed_path: str = None) -> Dict:
+    """
+    Một lần đồng bộ: đọc feed, so (vector hóa) với trạng thái đã đồng bộ lần trước, chỉ gửi
+    các dòng đổi tồn kho / giá lên Elasticsearch, rồi làm mới cache tìm kiếm và snapshot catalog.
+    """
+    feed_path = feed_path or INVENTORY_FEED_PATH
+    start = time.perf_counter()
+    current = await asyncio.to_thread(load_inventory_feed, feed_path)
+    previous = await asyncio.to_thread(load_synced_state, INVENTORY_SYNC_STATE_PATH)
+    changed = diff_inventory(current, previous)
+    result = {"feed_rows": len(current), "changed": len(changed), "updated": 0, "missing": 0, "failed": 0}
+
+    if len(changed):
+        missing, failed = await _push_updates(changed)
+        result["missing"], result["failed"] = len(missing), len(failed)
+        result["updated"] = len(changed) - len(missing) - len(failed)
+        await asyncio.to_thread(save_synced_state, INVENTORY_SYNC_STATE_PATH, current, previous, failed)
+        if result["updated"]:
+            invalidate_search_cache()
+            await _bump_catalog_version()
+            if read_current_pointer():
+                ok = changed[~changed.index.isin(failed + missing)]
+                updates = {
+                    code: {"inventory": int(inventory), "lifecare_price": float(price)}
+                    for code, inventory, price in zip(ok.index, ok['inventory'], ok['lifecare_price'])
+                }
+                await asyncio.to_thread(publish_updated_snapshot, updates)
+    elif previous is None:
+        await asyncio.to_thread(save_synced_state, INVENTORY_SYNC_STATE_PATH, current, None, [])
+
+    result["duration_ms"] = (time.perf_counter() - start) * 1000
+    logger.info("%d dòng feed, %d thay đổi, %d đã cập nhật, %d không có trong index, %d lỗi (%.0fms).",
+                result['feed_rows'], result['changed'], result['updated'], result['missing'], result['failed'], result['duration_ms'])
+    return result
+
+
+def _acquire_leader_lock() -> bool:
+    """Khóa file không chặn: chỉ worker giữ khóa mới chạy đồng bộ."""
+    global _lock_handle
+    try:
+        import fcntl
+    except ImportError:
+        return True
+    os.makedirs(os.path.dirname(os.path.abspath(INVENTORY_SYNC_LOCK_PATH)), exist_ok=True)
+    handle = open(INVENTORY_SYNC_LOCK_PATH, "a")
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return False
+    _lock_handle = handle
+    return True
+
+
+async def _sync_loop():
+    last_mtime = None
+    while True:
+        mtime = _feed_mtime(INVENTORY_FEED_PATH)
+        if mtime is None:
+            _stats["errors"] += 1
+            _stats["last_error"] = f"Không tìm thấy feed '{INVENTORY_FEED_PATH}'"
+        elif mtime == last_mtime:
+            # Feed chưa đổi từ lần đồng bộ thành công trước: không cần đọc lại
+            _stats["skipped"] += 1
+        else:
+            try:
+                result = await sync_inventory_once(INVENTORY_FEED_PATH)
+                last_mtime = mtime if not result["failed"] else None
+                _stats["runs"] += 1
+                _stats["feed_rows"] = result["feed_rows"]
+                for key in ("changed", "updated", "missing", "failed"):
+                    _stats[key] += result[key]
+                _stats["last_duration_ms"] = result["duration_ms"]
+                _stats["last_error"] = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                _stats["errors"] += 1
+                _stats["last_error"] = str(e)
+                logger.warning("Lỗi khi đồng bộ tồn kho: %s", e)
+            _stats["last_run"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        await asyncio.sleep(INVENTORY_SYNC_INTERVAL_SECONDS)
+
+
+def start_inventory_sync() -> bool:
+    """Bắt đầu tác vụ nền đồng bộ tồn kho / giá nếu đã cấu hình INVENTORY_FEED_PATH."""
+    global _task
+    if not INVENTORY_FEED_PATH or _task is not None:
+        return False
+    if not _acquire_leader_lock():
+        logger.info("Worker khác đang chạy đồng bộ tồn kho, bỏ qua.")
+        return False
+    _task = asyncio.get_running_loop().create_task(_sync_loop())
+    logger.info("Đã khởi động đồng bộ tồn kho từ '%s' mỗi %.0fs.", INVENTORY_FEED_PATH, INVENTORY_SYNC_INTERVAL_SECONDS)
+    return True
+
+
+async def stop_inventory_sync():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+
+
+def get_inventory_sync_stats() -> Dict:
+    stats = dict(_stats)
+    stats.update(enabled=_task is not None, feed=INVENTORY_FEED_PATH or None, interval_seconds=INVENTORY_SYNC_INTERVAL_SECONDS)
+    return stats
@@ -1,6 +1,13 @@
 import os
+import time
 import requests
-from src.config.settings import GEMINI_API_KEY, LMSTUDIO_API_URL, LMSTUDIO_MODEL, OPENAI_API_KEY
+from contextlib import contextmanager
+from src.services.health_service import record_llm_call
+from src.utils.metrics import Counter, Gauge, Histogram
+from src.utils.logging_setup import get_logger
+from src.config.settings import GEMINI_API_KEY, LMSTUDIO_API_URL, LMSTUDIO_MODEL, OPENAI_API_KEY, LMSTUDIO_TIMEOUT
+
+logger = get_logger(__name__)
 
 def get_gemini_model():
     """Khởi tạo và trả về instance của Gemini Model."""
@@ -12,10 +19,42 @@ def get_gemini_model():
         model = genai.GenerativeModel('gemini-2.0-flash')
         return model
     except Exception as e:
-        print(f"Lỗi khi khởi tạo Gemini: {e}")
+        logger.error("Lỗi khi khởi tạo Gemini: %s", e)
         return None
 
-def get_lmstudio_response(prompt: str):
+LLM_CALL_SECONDS = Histogram("llm_call_duration_seconds", "Thời gian một lệnh gọi LLM", ["provider"])
+LLM_CALLS_TOTAL = Counter("llm_calls_total", "Số lệnh gọi LLM theo kết quả", ["provider", "status"])
+LLM_IN_FLIGHT = Gauge("llm_calls_in_flight", "Số lệnh gọi LLM đang chờ phản hồi", ["provider"])
+
+@contextmanager
+def track_llm_call(provider: str):
+    """Đo độ trễ và ghi nhận thành công/lỗi của một lệnh gọi LLM cho health_service và /metrics."""
+    start = time.monotonic()
+    ok = False
+    LLM_IN_FLIGHT.inc(provider=provider)
+    try:
+        yield
+        ok = True
+    finally:
+        elapsed = time.monotonic() - start
+        LLM_IN_FLIGHT.dec(provider=provider)
+        LLM_CALL_SECONDS.observe(elapsed, provider=provider)
+        LLM_CALLS_TOTAL.inc(provider=provider, status="ok" if ok else "error")
+        record_llm_call(provider, elapsed, ok)
+
+def gemini_request_options(deadline=None) -> dict:
+    """Tùy chọn request cho Gemini, giới hạn timeout theo ngân sách còn lại của lượt chat."""
+    if deadline is None:
+        return {}
+    return {"timeout": deadline.timeout()}
+
+def openai_request_options(deadline=None) -> dict:
+    """Tham số timeout cho OpenAI client theo ngân sách còn lại của lượt chat."""
+    if deadline is None:
+        return {}
+    return {"timeout": deadline.timeout()}
+
+def get_lmstudio_response(prompt: str, timeout: float = LMSTUDIO_TIMEOUT):
     """Gửi prompt đến LM Studio API và nhận phản hồi."""
     try:
         url = f"{LMSTUDIO_API_URL}/v1/chat/completions"
@@ -27,16 +66,17 @@ def get_lmstudio_response(prompt: str):
             "max_tokens": 4000
         }
         
-        print(f"Gửi yêu cầu đến LM Studio API: {url}")
-        response = requests.post(url, headers=headers, json=data, timeout=60)
-        response.raise_for_status()
-        result = response.json()
+        logger.debug("Gửi yêu cầu đến LM Studio API: %s", url)
+        with track_llm_call("lmstudio"):
+            response = requests.post(url, headers=headers, json=data, timeout=timeout)
+            response.raise_for_status()
+            result = response.json()
         
         if "choices" in result and len(result["choices"]) > 0:
             return result["choices"][0]["message"]["content"]
         return "Không nhận được phản hồi từ LM Studio."
     except Exception as e:
-        print(f"Lỗi khi gọi LM Studio API: {e}")
+        logger.warning("Lỗi khi gọi LM Studio API: %s", e)
         return f"Lỗi kết nối đến LM Studio: {str(e)}"
 
 def get_openai_model():
@@ -48,5 +88,5 @@ def get_openai_model():
         client = openai.OpenAI(api_key=OPENAI_API_KEY)
         return client
     except Exception as e:
-        print(f"Lỗi khi khởi tạo OpenAI client: {e}")
+        logger.error("Lỗi khi khởi tạo OpenAI client: %s", e)
         return None
\ No newline at end of file
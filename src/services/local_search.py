@@ -0,0 +1,318 @@
+import bisect
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.utils.catalog_loader import load_catalog_records
+from src.utils.catalog_snapshot import read_current_pointer, get_current_snapshot, get_snapshot_stats
+from src.utils.logging_setup import get_logger
+
+logger = get_logger(__name__)
+
+# Backend tìm kiếm trong bộ nhớ: mirror catalog từ snapshot do script nạp dữ liệu công bố
+# (hoặc trực tiếp từ cùng file xlsx nếu chưa có snapshot),
+# chấm điểm BM25 theo đúng cấu trúc truy vấn của build_search_body.
+LOCAL_CATALOG_PATH = os.environ.get("LOCAL_CATALOG_PATH", "dulieu_1208.xlsx")
+# Chu kỳ (giây) kiểm tra file catalog đã thay đổi để nạp lại
+LOCAL_RELOAD_CHECK_SECONDS = float(os.environ.get("LOCAL_RELOAD_CHECK_SECONDS", "30"))
+
+# Tham số BM25 mặc định của Elasticsearch
+_K1 = 1.2
+_B = 0.75
+# Hệ số boost giống build_search_body
+PHRASE_BOOST = 10.0
+CATEGORY_BOOST = 5.0
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def fold_text(text) -> str:
+    """Chữ thường, bỏ dấu tiếng Việt (kể cả đ -> d)."""
+    if text is None:
+        return ""
+    text = str(text).lower().replace("đ", "d")
+    decomposed = unicodedata.normalize("NFD", text)
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def tokenize(text) -> List[str]:
+    return _TOKEN_RE.findall(fold_text(text))
+
+
+# Mã hóa (tài liệu, vị trí) thành một số nguyên để tìm cụm từ bằng phép giao mảng đã sắp xếp
+_POSITION_STRIDE = 1 << 20
+
+
+class _FieldIndex:
+    """
+    Chỉ mục ngược của một trường văn bản. Sau khi dựng, mỗi term giữ mảng tài liệu chứa nó,
+    điểm BM25 tính sẵn cho từng tài liệu và mảng (tài liệu, vị trí) để khớp cụm từ.
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[int, List[int]]] = defaultdict(dict)
+        self.lengths: List[int] = []
+        self.terms: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+
+    def add(self, doc_id: int, text):
+        tokens = tokenize(text)
+        self.lengths.append(len(tokens))
+        for position, token in enumerate(tokens):
+            self._postings[token].setdefault(doc_id, []).append(position)
+
+    def finalize(self):
+        """Tính sẵn điểm BM25 của mọi cặp (term, tài liệu) vì chỉ mục không đổi sau khi dựng."""
+        doc_count = len(self.lengths)
+        lengths = np.asarray(self.lengths, dtype=np.float64)
+        avg = float(lengths.mean()) if doc_count and lengths.mean() > 0 else 1.0
+        for term, docs in self._postings.items():
+            doc_ids = np.fromiter(docs.keys(), dtype=np.int64, count=len(docs))
+            tf = np.fromiter((len(p) for p in docs.values()), dtype=np.float64, count=len(docs))
+            idf = math.log(1 + (doc_count - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = _K1 * (1 - _B + _B * lengths[doc_ids] / avg)
+            scores = idf * tf * (_K1 + 1) / (tf + norm)
+            positions = np.sort(np.fromiter(
+                (doc_id * _POSITION_STRIDE + pos for doc_id, plist in docs.items() for pos in plist),
+                dtype=np.int64
+            ))
+            self.terms[term] = (doc_ids, scores, positions)
+        self._postings = {}
+
+    def match(self, terms: List[str], doc_count: int, require_all: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Truy vấn `match`: trả về (điểm, tài liệu khớp) dạng mảng theo doc_id.
+        `require_all` tương đương operator "and".
+        """
+        scores = np.zeros(doc_count, dtype=np.float64)
+        counts = np.zeros(doc_count, dtype=np.int32)
+        unique_terms = list(dict.fromkeys(terms))
+        for term in unique_terms:
+            entry = self.terms.get(term)
+            if entry is None:
+                continue
+            doc_ids, term_scores, _ = entry
+            scores[doc_ids] += term_scores
+            counts[doc_ids] += 1
+        matched = counts == len(unique_terms) if require_all else counts > 0
+        if require_all:
+            scores[~matched] = 0.0
+        return scores, matched
+
+    def phrase(self, terms: List[str], doc_count: int) -> np.ndarray:
+        """Tài liệu chứa đủ các term liền nhau theo đúng thứ tự (match_phrase)."""
+        mask = np.zeros(doc_count, dtype=bool)
+        if not terms or any(term not in self.terms for term in terms):
+            return mask
+        starts = self.terms[terms[0]][2]
+        for offset, term in enumerate(terms[1:], start=1):
+            following = self.terms[term][2] - offset
+            starts = np.intersect1d(starts, following, assume_unique=True)
+            if not starts.size:
+                return mask
+        mask[starts // _POSITION_STRIDE] = True
+        return mask
+
+
+class CatalogIndex:
+    """Ảnh chụp catalog trong bộ nhớ, chỉ đọc sau khi dựng xong nên dùng được từ nhiều luồng."""
+
+    def __init__(self, products: List[Dict], version: Optional[str] = None):
+        self.products = products
+        self.version = version
+        self.fields = {name: _FieldIndex() for name in ("product_name", "category", "properties")}
+        for doc_id, product in enumerate(products):
+            for name, field in self.fields.items():
+                field.add(doc_id, product.get(name))
+        for field in self.fields.values():
+            field.finalize()
+
+        # Thứ hạng của product_code theo thứ tự chuỗi, dùng làm tiêu chí sắp xếp thứ hai như SEARCH_SORT
+        codes = [str(product.get("product_code") or "") for product in products]
+        self.sorted_codes = sorted(set(codes))
+        rank = {code: i for i, code in enumerate(self.sorted_codes)}
+        self.code_rank = np.asarray([rank[code] for code in codes], dtype=np.int64)
+        self.codes = codes
+
+        # category.keyword: nguyên chuỗi danh mục -> các tài liệu
+        category_docs: Dict[str, List[int]] = defaultdict(list)
+        for doc_id, product in enumerate(products):
+            category_docs[str(product.get("category") or "").strip()].append(doc_id)
+        self.category_keywords = {key: np.asarray(ids, dtype=np.int64) for key, ids in category_docs.items()}
+
+    def __len__(self):
+        return len(self.products)
+
+    def search(self, product_name: str = None, category: str = None, properties: str = None, size: int = 10,
+               strict_properties: bool = False, strict_category: bool = False, search_after: list = None) -> Tuple[List[Dict], Optional[list]]:
+        """
+        Cùng ngữ nghĩa với build_search_body: tên sản phẩm bắt buộc khớp (OR các từ), cộng điểm
+        khi khớp cả cụm (x10) và khớp danh mục (x5); strict_* chuyển danh mục / thuộc tính thành
+        điều kiện bắt buộc. Trả về (trang sản phẩm, search_after của trang sau hoặc None).
+        """
+        doc_count = len(self.products)
+        total = np.zeros(doc_count, dtype=np.float64)
+        required = np.ones(doc_count, dtype=bool)
+        any_should = np.zeros(doc_count, dtype=bool)
+        has_must = False
+
+        if product_name:
+            name_terms = tokenize(product_name)
+            field = self.fields["product_name"]
+            scores, matched = field.match(name_terms, doc_count)
+            has_must = True
+            required &= matched
+            total += scores
+            # Cộng điểm khớp nguyên cụm từ
+            total += np.where(field.phrase(name_terms, doc_count), scores * PHRASE_BOOST, 0.0)
+
+        if category:
+            if strict_category:
+                # Tương đương match trên category.keyword: khớp nguyên chuỗi
+                mask = np.zeros(doc_count, dtype=bool)
+                mask[self.category_keywords.get(str(category).strip(), np.empty(0, dtype=np.int64))] = True
+                has_must = True
+                required &= mask
+            else:
+                scores, matched = self.fields["category"].match(tokenize(category), doc_count)
+                total += scores * CATEGORY_BOOST
+                any_should |= matched
+
+        if properties:
+            scores, matched = self.fields["properties"].match(tokenize(properties), doc_count, require_all=True)
+            total += scores
+            if strict_properties:
+                has_must = True
+                required &= matched
+            else:
+                any_should |= matched
+
+        # Chỉ có điều kiện should thì phải khớp ít nhất một
+        candidates = np.flatnonzero(required if has_must else any_should)
+        scores = total[candidates]
+
+        if search_after:
+            after_score = float(search_after[0])
+            after_rank = bisect.bisect_right(self.sorted_codes, str(search_after[1]))
+            ranks = self.code_rank[candidates]
+            keep = (scores < after_score) | ((scores == after_score) & (ranks >= after_rank))
+            candidates, scores = candidates[keep], scores[keep]
+
+        # Chỉ sắp xếp phần đầu: mọi tài liệu có điểm >= điểm thứ `size` (kể cả bằng điểm)
+        if candidates.size > size:
+            threshold = np.partition(scores, candidates.size - size)[candidates.size - size]
+            top = scores >= threshold
+            candidates, scores = candidates[top], scores[top]
+        order = np.lexsort((self.code_rank[candidates], -scores))[:size]
+        page = candidates[order]
+
+        next_search_after = None
+        if page.size == size and size > 0:
+            last = page[-1]
+            next_search_after = [float(total[last]), self.codes[last]]
+        return [self.products[doc_id] for doc_id in page.tolist()], next_search_after
+
+
+_index: Optional[CatalogIndex] = None
+_reload_lock = threading.Lock()
+# Bảo vệ cờ "reloading" để chỉ một luồng nạp nền được khởi động
+_reload_lock_guard = threading.Lock()
+_state = {"path": LOCAL_CATALOG_PATH, "source": None, "last_check": 0.0, "loaded_at": None, "load_seconds": None, "reloads": 0, "reloading": False}
+
+
+def _catalog_source(path: str = None) -> Tuple[str, str]:
+    """Nguồn dữ liệu hiện tại: snapshot đã công bố (nếu có), nếu không thì file xlsx."""
+    if path is None:
+        pointer = read_current_pointer()
+        if pointer:
+            return "snapshot", pointer
+    path = path or _state["path"]
+    return "xlsx", f"{path}@{os.path.getmtime(path)}"
+
+
+def load_catalog_index(path: str = None) -> CatalogIndex:
+    """
+    Dựng chỉ mục mới rồi thay thế chỉ mục đang dùng (một phép gán, an toàn khi đang có truy vấn).
+    Khi có snapshot catalog, sản phẩm được đọc thẳng từ vùng nhớ map dùng chung giữa các worker
+    thay vì mỗi worker giữ một bản sao.
+    """
+    global _index
+    with _reload_lock:
+        start = time.perf_counter()
+        kind, source = _catalog_source(path)
+        products = get_current_snapshot(refresh=True) if kind == "snapshot" else None
+        if kind == "snapshot" and products is None:
+            # Không mở được snapshot: dùng file xlsx, giữ `source` là con trỏ snapshot để không nạp lại liên tục
+            logger.warning("Không mở được snapshot catalog, nạp chỉ mục từ file xlsx.")
+            kind = "xlsx"
+        if products is None:
+            products = load_catalog_records(path or _state["path"])
+        index = CatalogIndex(products, version=source)
+        _index = index
+        _state.update(source=source, loaded_at=time.time(), load_seconds=time.perf_counter() - start)
+        if path:
+            _state["path"] = path
+        _state["reloads"] += 1
+        logger.info("Đã nạp %d sản phẩm (%s) vào chỉ mục tìm kiếm trong bộ nhớ (%.2fs).", len(index), kind, _state['load_seconds'])
+        return index
+
+
+def _reload_in_background():
+    try:
+        load_catalog_index()
+    except Exception as e:
+        logger.warning("Không thể nạp lại catalog: %s", e)
+    finally:
+        _state["reloading"] = False
+
+
+def _start_background_load():
+    with _reload_lock_guard:
+        if _state["reloading"]:
+            return
+        _state["reloading"] = True
+    threading.Thread(target=_reload_in_background, daemon=True).start()
+
+
+def _maybe_reload():
+    """Catalog đổi thì dựng lại chỉ mục trong luồng nền; các truy vấn vẫn dùng chỉ mục cũ cho tới khi xong."""
+    now = time.monotonic()
+    if _state["reloading"] or now - _state["last_check"] < LOCAL_RELOAD_CHECK_SECONDS:
+        return
+    _state["last_check"] = now
+    try:
+        _, source = _catalog_source()
+    except OSError:
+        return
+    if source != _state["source"]:
+        logger.info("Catalog đã thay đổi, nạp lại chỉ mục trong bộ nhớ.")
+        _start_background_load()
+
+
+def get_catalog_index() -> Optional[CatalogIndex]:
+    """
+    Chỉ mục đang dùng. Nếu chưa được nạp (startup chưa nạp xong hoặc nạp lỗi), bắt đầu nạp trong luồng nền
+    và trả về None: việc dựng chỉ mục không chạy trên event loop, lượt chat dùng Elasticsearch trong lúc chờ.
+    """
+    if _index is None:
+        # Nạp lỗi thì chỉ thử lại sau LOCAL_RELOAD_CHECK_SECONDS, không dựng lại ở mọi truy vấn
+        now = time.monotonic()
+        if not _state["last_check"] or now - _state["last_check"] >= LOCAL_RELOAD_CHECK_SECONDS:
+            _state["last_check"] = now
+            _start_background_load()
+        return None
+    _maybe_reload()
+    return _index
+
+
+def get_local_search_stats() -> Dict:
+    stats = dict(_state)
+    stats["products"] = len(_index) if _index is not None else 0
+    stats["snapshot"] = get_snapshot_stats()
+    return stats
@@ -0,0 +1,156 @@
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+
+from src.config.settings import PREFETCH_ENABLED, PREFETCH_TTL_SECONDS, PREFETCH_MAX_SESSIONS
+from src.services.search_service import search_products, close_search_cursor
+from src.services.response_service import filter_products_with_ai
+from src.utils.turn_context import set_current_turn, Deadline
+from src.utils.logging_setup import get_logger
+
+logger = get_logger(__name__)
+
+# Trang "xem thêm" tiếp theo được tải trước cho từng session:
+# session_id -> {"key", "task", "created_at"}
+# Chỉ được truy cập từ event loop nên không cần khóa.
+_prefetches: Dict[str, Dict] = {}
+_stats = {
+    "scheduled": 0,
+    "hits": 0,        # kết quả đã sẵn sàng khi khách hỏi
+    "joined": 0,      # đang tải dở, lượt chat chờ tiếp thay vì tìm lại từ đầu
+    "misses": 0,      # không có kết quả tải trước
+    "stale": 0,       # có nhưng không dùng được (đổi truy vấn / cursor, quá hạn)
+    "cancelled": 0,
+    "errors": 0,
+}
+
+
+def _prefetch_key(last_query: Dict, cursor: Optional[Dict]) -> Tuple:
+    """Kết quả tải trước chỉ dùng được cho đúng truy vấn và đúng vị trí cursor đã dùng để tải."""
+    cursor = cursor or {}
+    return (
+        last_query.get("product_name"),
+        last_query.get("category"),
+        last_query.get("properties"),
+        cursor.get("pit_id"),
+        tuple(cursor.get("search_after") or ()),
+    )
+
+
+async def _prefetch_page(last_query: Dict, cursor: Optional[Dict], user_query: str, history_text: str, filter_with_ai: bool):
+    # Chạy ngoài lượt chat đã trả lời: không bị hủy theo lượt đó, không tính token vào lượt đó
+    set_current_turn(None)
+    retrieved = await search_products(
+        product_name=last_query["product_name"],
+        category=last_query["category"],
+        properties=last_query["properties"],
+        cursor=cursor,
+        strict_properties=True,
+        strict_category=True,
+        # "detail" chứa mọi trường của "listing", dùng được cho cả câu hỏi thông số
+        source_profile="detail",
+        paginate=True
+    )
+    page_cursor = retrieved.cursor
+    products = list(retrieved)
+    if filter_with_ai and products:
+        products = await asyncio.to_thread(filter_products_with_ai, user_query, history_text, products)
+    return products, page_cursor, filter_with_ai
+
+
+def _discard(entry: Dict):
+    """Bỏ một kết quả tải trước: hủy tác vụ nếu còn chạy, đóng PIT mà nó đã mở."""
+    task = entry["task"]
+    _stats["cancelled"] += 1
+    if not task.done():
+        task.cancel()
+        return
+    if task.cancelled() or task.exception() is not None:
+        return
+    _, page_cursor, _ = task.result()
+    source_pit = entry["key"][3]
+    if page_cursor and page_cursor.get("pit_id") and page_cursor["pit_id"] != source_pit:
+        asyncio.create_task(close_search_cursor(page_cursor))
+
+
+def schedule_prefetch(session_id: str, last_query: Optional[Dict], cursor: Optional[Dict], user_query: str, history_text: str, filter_with_ai: bool = True):
+    """
+    Tải trước và lọc trước trang "xem thêm" tiếp theo của `last_query` ở chế độ nền,
+    ngay sau khi đã trả lời khách. Thay thế kết quả tải trước cũ của session.
+    """
+    cancel_prefetch(session_id)
+    if not PREFETCH_ENABLED or not last_query or (cursor and cursor.get("exhausted")):
+        return
+
+    if len(_prefetches) >= PREFETCH_MAX_SESSIONS:
+        oldest = min(_prefetches, key=lambda sid: _prefetches[sid]["created_at"])
+        _discard(_prefetches.pop(oldest))
+
+    task = asyncio.create_task(_prefetch_page(last_query, cursor, user_query, history_text, filter_with_ai))
+    # Lấy exception ra để không bị cảnh báo "exception was never retrieved" khi không ai dùng tới
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    _prefetches[session_id] = {"key": _prefetch_key(last_query, cursor), "task": task, "created_at": time.time()}
+    _stats["scheduled"] += 1
+
+
+async def take_prefetched(session_id: str, last_query: Dict, cursor: Optional[Dict], deadline: Deadline = None) -> Optional[Tuple[List[Dict], Optional[Dict], bool]]:
+    """
+    Lấy trang đã tải trước cho lượt "xem thêm" hiện tại.
+    Trả về (sản phẩm, cursor trang sau, đã lọc AI hay chưa), hoặc None nếu phải tìm kiếm lại.
+    """
+    entry = _prefetches.pop(session_id, None)
+    if entry is None:
+        _stats["misses"] += 1
+        return None
+
+    if entry["key"] != _prefetch_key(last_query, cursor) or time.time() - entry["created_at"] > PREFETCH_TTL_SECONDS:
+        _stats["stale"] += 1
+        _discard(entry)
+        return None
+
+    task = entry["task"]
+    joined = not task.done()
+    if joined:
+        try:
+            await asyncio.wait_for(asyncio.shield(task), timeout=deadline.timeout() if deadline else None)
+        except asyncio.TimeoutError:
+            _stats["misses"] += 1
+            _discard(entry)
+            return None
+        except asyncio.CancelledError:
+            # Lượt chat bị hủy, session giữ nguyên nên kết quả tải trước vẫn còn dùng được
+            if not task.cancelled():
+                _prefetches.setdefault(session_id, entry)
+            raise
+        except Exception:
+            pass
+
+    if task.cancelled() or task.exception() is not None:
+        _stats["errors"] += 1
+        if not task.cancelled():
+            logger.warning("Tải trước trang tiếp theo thất bại: %s", task.exception())
+        return None
+    _stats["joined" if joined else "hits"] += 1
+    return task.result()
+
+
+def cancel_prefetch(session_id: str):
+    """Hủy kết quả tải trước của session (khách đã chuyển sang chủ đề khác)."""
+    entry = _prefetches.pop(session_id, None)
+    if entry is not None:
+        _discard(entry)
+
+
+def cancel_all_prefetches():
+    for session_id in list(_prefetches):
+        cancel_prefetch(session_id)
+
+
+def get_prefetch_stats() -> Dict:
+    stats = dict(_stats)
+    used = stats["hits"] + stats["joined"]
+    requests = used + stats["misses"] + stats["stale"] + stats["errors"]
+    stats["hit_rate"] = used / requests if requests else 0.0
+    stats["pending_sessions"] = len(_prefetches)
+    stats["enabled"] = PREFETCH_ENABLED
+    return stats
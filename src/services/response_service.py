@@ -2,8 +2,13 @@ import json
 import re
 from collections import defaultdict
 from typing import List, Dict, Optional
-from src.services.llm_service import get_gemini_model, get_lmstudio_response, get_openai_model
+from src.services.llm_service import get_gemini_model, get_lmstudio_response, get_openai_model, gemini_request_options, openai_request_options, track_llm_call
 from src.utils.helpers import is_general_query, format_history_text
+from src.utils.turn_context import raise_if_cancelled, note_llm_usage, Deadline
+from src.utils.logging_setup import get_logger, log_payload
+from src.config.settings import STAGE_MIN_BUDGET, LMSTUDIO_TIMEOUT
+
+logger = get_logger(__name__)
 
 def generate_llm_response(
     user_query: str,
@@ -13,10 +18,12 @@ def generate_llm_response(
     model_choice: str = "gemini",
     needs_product_search: bool = True,
     wants_images: bool = False,
-    is_image_search: bool = False
+    is_image_search: bool = False,
+    deadline: Deadline = None
 ) -> str:
     """
     Tạo prompt và gọi đến LLM để sinh câu trả lời.
+    Nếu ngân sách thời gian của lượt chat không còn đủ, dùng câu trả lời dự phòng.
     """
     if is_general_query(user_query):
         if not search_results:
@@ -49,39 +56,50 @@ def generate_llm_response(
 
     prompt = _build_prompt(user_query, context, needs_product_search, wants_images, product_infos, has_history, is_image_search)
 
-    print("--- PROMPT GỬI ĐẾN LLM ---")
-    print(prompt)
-    print("--------------------------")
+    log_payload(logger, "prompt", "Prompt sinh câu trả lời", prompt)
+
+    if deadline and not deadline.has(STAGE_MIN_BUDGET["generation"]):
+        logger.info("Không đủ thời gian để gọi LLM (còn %.1fs), sử dụng câu trả lời dự phòng.", deadline.remaining())
+        fallback = _get_fallback_response(search_results, needs_product_search)
+        return {"answer": fallback, "product_images": []} if wants_images else fallback
 
+    raise_if_cancelled()
     llm_response = None
     try:
         if model_choice == "gemini":
             model = get_gemini_model()
             if model:
-                response = model.generate_content(prompt, safety_settings={'HARM_CATEGORY_HARASSMENT': 'BLOCK_NONE'})
+                with track_llm_call("gemini"):
+                    response = model.generate_content(prompt, safety_settings={'HARM_CATEGORY_HARASSMENT': 'BLOCK_NONE'}, request_options=gemini_request_options(deadline))
                 llm_response = response.text.strip()
         elif model_choice == "lmstudio":
-            llm_response = get_lmstudio_response(prompt)
+            llm_response = get_lmstudio_response(prompt, timeout=deadline.timeout(LMSTUDIO_TIMEOUT) if deadline else LMSTUDIO_TIMEOUT)
         elif model_choice == "openai":
             openai = get_openai_model()
             if not openai:
                 return {"answer": "Không tìm thấy OpenAI API key.", "product_images": []} if wants_images else "Không tìm thấy OpenAI API key."
-            response = openai.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.5,
-                max_tokens=4000
-            )
+            with track_llm_call("openai"):
+                response = openai.chat.completions.create(
+                    model="gpt-4o-mini",
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=0.5,
+                    max_tokens=4000,
+                    **openai_request_options(deadline)
+                )
             llm_response = response.choices[0].message.content.strip()
             usage = response.usage
-            print(f"📊 Prompt: {usage.prompt_tokens}, Completion: {usage.completion_tokens}, Total: {usage.total_tokens}")
             cost = (usage.prompt_tokens * 0.15 + usage.completion_tokens * 0.6) / 1_000_000
-            print(f"💰 Estimated cost (GPT-4o-mini): ${cost:.6f}")
+            logger.debug("OpenAI token: prompt %s, completion %s, tổng %s, chi phí ước tính (GPT-4o-mini) $%.6f",
+                         usage.prompt_tokens, usage.completion_tokens, usage.total_tokens, cost)
 
     except Exception as e:
-        print(f"Lỗi khi gọi LLM: {e}")
+        logger.warning("Lỗi khi gọi LLM: %s", e)
         llm_response = None
 
+    note_llm_usage(prompt, llm_response)
+    if llm_response:
+        log_payload(logger, "response", "Câu trả lời của LLM", llm_response)
+
     if wants_images:
         answer, product_images = _parse_answer_and_images(llm_response, product_infos)
         return {"answer": answer, "product_images": product_images}
@@ -91,6 +109,33 @@ def generate_llm_response(
         return _get_fallback_response(search_results, needs_product_search)
 
 
+def generate_templated_response(
+    search_results: list,
+    include_specs: bool = False,
+    needs_product_search: bool = True,
+    wants_images: bool = False
+):
+    """
+    Câu trả lời không cần LLM, dựng từ _build_product_context (giá, tồn kho, link).
+    Dùng trong chế độ degraded khi LLM quá tải. Trả về cùng định dạng với generate_llm_response.
+    """
+    if not needs_product_search:
+        answer = "Dạ, em chào anh/chị. Anh/chị đang quan tâm sản phẩm nào để em tư vấn ạ?"
+    elif not search_results:
+        answer = _get_fallback_response(search_results, needs_product_search)
+    else:
+        product_lines = _build_product_context(search_results, include_specs).split("\n", 1)[1]
+        answer = "Dạ, em gửi anh/chị thông tin các sản phẩm liên quan ạ:\n" + product_lines.rstrip()
+
+    if wants_images:
+        product_images = [
+            f"{p.get('product_name', '')} ({p.get('properties', '')})"
+            for p in search_results if p.get('product_name')
+        ] if needs_product_search else []
+        return {"answer": answer, "product_images": product_images}
+    return answer
+
+
 def _build_product_context(search_results: List[Dict], include_specs: bool = False) -> str:
     """
     Xây dựng context thông tin sản phẩm, nhóm các sản phẩm cùng tên lại với nhau.
@@ -352,7 +397,7 @@ def _get_fallback_response(search_results: List[Dict], needs_product_search: boo
     else:
         return "Dạ, em xin lỗi, em không hiểu rõ câu hỏi của anh/chị. Anh/chị có thể hỏi lại không ạ?"
     
-def evaluate_and_choose_product(user_query: str, history_text: str, product_candidates: List[Dict], model_choice: str = "gemini") -> Dict:
+def evaluate_and_choose_product(user_query: str, history_text: str, product_candidates: List[Dict], model_choice: str = "gemini", deadline: Deadline = None) -> Dict:
     """
     Sử dụng một lệnh gọi AI duy nhất để vừa đánh giá độ cụ thể của yêu cầu,
     vừa chọn ra sản phẩm phù hợp nhất nếu có thể.
@@ -367,7 +412,7 @@ def evaluate_and_choose_product(user_query: str, history_text: str, product_cand
         props = product.get("properties", "")
         full_name = f"{name} ({props})" if props and str(props) != '0' else name
         prompt_list += f"{i}: {full_name}\n"
-    print("Danh sách các sản phẩm trước khi đánh giá:\n", prompt_list)
+    logger.debug("Danh sách các sản phẩm trước khi đánh giá:\n%s", prompt_list)
     prompt = f"""
     Bạn là một AI chuyên phân tích và chọn lựa sản phẩm. Dựa vào yêu cầu của khách hàng và danh sách sản phẩm, hãy thực hiện các nhiệm vụ sau:
     1. Phân tích yêu cầu của khách và danh sách sản phẩm.
@@ -410,10 +455,18 @@ def evaluate_and_choose_product(user_query: str, history_text: str, product_cand
     JSON kết quả:
     """
 
+    if deadline and not deadline.has(STAGE_MIN_BUDGET["evaluation"]):
+        logger.info("Không đủ thời gian để AI đánh giá sản phẩm.")
+        return {'type': 'NO_MATCH', 'score': 0.0, 'product': None, 'reason': None}
+
+    raise_if_cancelled()
     try:
         model = get_gemini_model()
         if model:
-            response = model.generate_content(prompt)
+            with track_llm_call("gemini"):
+                response = model.generate_content(prompt, request_options=gemini_request_options(deadline))
+            note_llm_usage(prompt, response.text)
+            log_payload(logger, "response", "Phản hồi đánh giá sản phẩm", response.text)
             json_text = re.search(r'\{.*\}', response.text, re.DOTALL).group(0)
             data = json.loads(json_text)
             
@@ -426,7 +479,7 @@ def evaluate_and_choose_product(user_query: str, history_text: str, product_cand
             if index is not None and 0 <= index < len(product_candidates):
                 product = product_candidates[index]
 
-            print(f"AI đánh giá: {request_type}, score: {score}, chọn index: {index}, lý do: {reason}")
+            logger.info("AI đánh giá: %s, score: %s, chọn index: %s, lý do: %s", request_type, score, index, reason)
             
             if request_type in ["PERFECT_MATCH", "CLOSE_MATCH"] and product:
                  return {'type': request_type, 'score': score, 'product': product, 'reason': reason}
@@ -434,12 +487,12 @@ def evaluate_and_choose_product(user_query: str, history_text: str, product_cand
             return {'type': 'NO_MATCH', 'score': 0.0, 'product': None, 'reason': None}
 
     except Exception as e:
-        print(f"Lỗi khi AI đánh giá và chọn sản phẩm: {e}")
+        logger.warning("Lỗi khi AI đánh giá và chọn sản phẩm: %s", e)
 
     # Fallback an toàn
     return {'type': 'NO_MATCH', 'score': 0.0, 'product': None, 'reason': None}
 
-def evaluate_purchase_confirmation(user_query: str, history_text: str, model_choice: str = "gemini") -> Dict:
+def evaluate_purchase_confirmation(user_query: str, history_text: str, model_choice: str = "gemini", deadline: Deadline = None) -> Dict:
     """
     Sử dụng AI để đánh giá phản hồi của khách hàng khi được hỏi xác nhận đơn hàng.
     Trả về một dictionary: {'decision': 'CONFIRM'/'CANCEL'/'UNCLEAR'}
@@ -467,30 +520,90 @@ def evaluate_purchase_confirmation(user_query: str, history_text: str, model_cho
     JSON kết quả:
     """
 
+    if deadline and not deadline.has(STAGE_MIN_BUDGET["confirmation"]):
+        logger.info("Không đủ thời gian để AI đánh giá xác nhận đơn hàng: UNCLEAR")
+        return {'decision': 'UNCLEAR'}
+
+    raise_if_cancelled()
     try:
         model = get_gemini_model()
         if model:
             # Sử dụng generation_config để đảm bảo đầu ra là JSON
             from google.generativeai.types import GenerationConfig
             generation_config = GenerationConfig(response_mime_type="application/json")
-            response = model.generate_content(prompt, generation_config=generation_config)
+            with track_llm_call("gemini"):
+                response = model.generate_content(prompt, generation_config=generation_config, request_options=gemini_request_options(deadline))
+            note_llm_usage(prompt, response.text)
             
             data = json.loads(response.text)
             decision = data.get("decision", "UNCLEAR").upper()
 
             if decision in ["CONFIRM", "CANCEL"]:
-                print(f"AI đánh giá ý định xác nhận: {decision}")
+                logger.info("AI đánh giá ý định xác nhận: %s", decision)
                 return {'decision': decision}
 
         # Nếu có lỗi hoặc không xác định được, coi như không rõ ràng
-        print("AI đánh giá ý định xác nhận: UNCLEAR")
+        logger.info("AI đánh giá ý định xác nhận: UNCLEAR")
         return {'decision': 'UNCLEAR'}
 
     except Exception as e:
-        print(f"Lỗi khi AI đánh giá xác nhận đơn hàng: {e}")
+        logger.warning("Lỗi khi AI đánh giá xác nhận đơn hàng: %s", e)
         return {'decision': 'UNCLEAR'}
 
-def filter_products_with_ai(user_query: str, history_text: str, product_candidates: List[Dict]) -> List[Dict]:
+def evaluate_purchase_confirmation_locally(user_query: str) -> Dict:
+    """
+    Đánh giá câu trả lời xác nhận đơn hàng bằng từ khóa, không gọi LLM (chế độ degraded).
+    Từ chối được xét trước vì câu từ chối thường có cả "dạ", "vâng" ("dạ không ạ"); câu hỏi hoặc câu dài
+    (khách hỏi sang chuyện khác) là UNCLEAR.
+    """
+    words = re.sub(r"[^\w\s]", " ", user_query.lower()).split()
+    query = " " + " ".join(words) + " "
+    if "?" in user_query or len(words) > 6:
+        logger.info("Đánh giá ý định xác nhận (từ khóa): UNCLEAR")
+        return {'decision': 'UNCLEAR'}
+    cancel_keywords = ["không", "ko", "k", "thôi", "hủy", "huỷ", "bỏ", "chưa"]
+    confirm_keywords = ["ok", "oke", "okay", "đúng", "chốt", "lấy", "vâng", "dạ", "ừ", "uk", "được", "đồng ý", "có", "chuẩn"]
+    if any(f" {kw} " in query for kw in cancel_keywords):
+        decision = "CANCEL"
+    elif any(f" {kw} " in query for kw in confirm_keywords):
+        decision = "CONFIRM"
+    else:
+        decision = "UNCLEAR"
+    logger.info("Đánh giá ý định xác nhận (từ khóa): %s", decision)
+    return {'decision': decision}
+
+def evaluate_and_choose_product_locally(product_name: str, properties: str, product_candidates: List[Dict], suggestion_confirmed: bool = False) -> Dict:
+    """
+    Chọn sản phẩm cho vòng mua hàng không gọi LLM (chế độ degraded), cùng dạng kết quả với evaluate_and_choose_product.
+    PERFECT_MATCH khi khách vừa đồng ý gợi ý trước (`suggestion_confirmed`, gợi ý nằm đầu danh sách) hoặc tên / thuộc tính
+    sản phẩm chứa đủ các từ khách yêu cầu (ưu tiên sản phẩm còn hàng); không thì gợi ý sản phẩm đầu tiên (CLOSE_MATCH)
+    để khách xác nhận.
+    """
+    if not product_candidates:
+        return {'type': 'NO_MATCH', 'score': 0.0, 'product': None, 'reason': None}
+    if suggestion_confirmed:
+        return {'type': 'PERFECT_MATCH', 'score': 1.0, 'product': product_candidates[0], 'reason': None}
+
+    wanted = set(re.findall(r"\w+", f"{product_name or ''} {properties or ''}".lower()))
+    matches = [
+        product for product in product_candidates
+        if wanted and wanted <= set(re.findall(r"\w+", f"{product.get('product_name') or ''} {product.get('properties') or ''}".lower()))
+    ]
+
+    def in_stock(product):
+        try:
+            return int(product.get("inventory") or 0) > 0
+        except (ValueError, TypeError):
+            return False
+
+    if matches:
+        chosen = next((product for product in matches if in_stock(product)), matches[0])
+        logger.info("Đánh giá sản phẩm (từ khóa): PERFECT_MATCH")
+        return {'type': 'PERFECT_MATCH', 'score': 1.0, 'product': chosen, 'reason': None}
+    logger.info("Đánh giá sản phẩm (từ khóa): CLOSE_MATCH")
+    return {'type': 'CLOSE_MATCH', 'score': 0.5, 'product': product_candidates[0], 'reason': None}
+
+def filter_products_with_ai(user_query: str, history_text: str, product_candidates: List[Dict], deadline: Deadline = None) -> List[Dict]:
     """
     Sử dụng AI để lọc và chọn ra những sản phẩm phù hợp nhất từ danh sách tìm kiếm.
     """
@@ -498,6 +611,11 @@ def filter_products_with_ai(user_query: str, history_text: str, product_candidat
     if not product_candidates or len(product_candidates) <= 1:
         return product_candidates
 
+    # Không đủ thời gian thì bỏ qua bước lọc, dùng nguyên kết quả tìm kiếm
+    if deadline and not deadline.has(STAGE_MIN_BUDGET["filter"]):
+        logger.info("Không đủ thời gian để AI lọc sản phẩm (còn %.1fs), giữ nguyên danh sách.", deadline.remaining())
+        return product_candidates
+
     prompt_list = ""
     for i, product in enumerate(product_candidates):
         name = product.get("product_name", "")
@@ -506,7 +624,7 @@ def filter_products_with_ai(user_query: str, history_text: str, product_candidat
         full_name = f"{name} {category} ({props})" if props and str(props) != '0' else f"{name} {category}"
         prompt_list += f"Sản phẩm {i}: {full_name}\n"
 
-    print("Danh sách các sản phẩm trước khi lọc:\n", prompt_list)
+    logger.debug("Danh sách các sản phẩm trước khi lọc:\n%s", prompt_list)
     prompt = f"""
     Bạn là một chuyên gia bán hàng thông thái. Nhiệm vụ của bạn là giúp nhân viên tư vấn chọn ra những sản phẩm phù hợp nhất để giới thiệu cho khách hàng.
 
@@ -542,12 +660,16 @@ def filter_products_with_ai(user_query: str, history_text: str, product_candidat
     JSON kết quả:
     """
 
+    raise_if_cancelled()
     try:
         model = get_gemini_model()
         if model:
             from google.generativeai.types import GenerationConfig
             generation_config = GenerationConfig(response_mime_type="application/json")
-            response = model.generate_content(prompt, generation_config=generation_config)
+            with track_llm_call("gemini"):
+                response = model.generate_content(prompt, generation_config=generation_config, request_options=gemini_request_options(deadline))
+            note_llm_usage(prompt, response.text)
+            log_payload(logger, "response", "Phản hồi lọc sản phẩm", response.text)
             data = json.loads(response.text)
             
             indices = data.get("indices", [])
@@ -556,17 +678,17 @@ def filter_products_with_ai(user_query: str, history_text: str, product_candidat
 
             # Nếu AI không chọn được sản phẩm nào phù hợp, trả về danh sách rỗng.
             if not indices:
-                print("AI không chọn sản phẩm nào. Trả về danh sách rỗng.")
+                logger.info("AI không chọn sản phẩm nào. Trả về danh sách rỗng.")
                 return []
 
             # Tạo danh sách sản phẩm mới dựa trên các index AI đã chọn
             filtered_products = [product_candidates[i] for i in indices if 0 <= i < len(product_candidates)]
             
-            print(f"AI đã lọc sản phẩm. Kết quả: {len(filtered_products)}/{len(product_candidates)} sản phẩm được chọn.")
+            logger.info("AI đã lọc sản phẩm. Kết quả: %d/%d sản phẩm được chọn.", len(filtered_products), len(product_candidates))
             return filtered_products
 
     except Exception as e:
-        print(f"Lỗi khi AI lọc sản phẩm: {e}")
+        logger.warning("Lỗi khi AI lọc sản phẩm: %s", e)
 
     # Nếu có lỗi, trả về danh sách gốc để không làm gián đoạn cuộc trò chuyện
     return product_candidates
\ No newline at end of file
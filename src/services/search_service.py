@@ -1,34 +1,305 @@
+import asyncio
 import os
-from elasticsearch import Elasticsearch
+import json
+import threading
+import time
+from elasticsearch import AsyncElasticsearch, ApiError, TransportError, NotFoundError
 from src.config.settings import PAGE_SIZE
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
+from src.utils.turn_context import raise_if_cancelled, Deadline
+from src.utils.circuit_breaker import CircuitBreaker
+from src.utils.result_cache import ResultCache
+from src.utils.metrics import Counter, Histogram
+from src.utils.logging_setup import get_logger
+from src.services import local_search, image_index
 
+logger = get_logger(__name__)
+
+# "elasticsearch" (mặc định) hoặc "memory": tìm kiếm văn bản trên chỉ mục trong bộ nhớ
+# dựng từ file catalog, không cần Elasticsearch (xem local_search)
+SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND", "elasticsearch").lower()
+# "elasticsearch" (mặc định) hoặc "local": tìm kiếm bằng ảnh trên ma trận embedding của
+# snapshot catalog trong tiến trình (xem image_index)
+IMAGE_SEARCH_BACKEND = os.environ.get("IMAGE_SEARCH_BACKEND", "elasticsearch").lower()
 ELASTIC_HOST = os.environ.get("ELASTIC_HOST", "http://localhost:9200")
 INDEX_NAME = os.environ.get("ELASTIC_INDEX", "products_news")
+ES_REQUEST_TIMEOUT = float(os.environ.get("ES_REQUEST_TIMEOUT", "5"))
+ES_MAX_RETRIES = int(os.environ.get("ES_MAX_RETRIES", "2"))
+ES_CONNECTIONS_PER_NODE = int(os.environ.get("ES_CONNECTIONS_PER_NODE", "20"))
+# Thời gian giữ point-in-time giữa hai lần "xem thêm"
+ES_PIT_KEEP_ALIVE = os.environ.get("ES_PIT_KEEP_ALIVE", "5m")
+# Thứ tự ổn định cho phân trang search_after: điểm liên quan rồi mã sản phẩm (duy nhất)
+SEARCH_SORT = [{"_score": {"order": "desc"}}, {"product_code": {"order": "asc"}}]
 
-try:
-    es_client = Elasticsearch(hosts=[ELASTIC_HOST])
-    if not es_client.ping():
-        raise ConnectionError("Không thể kết nối đến Elasticsearch từ search_service.")
-except ConnectionError as e:
-    print(f"Lỗi kết nối trong search_service: {e}")
-    es_client = None
+# Cache kết quả search_products trong tiến trình
+SEARCH_CACHE_ENABLED = os.environ.get("SEARCH_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+SEARCH_CACHE_MAX_ENTRIES = int(os.environ.get("SEARCH_CACHE_MAX_ENTRIES", "2000"))
+SEARCH_CACHE_MAX_MB = float(os.environ.get("SEARCH_CACHE_MAX_MB", "64"))
+SEARCH_CACHE_TTL_SECONDS = float(os.environ.get("SEARCH_CACHE_TTL_SECONDS", "300"))
+# Index chứa phiên bản catalog do script nạp dữ liệu ghi sau mỗi lần cập nhật;
+# phiên bản đổi thì toàn bộ cache bị xóa
+CATALOG_META_INDEX = os.environ.get("CATALOG_META_INDEX", "catalog_meta")
+CATALOG_VERSION_CHECK_SECONDS = float(os.environ.get("CATALOG_VERSION_CHECK_SECONDS", "30"))
 
-def search_products(product_name: str = None, category: str = None, properties: str = None, offset: int = 0, size: int = PAGE_SIZE, strict_properties: bool = False, strict_category: bool = False) -> List[Dict]:
-    if not product_name and not category and not properties:
-        return []
 
+class SearchUnavailableError(Exception):
+    """Elasticsearch không phản hồi (lỗi kết nối, timeout, lỗi 5xx hoặc circuit breaker đang mở)."""
+
+
+class SearchHits(list):
+    """
+    Danh sách sản phẩm tìm được, kèm thời gian truy vấn (ms) phía Elasticsearch và phía client.
+    `cursor` dùng để lấy trang tiếp theo; None nghĩa là đã hết kết quả.
+    `skipped` khác None (ví dụ "deadline") khi không tìm kiếm được: danh sách rỗng không có nghĩa là không có sản phẩm.
+    """
+
+    def __init__(self, hits=(), took_ms: Optional[int] = None, elapsed_ms: Optional[float] = None, cursor: Optional[Dict] = None,
+                 skipped: Optional[str] = None):
+        super().__init__(hits)
+        self.took_ms = took_ms
+        self.elapsed_ms = elapsed_ms
+        self.cursor = cursor
+        self.skipped = skipped
+
+
+# Nhóm trường _source cần lấy cho từng kiểu truy vấn. Luồng văn bản không bao giờ
+# lấy image_embedding (512 số thực mỗi sản phẩm) vì không dùng đến.
+_LISTING_FIELDS = [
+    "product_name", "category", "properties", "lifecare_price",
+    "inventory", "guarantee", "avatar_images", "link_product"
+]
+SOURCE_PROFILES = {
+    # Danh sách sản phẩm để lọc AI, sinh câu trả lời và gửi ảnh
+    "listing": _LISTING_FIELDS,
+    # Đánh giá sản phẩm khi khách chốt đơn: tên, thuộc tính, giá, tồn kho
+    "purchase": ["product_code", "product_name", "category", "properties", "lifecare_price", "inventory", "link_product"],
+    # Khi khách hỏi thông số / chi tiết
+    "detail": _LISTING_FIELDS + ["product_code", "trademark", "specifications"],
+    # Kết quả tìm kiếm bằng ảnh
+    "image": _LISTING_FIELDS + ["specifications"],
+}
+
+# Client được tạo khi có truy vấn đầu tiên, không kết nối lúc import
+_es_client: Optional[AsyncElasticsearch] = None
+_breaker = CircuitBreaker(
+    "elasticsearch",
+    failure_threshold=int(os.environ.get("ES_BREAKER_FAILURES", "5")),
+    reset_timeout=float(os.environ.get("ES_BREAKER_RESET_SECONDS", "30"))
+)
+_stats_lock = threading.Lock()
+_stats = {"queries": 0, "errors": 0, "rejected": 0, "total_took_ms": 0, "total_elapsed_ms": 0.0}
+_search_cache = ResultCache(
+    "search_products",
+    max_entries=SEARCH_CACHE_MAX_ENTRIES,
+    max_bytes=int(SEARCH_CACHE_MAX_MB * 1024 * 1024),
+    ttl_seconds=SEARCH_CACHE_TTL_SECONDS
+)
+_catalog = {"version": None, "last_check": 0.0}
+# took của Elasticsearch (thời gian phía server) và thời gian phía client, để thấy phần mất ở mạng / hàng đợi
+SEARCH_TOOK_SECONDS = Histogram("search_took_seconds", "Thời gian Elasticsearch báo trong trường took", ["query"])
+SEARCH_REQUEST_SECONDS = Histogram("search_request_duration_seconds", "Thời gian một truy vấn tìm kiếm phía client", ["query", "backend"])
+SEARCH_ERRORS_TOTAL = Counter("search_errors_total", "Số truy vấn Elasticsearch không phục vụ được", ["reason"])
+
+
+def get_es_client() -> AsyncElasticsearch:
+    """Trả về client Elasticsearch bất đồng bộ dùng chung (pool kết nối, tự retry lỗi tạm thời)."""
+    global _es_client
+    if _es_client is None:
+        _es_client = AsyncElasticsearch(
+            hosts=[ELASTIC_HOST],
+            request_timeout=ES_REQUEST_TIMEOUT,
+            max_retries=ES_MAX_RETRIES,
+            retry_on_timeout=True,
+            retry_on_status=(429, 502, 503, 504),
+            connections_per_node=ES_CONNECTIONS_PER_NODE
+        )
+    return _es_client
+
+
+async def close_es_client():
+    global _es_client
+    if _es_client is not None:
+        await _es_client.close()
+        _es_client = None
+
+
+async def _execute_search(label: str, deadline: Deadline = None, **search_kwargs) -> tuple:
+    """
+    Gửi một truy vấn search qua circuit breaker và ghi nhận thời gian.
+    Trả về (response, thời gian phía client tính bằng ms).
+    Ném SearchUnavailableError khi Elasticsearch không phục vụ được,
+    thay vì trả về danh sách rỗng (dễ bị hiểu nhầm là "không có sản phẩm").
+    """
+    raise_if_cancelled()
+    if not _breaker.allow_request():
+        with _stats_lock:
+            _stats["rejected"] += 1
+        SEARCH_ERRORS_TOTAL.inc(reason="rejected")
+        raise SearchUnavailableError("Circuit breaker của Elasticsearch đang mở.")
+
+    client = get_es_client()
+    if deadline is not None:
+        client = client.options(request_timeout=deadline.timeout(ES_REQUEST_TIMEOUT))
+
+    # Truy vấn theo point-in-time không được chỉ định index
+    if "pit" not in search_kwargs.get("body", {}):
+        search_kwargs["index"] = INDEX_NAME
+
+    start = time.perf_counter()
+    try:
+        response = await client.search(**search_kwargs)
+    except ApiError as e:
+        if e.meta.status >= 500 or e.meta.status == 429:
+            _breaker.record_failure()
+            with _stats_lock:
+                _stats["errors"] += 1
+            SEARCH_ERRORS_TOTAL.inc(reason=f"http_{e.meta.status}")
+            raise SearchUnavailableError(f"Elasticsearch trả về lỗi {e.meta.status}.") from e
+        # Elasticsearch vẫn phản hồi, chỉ là truy vấn không hợp lệ
+        _breaker.record_success()
+        raise
+    except TransportError as e:
+        _breaker.record_failure()
+        with _stats_lock:
+            _stats["errors"] += 1
+        SEARCH_ERRORS_TOTAL.inc(reason="transport")
+        raise SearchUnavailableError(f"Không kết nối được Elasticsearch: {e}") from e
+    except BaseException:
+        # Bị hủy (client ngắt kết nối, hết thời gian lượt chat, prefetch bị hủy) hoặc lỗi không rõ:
+        # không kết luận được về Elasticsearch, chỉ trả lại lượt thử của half_open
+        _breaker.release_trial()
+        raise
+
+    _breaker.record_success()
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    took_ms = response.get("took", 0)
+    with _stats_lock:
+        _stats["queries"] += 1
+        _stats["total_took_ms"] += took_ms
+        _stats["total_elapsed_ms"] += elapsed_ms
+    SEARCH_TOOK_SECONDS.observe(took_ms / 1000, query=label)
+    SEARCH_REQUEST_SECONDS.observe(elapsed_ms / 1000, query=label, backend="elasticsearch")
+    logger.debug("[%s] ES took=%sms, tổng=%.1fms", label, took_ms, elapsed_ms)
+    return response, elapsed_ms
+
+
+async def _open_point_in_time() -> str:
+    """
+    Mở point-in-time trên index sản phẩm. Lỗi phía server (5xx, 429) và lỗi kết nối thành
+    SearchUnavailableError như _execute_search; lỗi 4xx (ví dụ index không tồn tại) được ném lại dạng ApiError.
+    """
+    if not _breaker.allow_request():
+        raise SearchUnavailableError("Circuit breaker của Elasticsearch đang mở.")
+    try:
+        response = await get_es_client().open_point_in_time(index=INDEX_NAME, keep_alive=ES_PIT_KEEP_ALIVE)
+    except ApiError as e:
+        if e.meta.status >= 500 or e.meta.status == 429:
+            _breaker.record_failure()
+            raise SearchUnavailableError(f"Không mở được point-in-time: Elasticsearch trả về lỗi {e.meta.status}.") from e
+        _breaker.record_success()
+        raise
+    except TransportError as e:
+        _breaker.record_failure()
+        raise SearchUnavailableError(f"Không mở được point-in-time: {e}") from e
+    except BaseException:
+        _breaker.release_trial()
+        raise
+    _breaker.record_success()
+    return response["id"]
+
+
+async def close_search_cursor(cursor: Optional[Dict]):
+    """Giải phóng point-in-time của một cursor không còn dùng nữa (lỗi được bỏ qua, PIT sẽ tự hết hạn)."""
+    if not cursor or not cursor.get("pit_id"):
+        return
+    try:
+        await get_es_client().close_point_in_time(id=cursor["pit_id"])
+    except Exception as e:
+        logger.warning("Không thể đóng point-in-time: %s", e)
+
+
+async def _refresh_catalog_version():
+    """
+    Đọc phiên bản catalog (tối đa một lần mỗi CATALOG_VERSION_CHECK_SECONDS giây)
+    và xóa cache kết quả tìm kiếm khi dữ liệu đã được nạp lại.
+    """
+    now = time.monotonic()
+    if now - _catalog["last_check"] < CATALOG_VERSION_CHECK_SECONDS:
+        return
+    # Đánh dấu trước khi gọi để các truy vấn đồng thời không cùng kiểm tra
+    _catalog["last_check"] = now
+    # Chỉ đọc trạng thái, không dùng allow_request: lần kiểm tra phiên bản không được chiếm lượt thử
+    # của half_open (lượt thử dành cho truy vấn tìm kiếm, nơi kết quả được ghi nhận vào breaker)
+    if _breaker.state != "closed":
+        return
+    try:
+        response = await get_es_client().options(request_timeout=1.0).get(index=CATALOG_META_INDEX, id=INDEX_NAME)
+        version = response["_source"].get("version")
+    except NotFoundError:
+        version = None
+    except Exception as e:
+        logger.warning("Không đọc được phiên bản catalog: %s", e)
+        return
+    if version != _catalog["version"]:
+        if _catalog["version"] is not None:
+            logger.info("Catalog đổi phiên bản %s -> %s, xóa cache tìm kiếm.", _catalog["version"], version)
+        _search_cache.clear()
+        _catalog["version"] = version
+
+
+def _cache_key(product_name, category, properties, search_after, size, strict_properties, strict_category, source_profile) -> Tuple:
+    """Key cache: truy vấn đã chuẩn hóa (chữ thường, gộp khoảng trắng) cùng vị trí trang."""
+    def normalize(value):
+        return " ".join(str(value).lower().split()) if value is not None else None
+    return (
+        normalize(product_name), normalize(category), normalize(properties),
+        tuple(search_after) if search_after else None,
+        size, strict_properties, strict_category, source_profile
+    )
+
+
+def invalidate_search_cache():
+    """Xóa cache kết quả tìm kiếm (dùng khi tiến trình tự cập nhật dữ liệu)."""
+    _search_cache.clear()
+
+
+def get_search_stats() -> Dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    queries = stats["queries"] or 1
+    stats["avg_took_ms"] = stats["total_took_ms"] / queries
+    stats["avg_elapsed_ms"] = stats["total_elapsed_ms"] / queries
+    stats["circuit_breaker"] = _breaker.snapshot()
+    stats["cache"] = _search_cache.snapshot()
+    stats["cache"]["enabled"] = SEARCH_CACHE_ENABLED
+    stats["cache"]["catalog_version"] = _catalog["version"]
+    stats["backend"] = SEARCH_BACKEND
+    if SEARCH_BACKEND == "memory":
+        stats["local_index"] = local_search.get_local_search_stats()
+    stats["image_backend"] = IMAGE_SEARCH_BACKEND
+    if IMAGE_SEARCH_BACKEND == "local":
+        stats["image_index"] = image_index.get_image_index_stats()
+    return stats
+
+def build_search_body(product_name: str = None, category: str = None, properties: str = None, size: int = PAGE_SIZE, strict_properties: bool = False, strict_category: bool = False, source_profile: str = "listing", search_after: list = None) -> Dict:
+    """Dựng body truy vấn Elasticsearch cho search_products."""
     body = {
         "query": {
             "bool": {
                 "must": [],
                 "should": [],
-                "filter": []
+                "filter": [],
+                # Bỏ các sản phẩm đã bị xóa khỏi catalog (tombstone do nạp delta đánh dấu)
+                "must_not": [{"term": {"deleted": True}}]
             }
         },
         "size": size,
-        "from": offset
+        "sort": SEARCH_SORT,
+        "track_total_hits": False,
+        "_source": SOURCE_PROFILES[source_profile]
     }
+    if search_after:
+        body["search_after"] = search_after
 
     if product_name:
         # Điều kiện BẮT BUỘC: sản phẩm phải chứa các từ trong tên tìm kiếm
@@ -64,48 +335,152 @@ def search_products(product_name: str = None, category: str = None, properties:
         else:
             body["query"]["bool"]["should"].append(prop_query)
 
+    return body
+
+def _search_local(product_name, category, properties, search_after, size, strict_properties, strict_category, source_profile) -> Optional[SearchHits]:
+    """
+    search_products trên chỉ mục trong bộ nhớ; cursor chỉ cần search_after, không có PIT.
+    Trả về None khi chỉ mục chưa sẵn sàng (đang nạp trong nền) để search_products dùng Elasticsearch.
+    """
+    start = time.perf_counter()
+    index = local_search.get_catalog_index()
+    if index is None:
+        logger.warning("Chỉ mục trong bộ nhớ chưa sẵn sàng, tìm kiếm bằng Elasticsearch.")
+        return None
+    products, next_search_after = index.search(
+        product_name, category, properties, size, strict_properties, strict_category, search_after
+    )
+    fields = SOURCE_PROFILES[source_profile]
+    hits = [{field: product.get(field) for field in fields} for product in products]
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    next_cursor = {"pit_id": None, "search_after": next_search_after} if next_search_after else None
+    SEARCH_REQUEST_SECONDS.observe(elapsed_ms / 1000, query="search_products", backend="memory")
+    logger.debug("[search_products] local took=%.2fms, tìm thấy %d sản phẩm.", elapsed_ms, len(hits))
+    return SearchHits(hits, 0, elapsed_ms, next_cursor)
+
+async def search_products(product_name: str = None, category: str = None, properties: str = None, cursor: Optional[Dict] = None, size: int = PAGE_SIZE, strict_properties: bool = False, strict_category: bool = False, source_profile: str = "listing", deadline: Deadline = None, paginate: bool = False) -> List[Dict]:
+    """
+    Tìm kiếm sản phẩm theo tên, danh mục và thuộc tính.
+    `source_profile` chọn nhóm trường cần lấy về (xem SOURCE_PROFILES).
+
+    Phân trang bằng point-in-time + search_after: truyền `cursor` của trang trước
+    (SearchHits.cursor) để lấy trang tiếp theo. Với truy vấn sẽ được đọc tiếp nhiều trang,
+    truyền `paginate=True` ở trang đầu để PIT được mở ngay từ trang đầu: mọi trang cùng đọc
+    một snapshot của index nên không chồng lấn hay bỏ sót khi tồn kho được cập nhật giữa hai trang.
+    Không truyền `paginate` thì trang đầu được cache và không tốn lệnh mở PIT; cursor của nó
+    (pit_id None) vẫn đọc được trang sau, PIT khi đó được mở từ trang thứ hai.
+
+    Kết quả được cache theo truy vấn đã chuẩn hóa, cache bị xóa khi phiên bản catalog thay đổi.
+    Truy vấn gắn với PIT không dùng cache (trang trong cache có thể đến từ snapshot khác).
+    """
+    if not product_name and not category and not properties:
+        return SearchHits()
+
+    if deadline and deadline.expired():
+        logger.info("Hết thời gian cho lượt chat, bỏ qua tìm kiếm.")
+        return SearchHits(skipped="deadline")
+
+    search_after = cursor.get("search_after") if cursor else None
+    # Cursor có PIT là của một trang Elasticsearch (lúc chỉ mục trong bộ nhớ chưa sẵn sàng): đọc tiếp trên ES
+    if SEARCH_BACKEND == "memory" and not (cursor or {}).get("pit_id"):
+        hits = _search_local(product_name, category, properties, search_after, size, strict_properties, strict_category, source_profile)
+        if hits is not None:
+            return hits
+
+    use_pit = bool(cursor) or paginate
+    cache_key = None
+    if SEARCH_CACHE_ENABLED and not use_pit:
+        await _refresh_catalog_version()
+        cache_key = _cache_key(product_name, category, properties, search_after, size, strict_properties, strict_category, source_profile)
+        cached = _search_cache.get(cache_key)
+        if cached is not None:
+            products, next_search_after = cached
+            next_cursor = {"pit_id": None, "search_after": next_search_after} if next_search_after else None
+            return SearchHits([dict(p) for p in products], 0, 0.0, next_cursor)
+
+    body = build_search_body(product_name, category, properties, size, strict_properties, strict_category, source_profile, search_after)
+
+    pit_id = None
     try:
-        response = es_client.search(
-            index=INDEX_NAME,
-            body=body
-        )
-        hits = [hit['_source'] for hit in response['hits']['hits']]
-        print(f"Tìm thấy {len(hits)} sản phẩm (offset={offset}, strict_cat={strict_category}, strict_prop={strict_properties}).")
-        return hits
-    except Exception as e:
-        print(f"Lỗi khi tìm kiếm: {e}")
-        return []
+        if use_pit:
+            pit_id = (cursor or {}).get("pit_id") or await _open_point_in_time()
+            body["pit"] = {"id": pit_id, "keep_alive": ES_PIT_KEEP_ALIVE}
+        try:
+            response, elapsed_ms = await _execute_search("search_products", deadline, body=body)
+        except ApiError as e:
+            if not (pit_id and e.meta.status == 404):
+                raise
+            # PIT đã hết hạn (khách quay lại sau lâu): mở PIT mới, thứ tự sắp xếp vẫn giữ nguyên
+            logger.info("Point-in-time đã hết hạn, mở lại.")
+            pit_id = await _open_point_in_time()
+            body["pit"] = {"id": pit_id, "keep_alive": ES_PIT_KEEP_ALIVE}
+            response, elapsed_ms = await _execute_search("search_products", deadline, body=body)
+    except ApiError as e:
+        # Lỗi truy vấn (4xx): Elasticsearch vẫn hoạt động, coi như không có kết quả
+        logger.warning("Lỗi khi tìm kiếm: %s", e)
+        return SearchHits()
+
+    raw_hits = response['hits']['hits']
+    next_cursor = None
+    if len(raw_hits) == size:
+        next_cursor = {"pit_id": response.get("pit_id", pit_id), "search_after": raw_hits[-1]["sort"]}
+    elif pit_id and pit_id != (cursor or {}).get("pit_id"):
+        # PIT vừa mở trong lần gọi này (trang đầu hoặc mở lại sau khi hết hạn) mà đã là trang cuối:
+        # không cursor nào giữ nó để đóng sau
+        await close_search_cursor({"pit_id": response.get("pit_id", pit_id)})
+
+    hits = SearchHits([hit['_source'] for hit in raw_hits], response.get("took"), elapsed_ms, next_cursor)
+    if cache_key is not None:
+        products = [dict(p) for p in hits]
+        size_bytes = len(json.dumps(products, ensure_ascii=False, default=str))
+        _search_cache.put(cache_key, (products, next_cursor["search_after"] if next_cursor else None), size_bytes)
+    logger.debug("Tìm thấy %d sản phẩm (trang %s, strict_cat=%s, strict_prop=%s).", len(hits), "tiếp" if cursor else "đầu", strict_category, strict_properties)
+    return hits
     
-def search_products_by_image(image_embedding: list, top_k: int = 1, min_similarity: float = 0.97) -> list:
+async def search_products_by_image(image_embedding: list, top_k: int = 1, min_similarity: float = 0.97, deadline: Deadline = None) -> SearchHits:
     """
     Thực hiện tìm kiếm k-Nearest Neighbor (kNN) trong Elasticsearch
     để tìm các sản phẩm có ảnh tương đồng nhất.
     Chỉ trả về kết quả nếu độ tương đồng cao hơn một ngưỡng nhất định.
+    Hết ngân sách thời gian thì trả về SearchHits rỗng với skipped="deadline".
     """
     if not image_embedding:
-        return []
+        return SearchHits()
+
+    if deadline and deadline.expired():
+        logger.info("Hết thời gian cho lượt chat, bỏ qua tìm kiếm bằng ảnh.")
+        return SearchHits(skipped="deadline")
+
+    if IMAGE_SEARCH_BACKEND == "local":
+        result = await asyncio.to_thread(image_index.search_images, image_embedding, top_k, min_similarity, SOURCE_PROFILES["image"])
+        if result is not None:
+            products, elapsed_ms = result
+            SEARCH_REQUEST_SECONDS.observe(elapsed_ms / 1000, query="search_products_by_image", backend="local")
+            logger.debug("[search_products_by_image] local took=%.3fms, tìm thấy %d sản phẩm tương đồng (ngưỡng > %s).", elapsed_ms, len(products), min_similarity)
+            return SearchHits(products, 0, elapsed_ms)
+        logger.warning("Chỉ mục ảnh trong bộ nhớ chưa sẵn sàng, tìm kiếm bằng Elasticsearch.")
 
     knn_query = {
         "field": "image_embedding", 
         "query_vector": image_embedding,
         "k": top_k,
-        "num_candidates": 100 
+        "num_candidates": 100,
+        "filter": {"bool": {"must_not": [{"term": {"deleted": True}}]}}
     }
 
     try:
-        response = es_client.search(
-            index=INDEX_NAME,
+        response, elapsed_ms = await _execute_search(
+            "search_products_by_image",
+            deadline,
             knn=knn_query,
             min_score=min_similarity,
             size=top_k,
-            _source_includes=[ 
-                "product_name", "category", "properties", "specifications", "lifecare_price",
-                "inventory", "avatar_images", "link_product"
-            ]
+            source_includes=SOURCE_PROFILES["image"]
         )
-        hits = [hit['_source'] for hit in response['hits']['hits']]
-        print(f"Tìm thấy {len(hits)} sản phẩm tương đồng (ngưỡng > {min_similarity}).")
-        return hits
-    except Exception as e:
-        print(f"Lỗi khi tìm kiếm bằng vector: {e}")
-        return []
+    except ApiError as e:
+        logger.warning("Lỗi khi tìm kiếm bằng vector: %s", e)
+        return SearchHits()
+
+    hits = SearchHits([hit['_source'] for hit in response['hits']['hits']], response.get("took"), elapsed_ms)
+    logger.debug("Tìm thấy %d sản phẩm tương đồng (ngưỡng > %s).", len(hits), min_similarity)
+    return hits
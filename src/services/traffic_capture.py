@@ -0,0 +1,78 @@
+import hashlib
+import hmac
+import os
+import time
+from typing import Dict, Optional
+
+from src.utils.helpers import mask_phone_numbers
+from src.utils.jsonl_writer import BackgroundJsonlWriter
+from src.utils.turn_context import TurnContext
+
+# Ghi lại các lượt chat (đã ẩn danh) để phân tích cơ cấu traffic và chạy lại bằng benchmarks.traffic_replay.
+# Tắt mặc định.
+TRAFFIC_CAPTURE_ENABLED = os.environ.get("TRAFFIC_CAPTURE_ENABLED", "false").lower() in ("1", "true", "yes")
+TRAFFIC_CAPTURE_PATH = os.environ.get("TRAFFIC_CAPTURE_PATH", "cache/traffic_capture.jsonl")
+# Tỉ lệ session được ghi (chọn theo session để giữ trọn hội thoại)
+TRAFFIC_CAPTURE_SAMPLE_RATE = float(os.environ.get("TRAFFIC_CAPTURE_SAMPLE_RATE", "1.0"))
+# Khóa băm session_id / URL ảnh. Để trống thì mỗi tiến trình tự sinh khóa ngẫu nhiên: khi chạy nhiều
+# worker, cùng một session ở hai worker sẽ có mã khác nhau, nên đặt cùng một giá trị cho mọi worker.
+TRAFFIC_CAPTURE_SALT = os.environ.get("TRAFFIC_CAPTURE_SALT", "") or os.urandom(16).hex()
+# Số bản ghi tối đa chờ ghi; đầy thì bỏ bản ghi mới thay vì làm chậm lượt chat
+TRAFFIC_CAPTURE_MAX_QUEUE = int(os.environ.get("TRAFFIC_CAPTURE_MAX_QUEUE", "10000"))
+
+# Nhánh có tin nhắn chứa tên / SĐT / địa chỉ của khách: không lưu nội dung
+_PRIVATE_BRANCHES = {"customer_info"}
+
+_writer = BackgroundJsonlWriter(TRAFFIC_CAPTURE_PATH, "traffic_capture", max_queue=TRAFFIC_CAPTURE_MAX_QUEUE)
+
+
+def _anonymize(value: str) -> str:
+    return hmac.new(TRAFFIC_CAPTURE_SALT.encode(), value.encode("utf-8"), hashlib.sha256).hexdigest()[:16]
+
+
+def _sampled(session_key: str) -> bool:
+    if TRAFFIC_CAPTURE_SAMPLE_RATE >= 1:
+        return True
+    return int(session_key[:8], 16) / 0xFFFFFFFF < TRAFFIC_CAPTURE_SAMPLE_RATE
+
+
+def capture_turn(turn: TurnContext, session_id: str, message: Optional[str], model_choice: str, image_url: Optional[str],
+                 started_at: float, outcome: str, response=None):
+    """
+    Đưa một lượt chat đã xong vào hàng đợi ghi (không làm gì nếu chưa bật TRAFFIC_CAPTURE_ENABLED).
+    Bản ghi không chứa session_id / URL ảnh gốc (chỉ mã băm), số điện thoại trong câu hỏi bị che,
+    tin nhắn gửi thông tin khách hàng không được lưu nội dung.
+    `outcome`: completed, search_unavailable, deadline_exceeded, cancelled, error hoặc aborted.
+    """
+    if not TRAFFIC_CAPTURE_ENABLED:
+        return
+    session_key = _anonymize(session_id)
+    if not _sampled(session_key):
+        return
+    branch = turn.annotations.get("branch")
+    private = branch in _PRIVATE_BRANCHES
+    record = {
+        "ts": round(started_at, 3),
+        "session": session_key,
+        "query": None if private or not message else mask_phone_numbers(message),
+        "query_chars": len(message or ""),
+        "redacted": private,
+        "model_choice": model_choice,
+        "image": _anonymize(image_url) if image_url else None,
+        "branch": branch,
+        "degraded": bool(turn.annotations.get("degraded")),
+        "outcome": outcome,
+        "total_ms": round((time.time() - started_at) * 1000, 1),
+        "stages": {name: round(ms, 1) for name, ms in turn.stage_ms.items()},
+        "tokens": turn.tokens_used,
+        "reply_chars": len(response.reply) if response is not None else 0,
+        "images": len(response.images) if response is not None else 0,
+        "has_purchase": bool(response is not None and response.customer_info),
+    }
+    _writer.write(record)
+
+
+def get_traffic_capture_stats() -> Dict:
+    stats = dict(_writer.stats)
+    stats.update(enabled=TRAFFIC_CAPTURE_ENABLED, path=TRAFFIC_CAPTURE_PATH, sample_rate=TRAFFIC_CAPTURE_SAMPLE_RATE, pending=_writer.pending())
+    return stats
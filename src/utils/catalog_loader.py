@@ -0,0 +1,136 @@
+import hashlib
+import json
+import math
+import os
+from typing import Dict, Iterator, List
+
+import pandas as pd
+
+# Thứ tự cột trong file xlsx catalog
+CATALOG_COLUMNS = [
+    'product_code', 'product_name', 'category', 'properties',
+    'lifecare_price', 'trademark', 'guarantee', 'inventory',
+    'specifications', 'avatar_images', 'link_product'
+]
+
+
+def load_catalog_dataframe(path: str) -> pd.DataFrame:
+    """
+    Đọc file catalog (xlsx) và làm sạch như khi nạp vào Elasticsearch:
+    bỏ dòng thiếu mã / tên, ép kiểu tồn kho và giá, ô trống thành None.
+    """
+    return clean_catalog_dataframe(pd.read_excel(path))
+
+
+def clean_catalog_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+    """Làm sạch một khung dữ liệu catalog (toàn bộ file hoặc một phần khi đọc theo khối)."""
+    df.columns = CATALOG_COLUMNS
+    df = df.dropna(subset=['product_code', 'product_name'])
+    df['inventory'] = pd.to_numeric(df['inventory'], errors='coerce').fillna(0).astype(int)
+    df['lifecare_price'] = pd.to_numeric(df['lifecare_price'].astype(str).str.replace(',', ''), errors='coerce').fillna(0).astype(float)
+    df = df.where(pd.notnull(df), None)
+    return df
+
+
+def _excel_value(value):
+    # pd.read_excel đổi số thực nguyên (1234.0) thành int; giữ cùng kiểu khi đọc theo khối
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def iter_catalog_chunks(path: str, chunk_size: int = 1000, skip_rows: int = 0) -> Iterator[pd.DataFrame]:
+    """
+    Đọc file catalog (xlsx hoặc csv) theo từng khối `chunk_size` dòng đã làm sạch, bộ nhớ không
+    tăng theo kích thước file. `skip_rows` là số dòng hợp lệ (sau khi làm sạch) bỏ qua ở đầu,
+    dùng khi chạy tiếp từ checkpoint.
+    """
+    if path.lower().endswith(".csv"):
+        raw_chunks = (chunk for chunk in pd.read_csv(path, chunksize=chunk_size))
+    else:
+        raw_chunks = _iter_excel_chunks(path, chunk_size)
+
+    for raw in raw_chunks:
+        df = clean_catalog_dataframe(raw)
+        if skip_rows:
+            skipped = min(skip_rows, len(df))
+            df = df.iloc[skipped:]
+            skip_rows -= skipped
+        if len(df):
+            yield df
+
+
+def _iter_excel_chunks(path: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        next(rows, None)  # dòng tiêu đề
+        buffer = []
+        for row in rows:
+            if row is None or all(value is None for value in row):
+                continue
+            buffer.append([_excel_value(value) for value in row[:len(CATALOG_COLUMNS)]])
+            if len(buffer) >= chunk_size:
+                yield pd.DataFrame(buffer, columns=CATALOG_COLUMNS)
+                buffer = []
+        if buffer:
+            yield pd.DataFrame(buffer, columns=CATALOG_COLUMNS)
+    finally:
+        workbook.close()
+
+
+def count_catalog_rows(path: str) -> int:
+    """Số dòng dữ liệu (ước lượng, trước khi làm sạch) của file catalog, để báo tiến độ."""
+    if path.lower().endswith(".csv"):
+        with open(path, "rb") as f:
+            return max(0, sum(1 for _ in f) - 1)
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True)
+    try:
+        return max(0, (workbook.worksheets[0].max_row or 1) - 1)
+    finally:
+        workbook.close()
+
+
+def catalog_fingerprint(path: str) -> str:
+    """Dấu nhận diện phiên bản file nguồn (kích thước + thời điểm sửa), để checkpoint biết file đã đổi."""
+    stat = os.stat(path)
+    return f"{stat.st_size}-{int(stat.st_mtime)}"
+
+
+def dataframe_records(df: pd.DataFrame) -> List[Dict]:
+    """Các dòng của khung dữ liệu đã làm sạch thành dict, NaN thành None, mã sản phẩm dạng chuỗi."""
+    records = []
+    for record in df.to_dict(orient="records"):
+        for key, value in record.items():
+            if isinstance(value, float) and math.isnan(value):
+                record[key] = None
+        # Cột mã có ô trống bị pandas đổi sang float (1234.0): đưa về "1234"
+        record['product_code'] = str(_excel_value(record['product_code']))
+        records.append(record)
+    return records
+
+
+def load_catalog_records(path: str) -> List[Dict]:
+    """Danh sách sản phẩm (dict) từ file catalog, mã sản phẩm dạng chuỗi như trong index."""
+    return dataframe_records(load_catalog_dataframe(path))
+
+
+def normalize_catalog_value(value):
+    """Giá trị chuẩn hóa để so sánh dữ liệu nguồn với văn bản đã index (int/float, NaN/None, số/chuỗi)."""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    return str(value)
+
+
+def record_content_hash(record: Dict) -> str:
+    """Hash nội dung của một sản phẩm (mọi cột catalog), lưu vào index để nạp delta biết dòng nào đổi."""
+    payload = json.dumps([normalize_catalog_value(record.get(column)) for column in CATALOG_COLUMNS], ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
@@ -0,0 +1,409 @@
+import json
+import mmap
+import os
+import shutil
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from src.utils.logging_setup import get_logger
+
+logger = get_logger(__name__)
+
+# Ảnh chụp catalog dạng cột, ánh xạ bộ nhớ (mmap) chỉ đọc: nhiều worker cùng map một file
+# nên chỉ có một bản vật lý trong page cache. Script nạp dữ liệu ghi phiên bản mới rồi đổi
+# con trỏ CURRENT (os.replace, nguyên tử); worker thấy con trỏ đổi thì chuyển sang file mới.
+CATALOG_SNAPSHOT_DIR = os.environ.get("CATALOG_SNAPSHOT_DIR", "catalog_snapshots")
+# Số phiên bản giữ lại trên đĩa (worker chậm vẫn có thể đang map phiên bản cũ)
+CATALOG_SNAPSHOT_KEEP = int(os.environ.get("CATALOG_SNAPSHOT_KEEP", "3"))
+# Chu kỳ (giây) worker kiểm tra con trỏ CURRENT
+CATALOG_SNAPSHOT_CHECK_SECONDS = float(os.environ.get("CATALOG_SNAPSHOT_CHECK_SECONDS", "10"))
+# Số sản phẩm mỗi khối khi ghi snapshot (chỉ một khối embedding được chép ra bộ nhớ mỗi lần)
+CATALOG_SNAPSHOT_WRITE_ROWS = int(os.environ.get("CATALOG_SNAPSHOT_WRITE_ROWS", "10000"))
+
+STRING_FIELDS = [
+    "product_code", "product_name", "category", "properties", "trademark",
+    "guarantee", "specifications", "avatar_images", "link_product"
+]
+_MAGIC = b"HMCATSN1"
+_ALIGN = 64
+_POINTER_FILE = "CURRENT"
+_COPY_BUFFER_BYTES = 8 * 1024 * 1024
+
+
+def _pad(handle, offset: int) -> int:
+    padding = (-offset) % _ALIGN
+    if padding:
+        handle.write(b"\0" * padding)
+    return offset + padding
+
+
+def _quantize_int8(matrix: np.ndarray):
+    """Lượng tử hóa đối xứng theo từng dòng: vector ~= int8 * scale."""
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+class SnapshotWriter:
+    """
+    Ghi một phiên bản snapshot theo từng khối sản phẩm (`append`), không giữ cả catalog hay cả ma trận
+    embedding trong bộ nhớ: mỗi cột được ghi nối vào một file tạm cạnh snapshot, `commit()` ghép các
+    file tạm thành file snapshot (sao chép theo khối cố định) rồi công bố.
+    `embedding_dim` = 0 nếu snapshot không có embedding.
+    """
+
+    def __init__(self, embedding_dim: int = 0, embedding_dtype: str = "float32", directory: str = None, version: str = None):
+        self.directory = directory or CATALOG_SNAPSHOT_DIR
+        os.makedirs(self.directory, exist_ok=True)
+        self.version = version or time.strftime("%Y%m%d%H%M%S") + f"{int(time.time() * 1000) % 1000:03d}"
+        self.filename = f"catalog-{self.version}.snap"
+        self.path = os.path.join(self.directory, self.filename)
+        self.embedding_dim = embedding_dim
+        self.embedding_dtype = embedding_dtype
+        self.count = 0
+
+        self._dtypes: Dict[str, np.dtype] = {}
+        for field in STRING_FIELDS:
+            self._dtypes.update({f"{field}.offsets": np.uint64, f"{field}.nulls": np.uint8, f"{field}.data": np.uint8})
+        self._dtypes.update(inventory=np.int32, lifecare_price=np.float64)
+        if embedding_dim:
+            self._dtypes["embeddings"] = np.int8 if embedding_dtype == "int8" else np.float32
+            if embedding_dtype == "int8":
+                self._dtypes["embedding_scales"] = np.float32
+            self._dtypes["has_embedding"] = np.uint8
+        self._spools = {}
+        self._nbytes = {name: 0 for name in self._dtypes}
+        self._string_bytes = {field: 0 for field in STRING_FIELDS}
+        try:
+            for name in self._dtypes:
+                self._spools[name] = open(f"{self.path}.{name}.part", "w+b")
+            for field in STRING_FIELDS:
+                self._write(f"{field}.offsets", np.zeros(1))
+        except OSError:
+            self.abort()
+            raise
+
+    def _write(self, name: str, array):
+        array = np.ascontiguousarray(array, dtype=self._dtypes[name])
+        self._spools[name].write(array.tobytes())
+        self._nbytes[name] += array.nbytes
+
+    def append(self, records: List[Dict], embeddings: Optional[np.ndarray] = None, has_embedding: Optional[np.ndarray] = None):
+        """
+        Ghi nối một khối sản phẩm. `embeddings` là các dòng embedding tương ứng (chỉ khối này được
+        chép ra bộ nhớ, nên có thể truyền một lát cắt của memmap); None thì các dòng được đánh dấu không có embedding.
+        """
+        for field in STRING_FIELDS:
+            values = [r.get(field) for r in records]
+            encoded = [str(v).encode("utf-8") if v is not None else b"" for v in values]
+            ends = np.cumsum([len(b) for b in encoded], dtype=np.uint64) + np.uint64(self._string_bytes[field])
+            self._write(f"{field}.offsets", ends)
+            self._write(f"{field}.nulls", [v is None for v in values])
+            self._write(f"{field}.data", np.frombuffer(b"".join(encoded), dtype=np.uint8))
+            if len(ends):
+                self._string_bytes[field] = int(ends[-1])
+        self._write("inventory", [int(r.get("inventory") or 0) for r in records])
+        self._write("lifecare_price", [float(r.get("lifecare_price") or 0) for r in records])
+
+        if self.embedding_dim:
+            if embeddings is None:
+                matrix = np.zeros((len(records), self.embedding_dim), dtype=np.float32)
+                mask = np.zeros(len(records), dtype=bool)
+            else:
+                matrix = np.asarray(embeddings, dtype=np.float32)
+                mask = has_embedding if has_embedding is not None else np.ones(len(records), dtype=bool)
+            if self.embedding_dtype == "int8":
+                quantized, scales = _quantize_int8(matrix)
+                self._write("embeddings", quantized)
+                self._write("embedding_scales", scales)
+            else:
+                self._write("embeddings", matrix)
+            self._write("has_embedding", mask)
+        self.count += len(records)
+
+    def _shape(self, name: str) -> List[int]:
+        if name.endswith(".offsets"):
+            return [self.count + 1]
+        if name.endswith(".data"):
+            return [self._nbytes[name]]
+        if name == "embeddings":
+            return [self.count, self.embedding_dim]
+        return [self.count]
+
+    def commit(self) -> str:
+        """Ghép các cột thành file snapshot, công bố nó (đổi con trỏ CURRENT). Trả về đường dẫn file."""
+        try:
+            embedding_dim = self.embedding_dim if self.count else 0
+            names = [name for name in self._dtypes if embedding_dim or name not in ("embeddings", "embedding_scales", "has_embedding")]
+            columns = {}
+            offset = 0
+            for name in names:
+                offset += (-offset) % _ALIGN
+                columns[name] = {"offset": offset, "dtype": np.dtype(self._dtypes[name]).str, "shape": self._shape(name)}
+                offset += self._nbytes[name]
+            header = json.dumps({
+                "version": self.version,
+                "count": self.count,
+                "embedding_dim": embedding_dim,
+                "embedding_dtype": self.embedding_dtype if embedding_dim else None,
+                "columns": columns,
+            }).encode("utf-8")
+
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "wb") as handle:
+                handle.write(_MAGIC)
+                handle.write(len(header).to_bytes(8, "little"))
+                handle.write(header)
+                # Các cột bắt đầu ở vị trí căn lề sau header; offset trong header tính từ đó
+                base = _pad(handle, len(_MAGIC) + 8 + len(header))
+                position = 0
+                for name in names:
+                    position = _pad(handle, base + position) - base
+                    spool = self._spools[name]
+                    spool.flush()
+                    spool.seek(0)
+                    shutil.copyfileobj(spool, handle, _COPY_BUFFER_BYTES)
+                    position += self._nbytes[name]
+                handle.flush()
+                os.fsync(handle.fileno())
+            os.replace(temp_path, self.path)
+        except BaseException:
+            self.abort()
+            raise
+        self._close_spools()
+        _publish(self.directory, self.filename)
+        _prune_old_snapshots(self.directory, self.filename)
+        logger.info("Đã ghi snapshot catalog %s (%d sản phẩm, %.1f MB).", self.filename, self.count, os.path.getsize(self.path) / 1024 / 1024)
+        return self.path
+
+    def _close_spools(self):
+        for name, spool in self._spools.items():
+            spool.close()
+            try:
+                os.remove(spool.name)
+            except OSError:
+                pass
+        self._spools = {}
+
+    def abort(self):
+        """Bỏ phiên bản đang ghi dở (xóa các file tạm); snapshot đang công bố không đổi."""
+        self._close_spools()
+        if os.path.exists(self.path + ".tmp"):
+            os.remove(self.path + ".tmp")
+
+
+def write_snapshot(records: List[Dict], embeddings: Optional[np.ndarray] = None, has_embedding: Optional[np.ndarray] = None,
+                   embedding_dtype: str = "float32", directory: str = None, version: str = None) -> str:
+    """
+    Ghi một phiên bản snapshot mới và công bố nó (đổi con trỏ CURRENT).
+    `embeddings`: ma trận (số sản phẩm x số chiều), dòng i ứng với records[i];
+    `has_embedding` đánh dấu dòng nào thực sự có embedding.
+    Ghi theo khối CATALOG_SNAPSHOT_WRITE_ROWS dòng nên `embeddings` có thể là memmap lớn.
+    Trả về đường dẫn file snapshot.
+    """
+    if embeddings is not None and not isinstance(embeddings, np.ndarray):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+    embedding_dim = embeddings.shape[1] if embeddings is not None and len(embeddings) else 0
+    writer = SnapshotWriter(embedding_dim, embedding_dtype, directory, version)
+    try:
+        for start in range(0, len(records), CATALOG_SNAPSHOT_WRITE_ROWS):
+            stop = start + CATALOG_SNAPSHOT_WRITE_ROWS
+            writer.append(
+                records[start:stop],
+                embeddings[start:stop] if embedding_dim else None,
+                has_embedding[start:stop] if embedding_dim and has_embedding is not None else None,
+            )
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.commit()
+
+
+def _publish(directory: str, filename: str):
+    pointer = os.path.join(directory, _POINTER_FILE)
+    temp_pointer = pointer + ".tmp"
+    with open(temp_pointer, "w", encoding="utf-8") as handle:
+        handle.write(filename)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(temp_pointer, pointer)
+
+
+def _prune_old_snapshots(directory: str, current: str):
+    snapshots = sorted(f for f in os.listdir(directory) if f.startswith("catalog-") and f.endswith(".snap"))
+    for filename in snapshots[:-CATALOG_SNAPSHOT_KEEP] if CATALOG_SNAPSHOT_KEEP > 0 else []:
+        if filename != current:
+            # Trên Linux, worker đang map file vẫn đọc được sau khi file bị xóa
+            os.remove(os.path.join(directory, filename))
+
+
+class CatalogSnapshot:
+    """Một phiên bản snapshot đã được map chỉ đọc. Các cột là mảng NumPy trỏ thẳng vào vùng map."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as handle:
+            self._mmap = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(_MAGIC)] != _MAGIC:
+            raise ValueError(f"File snapshot không hợp lệ: {path}")
+        header_length = int.from_bytes(self._mmap[len(_MAGIC):len(_MAGIC) + 8], "little")
+        header_end = len(_MAGIC) + 8 + header_length
+        header = json.loads(self._mmap[len(_MAGIC) + 8:header_end].decode("utf-8"))
+        base = header_end + (-header_end) % _ALIGN
+
+        self.version = header["version"]
+        self.count = header["count"]
+        self.embedding_dim = header["embedding_dim"]
+        self.embedding_dtype = header["embedding_dtype"]
+        self._columns: Dict[str, np.ndarray] = {}
+        for name, meta in header["columns"].items():
+            dtype = np.dtype(meta["dtype"])
+            size = int(np.prod(meta["shape"])) if meta["shape"] else 0
+            array = np.frombuffer(self._mmap, dtype=dtype, count=size, offset=base + meta["offset"])
+            self._columns[name] = array.reshape(meta["shape"])
+
+    def __len__(self):
+        return self.count
+
+    def column(self, name: str) -> np.ndarray:
+        return self._columns[name]
+
+    def string(self, field: str, index: int) -> Optional[str]:
+        if self._columns[f"{field}.nulls"][index]:
+            return None
+        offsets = self._columns[f"{field}.offsets"]
+        data = self._columns[f"{field}.data"]
+        return bytes(data[int(offsets[index]):int(offsets[index + 1])]).decode("utf-8")
+
+    def strings(self, field: str) -> List[Optional[str]]:
+        return [self.string(field, i) for i in range(self.count)]
+
+    def __getitem__(self, index: int) -> Dict:
+        """Một sản phẩm dạng dict (không kèm embedding), giải mã từ vùng map."""
+        if index < 0:
+            index += self.count
+        record = {field: self.string(field, index) for field in STRING_FIELDS}
+        record["inventory"] = int(self._columns["inventory"][index])
+        record["lifecare_price"] = float(self._columns["lifecare_price"][index])
+        return record
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self[index]
+
+    @property
+    def embeddings(self) -> Optional[np.ndarray]:
+        """Ma trận embedding (float32 hoặc int8 tùy lúc ghi), None nếu snapshot không có."""
+        return self._columns.get("embeddings")
+
+    @property
+    def embedding_scales(self) -> Optional[np.ndarray]:
+        return self._columns.get("embedding_scales")
+
+    @property
+    def has_embedding(self) -> Optional[np.ndarray]:
+        mask = self._columns.get("has_embedding")
+        return mask.astype(bool) if mask is not None else None
+
+    def embeddings_by_code(self) -> Dict[str, np.ndarray]:
+        """product_code -> embedding (float32), để mang embedding sang phiên bản snapshot mới."""
+        matrix = self.embeddings
+        if matrix is None:
+            return {}
+        mask = self.has_embedding
+        scales = self.embedding_scales
+        result = {}
+        for index in np.flatnonzero(mask):
+            vector = matrix[index].astype(np.float32)
+            if scales is not None:
+                vector *= scales[index]
+            result[self.string("product_code", index)] = vector
+        return result
+
+
+def read_current_pointer(directory: str = None) -> Optional[str]:
+    try:
+        with open(os.path.join(directory or CATALOG_SNAPSHOT_DIR, _POINTER_FILE), encoding="utf-8") as handle:
+            return handle.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def open_current_snapshot(directory: str = None) -> Optional[CatalogSnapshot]:
+    filename = read_current_pointer(directory)
+    if not filename:
+        return None
+    return CatalogSnapshot(os.path.join(directory or CATALOG_SNAPSHOT_DIR, filename))
+
+
+_current: Optional[CatalogSnapshot] = None
+_swap_lock = threading.Lock()
+_state = {"filename": None, "last_check": 0.0, "swaps": 0}
+
+
+def get_current_snapshot(refresh: bool = False) -> Optional[CatalogSnapshot]:
+    """
+    Snapshot đang được công bố. Con trỏ CURRENT được kiểm tra tối đa mỗi
+    CATALOG_SNAPSHOT_CHECK_SECONDS giây; khi đổi, snapshot mới được map và thay thế
+    bằng một phép gán. Snapshot cũ được giải phóng khi không còn ai tham chiếu.
+    """
+    global _current
+    now = time.monotonic()
+    if not refresh and _current is not None and now - _state["last_check"] < CATALOG_SNAPSHOT_CHECK_SECONDS:
+        return _current
+    with _swap_lock:
+        _state["last_check"] = now
+        filename = read_current_pointer()
+        if filename and filename != _state["filename"]:
+            try:
+                _current = CatalogSnapshot(os.path.join(CATALOG_SNAPSHOT_DIR, filename))
+                _state["filename"] = filename
+                _state["swaps"] += 1
+                logger.info("Đã chuyển sang snapshot catalog %s.", filename)
+            except (OSError, ValueError) as e:
+                logger.warning("Không thể mở snapshot catalog %s: %s", filename, e)
+    return _current
+
+
+def publish_updated_snapshot(updates: Dict[str, Dict], snapshot: CatalogSnapshot = None) -> Optional[str]:
+    """
+    Công bố phiên bản snapshot mới từ snapshot hiện tại, thay giá trị các trường theo
+    `updates` (product_code -> {trường: giá trị}); embedding giữ nguyên. None nếu chưa có snapshot.
+    """
+    snapshot = snapshot or get_current_snapshot(refresh=True)
+    if snapshot is None:
+        return None
+    matrix, scales = snapshot.embeddings, snapshot.embedding_scales
+    mask = snapshot.has_embedding
+    writer = SnapshotWriter(snapshot.embedding_dim if matrix is not None else 0,
+                            "int8" if scales is not None else "float32")
+    try:
+        for start in range(0, len(snapshot), CATALOG_SNAPSHOT_WRITE_ROWS):
+            stop = min(start + CATALOG_SNAPSHOT_WRITE_ROWS, len(snapshot))
+            records = [snapshot[index] for index in range(start, stop)]
+            for record in records:
+                changes = updates.get(record["product_code"])
+                if changes:
+                    record.update(changes)
+            block = None
+            if matrix is not None:
+                block = matrix[start:stop].astype(np.float32)
+                if scales is not None:
+                    block *= scales[start:stop, None]
+            writer.append(records, block, mask[start:stop] if mask is not None else None)
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.commit()
+
+
+def get_snapshot_stats() -> Dict:
+    stats = dict(_state)
+    if _current is not None:
+        stats.update(version=_current.version, products=_current.count, embedding_dim=_current.embedding_dim,
+                     embedding_dtype=_current.embedding_dtype, file_bytes=os.path.getsize(_current.path) if os.path.exists(_current.path) else None)
+    return stats
@@ -0,0 +1,85 @@
+import threading
+import time
+from typing import Dict
+
+from src.utils.logging_setup import get_logger
+
+logger = get_logger(__name__)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker đơn giản cho các dịch vụ bên ngoài (Elasticsearch, embed API, ...).
+    - closed: cho phép mọi request, đếm lỗi liên tiếp.
+    - open: sau `failure_threshold` lỗi liên tiếp, từ chối request trong `reset_timeout` giây.
+    - half_open: hết thời gian chờ, cho một request thử; thành công thì đóng lại, lỗi thì mở lại.
+    Mỗi request được allow_request cho qua phải kết thúc bằng record_success, record_failure hoặc release_trial.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._times_opened = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self._state == "closed":
+                return True
+            if self._state == "open":
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = "half_open"
+                self._trial_in_flight = False
+            # half_open: chỉ cho một request thử tại một thời điểm
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._state != "closed":
+                logger.info("Circuit breaker '%s': dịch vụ đã hoạt động trở lại.", self.name)
+            self._state = "closed"
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        """
+        Trả lại lượt thử của half_open mà không kết luận gì về dịch vụ: dùng khi request bị hủy
+        (client ngắt kết nối, hết thời gian lượt chat) hoặc lỗi không liên quan tới dịch vụ.
+        Không gọi thì breaker kẹt ở half_open và từ chối mọi request về sau.
+        """
+        with self._lock:
+            if self._state == "half_open":
+                self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._state == "half_open" or self._failures >= self.failure_threshold:
+                if self._state != "open":
+                    self._times_opened += 1
+                    logger.warning("Circuit breaker '%s' mở sau %d lỗi liên tiếp.", self.name, self._failures)
+                self._state = "open"
+                self._opened_at = time.monotonic()
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "state": self._state,
+                "consecutive_failures": self._failures,
+                "times_opened": self._times_opened,
+            }
@@ -0,0 +1,68 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    Cache embedding lưu trên đĩa (SQLite), loại bỏ theo LRU khi vượt `max_entries`.
+    Key là chuỗi có tiền tố cho biết loại khóa, ví dụ "url:...", "sha256:...".
+    Nhiều tiến trình có thể dùng chung một file.
+    """
+
+    def __init__(self, path: str, max_entries: int = 50000):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, embedding BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            row = self._conn.execute("SELECT embedding FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE embeddings SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        return np.frombuffer(row[0], dtype=np.float32).tolist()
+
+    def put(self, keys: List[str], embedding: List[float]):
+        """Lưu cùng một embedding dưới nhiều key (URL, hash nội dung, ...)."""
+        blob = np.asarray(embedding, dtype=np.float32).tobytes()
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, embedding, last_used) VALUES (?, ?, ?)",
+                [(key, blob, now) for key in keys if key]
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if count > self.max_entries:
+                # Xóa thêm 10% để không phải dọn ở mọi lần ghi
+                overflow = count - int(self.max_entries * 0.9)
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (overflow,)
+                )
+            self._conn.commit()
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return {
+            "entries": count,
+            "max_entries": self.max_entries,
+            "file_bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+        }
@@ -0,0 +1,215 @@
+import hashlib
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.utils.logging_setup import get_logger
+
+# Cấu hình dịch vụ embedding ảnh, dùng chung cho chatbot và script nạp dữ liệu
+EMBED_API_URL = os.environ.get("EMBED_API_URL", "https://embed.doiquanai.vn/embed")
+# Endpoint nhận nhiều ảnh trong một request (JSON {"image_urls": [...]} -> {"embeddings": [...]});
+# để trống nếu dịch vụ không hỗ trợ, khi đó embed_batch gửi song song từng ảnh
+EMBED_API_BATCH_URL = os.environ.get("EMBED_API_BATCH_URL", "")
+EMBED_CLIENT_TIMEOUT = float(os.environ.get("EMBED_CLIENT_TIMEOUT", "15"))
+EMBED_MAX_RETRIES = int(os.environ.get("EMBED_MAX_RETRIES", "3"))
+EMBED_BACKOFF_SECONDS = float(os.environ.get("EMBED_BACKOFF_SECONDS", "0.5"))
+# Số request đồng thời tối đa tới dịch vụ embedding (cũng là kích thước pool kết nối)
+EMBED_MAX_CONCURRENCY = int(os.environ.get("EMBED_MAX_CONCURRENCY", "8"))
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", "32"))
+# Số ảnh tối đa cùng lúc từ một host ảnh (dịch vụ embedding tải ảnh theo URL, tránh dồn tải lên một CDN);
+# 0 = chỉ giới hạn bởi EMBED_MAX_CONCURRENCY
+EMBED_PER_HOST_CONCURRENCY = int(os.environ.get("EMBED_PER_HOST_CONCURRENCY", "0"))
+
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+logger = get_logger(__name__)
+
+
+def _url_label(image_url: str) -> str:
+    """Host kèm mã băm của URL ảnh để ghi log: URL ảnh khách gửi có thể chứa token hay thông tin cá nhân."""
+    digest = hashlib.sha256(str(image_url).encode("utf-8")).hexdigest()[:12]
+    return f"{urlparse(str(image_url)).netloc or '?'}#{digest}"
+
+
+class EmbeddingServiceError(Exception):
+    """Dịch vụ embedding không phản hồi được sau khi đã thử lại."""
+
+
+class EmbeddingClient:
+    """
+    Client cho dịch vụ embedding ảnh: một requests.Session giữ kết nối keep-alive,
+    giới hạn số request đồng thời, tự thử lại lỗi tạm thời với backoff lũy thừa,
+    và API theo lô cho nhiều ảnh.
+    """
+
+    def __init__(self, endpoint: str = None, batch_endpoint: str = None, timeout: float = None, max_retries: int = None,
+                 backoff_seconds: float = None, max_concurrency: int = None, batch_size: int = None):
+        self.endpoint = endpoint or EMBED_API_URL
+        self.batch_endpoint = EMBED_API_BATCH_URL if batch_endpoint is None else batch_endpoint
+        self.timeout = timeout or EMBED_CLIENT_TIMEOUT
+        self.max_retries = EMBED_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_seconds = EMBED_BACKOFF_SECONDS if backoff_seconds is None else backoff_seconds
+        self.max_concurrency = max_concurrency or EMBED_MAX_CONCURRENCY
+        self.batch_size = batch_size or EMBED_BATCH_SIZE
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.max_concurrency)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._host_slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._stats_lock = threading.Lock()
+        self._stats = {"requests": 0, "images": 0, "retries": 0, "failures": 0, "total_ms": 0.0}
+
+    def _post(self, url: str, timeout: float = None, budget: float = None, **kwargs) -> Dict:
+        """POST có thử lại; không thử lại nữa nếu vượt quá `budget` giây (tính từ lúc bắt đầu)."""
+        timeout = timeout or self.timeout
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            error = None
+            with self._slots:
+                request_start = time.perf_counter()
+                try:
+                    response = self._session.post(url, timeout=timeout, **kwargs)
+                    if response.status_code in _RETRY_STATUSES:
+                        error = f"HTTP {response.status_code}"
+                    else:
+                        response.raise_for_status()
+                        with self._stats_lock:
+                            self._stats["requests"] += 1
+                            self._stats["total_ms"] += (time.perf_counter() - request_start) * 1000
+                        return response.json()
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    error = str(e)
+                except (requests.HTTPError, ValueError) as e:
+                    # Lỗi 4xx hoặc phản hồi không phải JSON: thử lại cũng không khác
+                    with self._stats_lock:
+                        self._stats["failures"] += 1
+                    raise EmbeddingServiceError(f"Dịch vụ embedding trả về lỗi: {e}") from e
+
+            attempt += 1
+            delay = self.backoff_seconds * (2 ** (attempt - 1)) * (0.5 + random.random())
+            out_of_budget = budget is not None and time.monotonic() - start + delay + timeout > budget
+            if attempt > self.max_retries or out_of_budget:
+                with self._stats_lock:
+                    self._stats["failures"] += 1
+                raise EmbeddingServiceError(f"Dịch vụ embedding lỗi sau {attempt} lần thử: {error}")
+            with self._stats_lock:
+                self._stats["retries"] += 1
+            time.sleep(delay)
+
+    def embed(self, image_url: str, timeout: float = None, budget: float = None) -> Optional[List[float]]:
+        """
+        Embedding của một ảnh. Trả về None khi dịch vụ báo lỗi với chính ảnh đó
+        (ảnh hỏng, không tải được); ném EmbeddingServiceError khi dịch vụ không phản hồi.
+        """
+        result = self._post(self.endpoint, timeout, budget, data={"image_url": image_url})
+        with self._stats_lock:
+            self._stats["images"] += 1
+        if "embedding" in result:
+            return result["embedding"]
+        logger.warning("Lỗi từ API embedding cho ảnh %s: %s", _url_label(image_url), result.get('error', 'Không rõ lỗi'))
+        return None
+
+    def _embed_or_none(self, image_url: str) -> Optional[List[float]]:
+        try:
+            return self.embed(image_url)
+        except EmbeddingServiceError as e:
+            logger.warning("%s", e)
+            return None
+
+    def _embed_chunk(self, image_urls: List[str]) -> List[Optional[List[float]]]:
+        try:
+            response = self._post(self.batch_endpoint, json={"image_urls": image_urls})
+            embeddings = list(response.get("embeddings") or [])
+        except EmbeddingServiceError as e:
+            logger.warning("%s", e)
+            embeddings = []
+        with self._stats_lock:
+            self._stats["images"] += len(image_urls)
+        return embeddings + [None] * (len(image_urls) - len(embeddings))
+
+    def embed_batch(self, image_urls: List[str]) -> List[Optional[List[float]]]:
+        """
+        Embedding cho nhiều ảnh, cùng thứ tự với `image_urls` (None cho ảnh lỗi).
+        Dùng endpoint theo lô nếu có (các lô gửi song song), nếu không thì gửi song song từng ảnh.
+        """
+        if not image_urls:
+            return []
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="embed")
+        if self.batch_endpoint:
+            chunks = [image_urls[i:i + self.batch_size] for i in range(0, len(image_urls), self.batch_size)]
+            return [embedding for chunk in self._executor.map(self._embed_chunk, chunks) for embedding in chunk]
+        return list(self._executor.map(self._embed_or_none, image_urls))
+
+    def _host_slot(self, image_url: str, limit: int) -> threading.BoundedSemaphore:
+        host = urlparse(image_url).netloc.lower()
+        with self._stats_lock:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = self._host_slots[host] = threading.BoundedSemaphore(limit)
+            return slot
+
+    def embed_many(self, image_urls: List[str], per_host_limit: int = None,
+                   on_result: Callable[[int, Optional[List[float]]], None] = None) -> List[Optional[List[float]]]:
+        """
+        Embedding cho nhiều ảnh bằng pool luồng (tối đa max_concurrency request đồng thời,
+        tối đa `per_host_limit` ảnh cùng lúc từ mỗi host ảnh). Mỗi ảnh được thử lại như `embed`;
+        ảnh lỗi nhận None. `on_result(i, embedding)` được gọi ngay khi ảnh thứ i xong (để báo tiến độ).
+        """
+        limit = EMBED_PER_HOST_CONCURRENCY if per_host_limit is None else per_host_limit
+        results: List[Optional[List[float]]] = [None] * len(image_urls)
+
+        def work(i: int) -> Optional[List[float]]:
+            if limit <= 0 or limit >= self.max_concurrency:
+                return self._embed_or_none(image_urls[i])
+            with self._host_slot(image_urls[i], limit):
+                return self._embed_or_none(image_urls[i])
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="embed") as executor:
+            futures = {executor.submit(work, i): i for i in range(len(image_urls))}
+            for future in as_completed(futures):
+                i = futures[future]
+                results[i] = future.result()
+                if on_result is not None:
+                    on_result(i, results[i])
+        return results
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self._session.close()
+
+    def snapshot(self) -> Dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["avg_ms"] = stats["total_ms"] / stats["requests"] if stats["requests"] else 0.0
+        stats["endpoint"] = self.endpoint
+        stats["batch_endpoint"] = self.batch_endpoint or None
+        stats["max_concurrency"] = self.max_concurrency
+        return stats
+
+
+_default_client: Optional[EmbeddingClient] = None
+_default_lock = threading.Lock()
+
+
+def get_embedding_client() -> EmbeddingClient:
+    """Client dùng chung trong tiến trình, cấu hình theo biến môi trường."""
+    global _default_client
+    if _default_client is None:
+        with _default_lock:
+            if _default_client is None:
+                _default_client = EmbeddingClient()
+    return _default_client
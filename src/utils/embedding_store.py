@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+import requests
+
+
+class EmbeddingStore:
+    """
+    Kho embedding ảnh cục bộ cho script nạp dữ liệu, dùng lại giữa các lần nạp lại toàn bộ.
+
+    Lưu trong một thư mục:
+    - meta.json: số chiều và kiểu số (float16 / float32);
+    - vectors.bin: ma trận embedding (mỗi dòng một vector), chỉ ghi thêm, đọc qua np.memmap;
+    - keys.jsonl: chỉ mục khóa -> dòng, mỗi dòng một cặp [key, row], chỉ ghi thêm.
+    Khóa có tiền tố như EmbeddingCache: "url:<URL ảnh>", "sha256:<hash nội dung ảnh>".
+    Nhiều khóa có thể trỏ cùng một dòng (cùng ảnh ở nhiều URL).
+
+    Vector được ghi trước, khóa ghi sau: lần ghi dở khi bị ngắt chỉ để lại dòng thừa
+    (bị cắt khi mở lại) hoặc khóa trỏ quá cuối ma trận (bị bỏ qua).
+    """
+
+    def __init__(self, directory: str, dtype: str = "float16"):
+        self.directory = directory
+        self.meta_path = os.path.join(directory, "meta.json")
+        self.vectors_path = os.path.join(directory, "vectors.bin")
+        self.keys_path = os.path.join(directory, "keys.jsonl")
+        self._lock = threading.Lock()
+        self._keys: Dict[str, int] = {}
+        self._matrix: Optional[np.memmap] = None
+        os.makedirs(directory, exist_ok=True)
+
+        meta = {}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        self.dtype = np.dtype(meta.get("dtype", dtype))
+        self.dim = meta.get("dim") or 0
+        self.rows = 0
+        if self.dim:
+            row_bytes = self.dim * self.dtype.itemsize
+            size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+            self.rows = size // row_bytes
+            if size != self.rows * row_bytes:
+                with open(self.vectors_path, "r+b") as f:
+                    f.truncate(self.rows * row_bytes)
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        key, row = json.loads(line)
+                    except ValueError:
+                        continue
+                    if row < self.rows:
+                        self._keys[key] = row
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def _view(self) -> np.memmap:
+        if self._matrix is None or len(self._matrix) < self.rows:
+            self._matrix = np.memmap(self.vectors_path, dtype=self.dtype, mode="r", shape=(self.rows, self.dim))
+        return self._matrix
+
+    def get(self, key: str) -> Optional[List[float]]:
+        return self.get_many([key])[0]
+
+    def get_many(self, keys: List[str]) -> List[Optional[List[float]]]:
+        """Embedding (float32, dạng list) theo từng khóa, None nếu chưa có."""
+        with self._lock:
+            rows = [self._keys.get(key) for key in keys]
+            found = [i for i, row in enumerate(rows) if row is not None]
+            results: List[Optional[List[float]]] = [None] * len(keys)
+            if found:
+                vectors = np.asarray(self._view()[[rows[i] for i in found]], dtype=np.float32)
+                for i, vector in zip(found, vectors):
+                    results[i] = vector.tolist()
+        return results
+
+    def alias(self, key: str, existing_key: str) -> bool:
+        """Cho `key` trỏ tới cùng vector với `existing_key` (không ghi thêm vector)."""
+        with self._lock:
+            row = self._keys.get(existing_key)
+            if row is None:
+                return False
+            self._write_keys([(key, row)])
+        return True
+
+    def put_many(self, items: List[tuple]):
+        """Ghi các cặp (danh sách khóa, embedding); bỏ qua vector sai số chiều."""
+        with self._lock:
+            if not self.dim:
+                first = next((embedding for _, embedding in items if embedding is not None), None)
+                if first is None:
+                    return
+                self.dim = len(first)
+                temp_path = self.meta_path + ".tmp"
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    json.dump({"dim": self.dim, "dtype": self.dtype.name}, f)
+                os.replace(temp_path, self.meta_path)
+            accepted = [(keys, embedding) for keys, embedding in items if embedding is not None and len(embedding) == self.dim]
+            if not accepted:
+                return
+            matrix = np.asarray([embedding for _, embedding in accepted], dtype=self.dtype)
+            with open(self.vectors_path, "ab") as f:
+                f.write(matrix.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            entries = []
+            for offset, (keys, _) in enumerate(accepted):
+                entries.extend((key, self.rows + offset) for key in keys if key)
+            self.rows += len(accepted)
+            self._write_keys(entries)
+
+    def _write_keys(self, entries):
+        with open(self.keys_path, "a", encoding="utf-8") as f:
+            for key, row in entries:
+                f.write(json.dumps([key, row], ensure_ascii=False) + "\n")
+        for key, row in entries:
+            self._keys[key] = row
+
+    def snapshot(self) -> Dict:
+        return {
+            "rows": self.rows,
+            "keys": len(self._keys),
+            "dim": self.dim,
+            "dtype": self.dtype.name,
+            "file_bytes": os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0,
+        }
+
+
+def image_content_hash(image_url: str, session: requests.Session = None, timeout: float = 15,
+                       max_bytes: int = 10 * 1024 * 1024) -> Optional[str]:
+    """sha256 nội dung ảnh (tải theo luồng, bỏ qua ảnh lớn hơn `max_bytes`); None nếu không tải được."""
+    digest, total = hashlib.sha256(), 0
+    try:
+        with (session or requests).get(image_url, timeout=timeout, stream=True) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(64 * 1024):
+                total += len(chunk)
+                if total > max_bytes:
+                    return None
+                digest.update(chunk)
+    except Exception:
+        return None
+    return digest.hexdigest()
@@ -1,5 +1,9 @@
+import re
 from typing import List
 
+# Số điện thoại Việt Nam (0xxx hoặc +84 / 84), cho phép dấu cách, chấm, gạch giữa các chữ số
+PHONE_PATTERN = re.compile(r'(?<!\d)(?:\+?84|0)(?:[\s.\-]?\d){8,10}(?!\d)')
+
 def is_asking_for_more(user_query: str) -> bool:
     """Kiểm tra xem người dùng có muốn xem thêm sản phẩm không."""
     keywords = [
@@ -23,4 +27,10 @@ def format_history_text(history: List[dict], limit: int = 10) -> str:
     history_text = ""
     for turn in history[-limit:]:
         history_text += f"Khách: {turn['user']}\nBot: {turn['bot']}\n"
-    return history_text
\ No newline at end of file
+    return history_text
+
+def mask_phone_numbers(text: str, replacement: str = "[SĐT]") -> str:
+    """Thay các số điện thoại trong văn bản bằng `replacement`."""
+    if not text:
+        return text
+    return PHONE_PATTERN.sub(replacement, text)
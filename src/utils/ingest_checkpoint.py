@@ -0,0 +1,108 @@
+import json
+import os
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+class IngestCheckpoint:
+    """
+    Checkpoint cho lần nạp dữ liệu theo luồng: số dòng nguồn (đã làm sạch) đã được Elasticsearch
+    xác nhận, kèm file tạm chứa embedding của các dòng đó (float32, đúng thứ tự nguồn) để cuối
+    cùng ghi snapshot catalog mà không giữ toàn bộ embedding trong bộ nhớ.
+
+    Checkpoint chỉ dùng lại được khi cùng file nguồn (dấu nhận diện không đổi) và cùng index.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.state_path = os.path.join(directory, "state.json")
+        self.vectors_path = os.path.join(directory, "embeddings.f32")
+        self.flags_path = os.path.join(directory, "has_embedding.u8")
+        self.state: Dict = {}
+
+    def load(self, source: str, fingerprint: str, index: str) -> Optional[Dict]:
+        """Trạng thái đã lưu nếu khớp với nguồn / index hiện tại, ngược lại None."""
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get("source") != source or state.get("fingerprint") != fingerprint or state.get("index") != index:
+            return None
+        self.state = state
+        self._truncate_spill(state["rows_done"], state.get("dim") or 0)
+        return state
+
+    def start(self, source: str, fingerprint: str, index: str, **extra):
+        """Bắt đầu lần nạp mới: xóa checkpoint và file embedding tạm cũ. `extra` được lưu kèm trạng thái."""
+        self.clear()
+        os.makedirs(self.directory, exist_ok=True)
+        self.state = {
+            "source": source, "fingerprint": fingerprint, "index": index,
+            "rows_done": 0, "indexed": 0, "failed": 0, "dim": 0,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            **extra,
+        }
+        open(self.vectors_path, "wb").close()
+        open(self.flags_path, "wb").close()
+        self._save()
+
+    def _truncate_spill(self, rows: int, dim: int):
+        # Khối đang ghi dở khi bị ngắt (sau checkpoint cuối) bị bỏ đi, sẽ được nạp lại
+        for path, row_bytes in ((self.vectors_path, dim * 4), (self.flags_path, 1)):
+            if os.path.exists(path):
+                with open(path, "r+b") as f:
+                    f.truncate(rows * row_bytes)
+
+    def append_chunk(self, embeddings: List[Optional[List[float]]], indexed: int, failed: int):
+        """Ghi embedding của một khối đã index xong rồi lưu checkpoint (theo đúng thứ tự này)."""
+        dim = self.state.get("dim") or next((len(e) for e in embeddings if e is not None), 0)
+        if dim and not self.state.get("dim"):
+            self.state["dim"] = dim
+            # Các khối trước đó không có ảnh nào: bù vector 0 cho đúng số dòng
+            with open(self.vectors_path, "ab") as f:
+                f.write(np.zeros((self.state["rows_done"], dim), dtype=np.float32).tobytes())
+        flags = np.array([e is not None and len(e) == dim for e in embeddings], dtype=np.uint8)
+        if dim:
+            matrix = np.zeros((len(embeddings), dim), dtype=np.float32)
+            for i, embedding in enumerate(embeddings):
+                if flags[i]:
+                    matrix[i] = embedding
+            with open(self.vectors_path, "ab") as f:
+                f.write(matrix.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        with open(self.flags_path, "ab") as f:
+            f.write(flags.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.state["rows_done"] += len(embeddings)
+        self.state["indexed"] += indexed
+        self.state["failed"] += failed
+        self._save()
+
+    def _save(self):
+        self.state["updated_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        temp_path = self.state_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.state_path)
+
+    def embeddings(self):
+        """(ma trận embedding dạng memmap hoặc None, mảng cờ có embedding) của các dòng đã nạp."""
+        rows, dim = self.state.get("rows_done", 0), self.state.get("dim") or 0
+        flags = np.fromfile(self.flags_path, dtype=np.uint8).astype(bool) if os.path.exists(self.flags_path) else np.zeros(0, dtype=bool)
+        if not dim or not rows:
+            return None, flags
+        return np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, dim)), flags
+
+    def clear(self):
+        for path in (self.state_path, self.vectors_path, self.flags_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.state = {}
@@ -0,0 +1,102 @@
+import os
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from src.utils.catalog_loader import CATALOG_COLUMNS
+from src.utils.logging_setup import get_logger
+
+logger = get_logger(__name__)
+
+INVENTORY_COLUMNS = ['product_code', 'inventory', 'lifecare_price']
+
+
+def load_inventory_feed(path: str) -> pd.DataFrame:
+    """
+    Đọc feed tồn kho / giá thành khung (product_code, inventory, lifecare_price), mỗi mã một dòng.
+    Hỗ trợ .csv, .parquet, .json (mảng bản ghi), .jsonl / .ndjson và file catalog .xlsx đầy đủ cột.
+    Feed dạng cột phải có đủ ba cột INVENTORY_COLUMNS.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".xlsx", ".xls"):
+        df = pd.read_excel(path)
+        df.columns = CATALOG_COLUMNS
+    elif extension == ".csv":
+        df = pd.read_csv(path, usecols=INVENTORY_COLUMNS, dtype={'product_code': str})
+    elif extension == ".parquet":
+        df = pd.read_parquet(path, columns=INVENTORY_COLUMNS)
+    elif extension in (".jsonl", ".ndjson"):
+        df = pd.read_json(path, lines=True, dtype={'product_code': str})
+    elif extension == ".json":
+        df = pd.read_json(path, dtype={'product_code': str})
+    else:
+        raise ValueError(f"Không hỗ trợ định dạng feed '{extension}'.")
+    return clean_inventory_frame(df)
+
+
+def clean_inventory_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Chuẩn hóa kiểu dữ liệu như khi nạp catalog: mã dạng chuỗi, tồn kho int, giá float (bỏ dấu phẩy)."""
+    missing = [column for column in INVENTORY_COLUMNS if column not in df.columns]
+    if missing:
+        raise ValueError(f"Feed thiếu cột: {', '.join(missing)}.")
+    df = df[INVENTORY_COLUMNS].dropna(subset=['product_code'])
+    codes = df['product_code']
+    # Mã số đọc từ Excel / JSON / CSV có thể thành float (1234.0): đưa về "1234"
+    if pd.api.types.is_numeric_dtype(codes):
+        codes = codes.astype('int64').astype(str)
+    else:
+        codes = codes.astype(str).str.strip().str.replace(r'^(\d+)\.0$', r'\1', regex=True)
+    prices = df['lifecare_price']
+    if not pd.api.types.is_numeric_dtype(prices):
+        prices = prices.astype(str).str.replace(',', '')
+    return pd.DataFrame({
+        'product_code': codes,
+        'inventory': pd.to_numeric(df['inventory'], errors='coerce').fillna(0).astype('int64'),
+        'lifecare_price': pd.to_numeric(prices, errors='coerce').fillna(0).astype(float),
+    }).drop_duplicates(subset='product_code', keep='last').set_index('product_code')
+
+
+def diff_inventory(current: pd.DataFrame, previous: Optional[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Các dòng của `current` có tồn kho hoặc giá khác `previous` (hoặc mã mới), so sánh vector hóa
+    trên toàn bộ khung. Cả hai khung có index là product_code.
+    """
+    if previous is None or previous.empty:
+        return current
+    aligned = previous.reindex(current.index)
+    changed = (
+        aligned['inventory'].isna()
+        | (current['inventory'] != aligned['inventory'])
+        | ~np.isclose(current['lifecare_price'].to_numpy(), aligned['lifecare_price'].to_numpy(dtype=float), rtol=0, atol=1e-6)
+    )
+    return current[changed.to_numpy()]
+
+
+def load_synced_state(path: str) -> Optional[pd.DataFrame]:
+    """Tồn kho / giá đã đồng bộ thành công lần trước (None nếu chưa có)."""
+    if not os.path.exists(path):
+        return None
+    try:
+        return pd.read_parquet(path)
+    except Exception as e:
+        logger.warning("Không đọc được trạng thái đồng bộ tồn kho '%s': %s", path, e)
+        return None
+
+
+def save_synced_state(path: str, current: pd.DataFrame, previous: Optional[pd.DataFrame], failed_codes) -> pd.DataFrame:
+    """
+    Lưu trạng thái đã đồng bộ: giá trị mới cho các mã cập nhật thành công, giữ giá trị cũ
+    cho các mã bị lỗi (để lần sau gửi lại). Ghi file tạm rồi đổi tên.
+    """
+    state = current
+    failed = current.index.isin(list(failed_codes))
+    if failed.any():
+        state = current[~failed]
+        if previous is not None:
+            state = pd.concat([state, previous[previous.index.isin(current.index[failed])]])
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = path + ".tmp"
+    state.to_parquet(temp_path)
+    os.replace(temp_path, path)
+    return state
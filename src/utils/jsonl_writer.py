@@ -0,0 +1,64 @@
+import json
+import logging
+import os
+import queue
+import threading
+from typing import Dict
+
+# Không dùng get_logger: logging_setup -> turn_context -> tracing -> module này tạo vòng import.
+# Logger "src.*" vẫn ghi qua hàng đợi của logging_setup.
+logger = logging.getLogger(__name__)
+
+
+class BackgroundJsonlWriter:
+    """
+    Ghi bản ghi JSON (mỗi dòng một bản ghi) vào file từ một luồng nền, để luồng xử lý request
+    không phải chờ I/O. Hàng đợi có giới hạn: khi đầy, bản ghi mới bị bỏ (đếm trong stats["dropped"])
+    thay vì làm chậm request. Luồng ghi được tạo ở lần ghi đầu tiên.
+    """
+
+    def __init__(self, path: str, name: str, max_queue: int = 10000, batch_size: int = 500):
+        self.path = path
+        self.name = name
+        self.batch_size = batch_size
+        self._queue: "queue.Queue[Dict]" = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self.stats = {"queued": 0, "dropped": 0, "written": 0, "write_errors": 0}
+
+    def write(self, record: Dict) -> bool:
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.stats["dropped"] += 1
+            return False
+        self.stats["queued"] += 1
+        if self._thread is None:
+            self._start()
+        return True
+
+    def _start(self):
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write("".join(json.dumps(record, ensure_ascii=False, default=str) + "\n" for record in batch))
+                self.stats["written"] += len(batch)
+            except OSError as e:
+                self.stats["write_errors"] += 1
+                logger.warning("[%s] Không ghi được '%s': %s", self.name, self.path, e)
+
+    def pending(self) -> int:
+        return self._queue.qsize()
@@ -0,0 +1,189 @@
+import copy
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+from src.utils.helpers import mask_phone_numbers
+from src.utils.metrics import Counter
+from src.utils.turn_context import get_current_turn
+
+# Log của ứng dụng (logger "src.*") đi qua một hàng đợi và được định dạng / ghi ở luồng nền,
+# nên request không phải chờ I/O của stdout hay file.
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# Mức riêng cho từng logger, ví dụ "src.services.search_service=WARNING,src.services.intent_service=DEBUG"
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "")
+# text hoặc json (mỗi dòng một đối tượng JSON)
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text").lower()
+# Để trống thì ghi ra stdout
+LOG_FILE = os.environ.get("LOG_FILE", "")
+# Số bản ghi tối đa chờ ghi; đầy thì bỏ bản ghi mới thay vì làm chậm request
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+# Tỉ lệ lượt chat được ghi toàn văn prompt / phản hồi thô của LLM (chọn theo trace ID, nên một lượt
+# được lấy mẫu sẽ có đủ prompt và phản hồi của mọi bước khi hai tỉ lệ bằng nhau)
+LOG_PROMPT_SAMPLE_RATE = float(os.environ.get("LOG_PROMPT_SAMPLE_RATE", "0.0"))
+LOG_RESPONSE_SAMPLE_RATE = float(os.environ.get("LOG_RESPONSE_SAMPLE_RATE", "0.1"))
+LOG_PAYLOAD_MAX_CHARS = int(os.environ.get("LOG_PAYLOAD_MAX_CHARS", "4000"))
+# Che số điện thoại, địa chỉ và các trường name / phone / address trong log
+LOG_REDACT = os.environ.get("LOG_REDACT", "true").lower() in ("1", "true", "yes")
+
+_ADDRESS_PATTERN = re.compile(
+    r"(?i)(?:\b(?:số nhà|ngõ|ngách|hẻm|kiệt|thôn|xóm|ấp)\s+\d"
+    r"|\bsố\s+\d+\w?\s*[,/]?\s*(?:đường|phố|ngõ|ngách|hẻm)\b"
+    r"|\b(?:phường|xã|thị trấn|quận|huyện|thị xã)\s+\w)"
+    r"[^\"'\n}\]]*"
+)
+_CUSTOMER_FIELD_PATTERN = re.compile(r"""(?i)(["'](?:name|phone|address)["']\s*:\s*)(["'])(.*?)\2""")
+
+_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+_listener: Optional[logging.handlers.QueueListener] = None
+_setup_lock = threading.Lock()
+_stats = {"dropped": 0, "payloads_logged": 0, "payloads_skipped": 0}
+LOG_RECORDS_DROPPED = Counter("log_records_dropped_total", "Số bản ghi log bị bỏ vì hàng đợi ghi log đầy")
+
+
+def redact(text: str) -> str:
+    """Che số điện thoại, địa chỉ và giá trị các trường name / phone / address."""
+    if not text:
+        return text
+    text = mask_phone_numbers(text)
+    text = _ADDRESS_PATTERN.sub("[ĐỊA CHỈ]", text)
+    return _CUSTOMER_FIELD_PATTERN.sub(lambda m: f"{m.group(1)}{m.group(2)}[ẨN]{m.group(2)}", text)
+
+
+class _TurnQueueHandler(logging.handlers.QueueHandler):
+    """
+    Đưa bản ghi vào hàng đợi từ luồng gọi log. Chỉ ghép thông điệp và gắn trace ID / session của lượt
+    chat hiện tại (contextvar chỉ đọc được ở luồng này); định dạng và che dữ liệu làm ở luồng ghi.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        turn = get_current_turn()
+        record.trace_id = turn.trace_id if turn else None
+        record.session_id = turn.session_id if turn else None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _stats["dropped"] += 1
+            LOG_RECORDS_DROPPED.inc()
+
+
+class _StdoutHandler(logging.StreamHandler):
+    """Ghi ra sys.stdout hiện tại (kể cả khi stdout bị chuyển hướng sau lúc cấu hình log)."""
+
+    def emit(self, record: logging.LogRecord):
+        self.stream = sys.stdout
+        super().emit(record)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        line = f"{self.formatTime(record)} {record.levelname} {record.name.rsplit('.', 1)[-1]}: {record.msg}"
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id:
+            line += f" [trace={trace_id[:12]}]"
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return redact(line) if LOG_REDACT else line
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.msg,
+            "trace_id": getattr(record, "trace_id", None),
+            "session_id": getattr(record, "session_id", None),
+        }
+        payload = getattr(record, "payload", None)
+        if payload:
+            entry["payload"] = payload
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        if LOG_REDACT:
+            entry["msg"] = redact(entry["msg"])
+            if "exc" in entry:
+                entry["exc"] = redact(entry["exc"])
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging():
+    """Cấu hình logger "src" (một lần cho mỗi tiến trình): hàng đợi, luồng ghi, định dạng và mức log."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        target = logging.FileHandler(LOG_FILE, encoding="utf-8") if LOG_FILE else _StdoutHandler()
+        target.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+        root = logging.getLogger("src")
+        root.setLevel(LOG_LEVEL)
+        root.propagate = False
+        root.addHandler(_TurnQueueHandler(_queue))
+        for item in filter(None, (part.strip() for part in LOG_LEVELS.split(","))):
+            name, _, level = item.partition("=")
+            logging.getLogger(name.strip()).setLevel(level.strip().upper())
+        _listener = logging.handlers.QueueListener(_queue, target)
+        _listener.start()
+
+
+def get_logger(name: str) -> logging.Logger:
+    setup_logging()
+    return logging.getLogger(name)
+
+
+def _payload_sampled(rate: float) -> bool:
+    if rate >= 1:
+        return True
+    turn = get_current_turn()
+    value = int(turn.trace_id[:8], 16) / 0xFFFFFFFF if turn else random.random()
+    return value < rate
+
+
+def log_payload(logger: logging.Logger, kind: str, label: str, text) -> bool:
+    """
+    Ghi toàn văn prompt (`kind="prompt"`) hoặc phản hồi thô của LLM (`kind="response"`) theo tỉ lệ lấy mẫu.
+    Nội dung dài quá LOG_PAYLOAD_MAX_CHARS bị cắt. Trả về True nếu đã ghi.
+    """
+    rate = LOG_PROMPT_SAMPLE_RATE if kind == "prompt" else LOG_RESPONSE_SAMPLE_RATE
+    if rate <= 0 or not logger.isEnabledFor(logging.INFO) or not _payload_sampled(rate):
+        _stats["payloads_skipped"] += 1
+        return False
+    text = str(text)
+    if len(text) > LOG_PAYLOAD_MAX_CHARS:
+        text = f"{text[:LOG_PAYLOAD_MAX_CHARS]}... (+{len(text) - LOG_PAYLOAD_MAX_CHARS} ký tự)"
+    _stats["payloads_logged"] += 1
+    logger.info("%s (%s):\n%s", label, kind, text, extra={"payload": kind})
+    return True
+
+
+def flush_logs(timeout: float = 5.0):
+    """Chờ luồng ghi xử lý hết các bản ghi đang chờ (dùng trước khi thoát hoặc đổi stdout)."""
+    deadline = time.monotonic() + timeout
+    while _queue.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def get_logging_stats() -> Dict:
+    stats = dict(_stats)
+    stats.update(level=LOG_LEVEL, format=LOG_FORMAT, pending=_queue.qsize(),
+                 prompt_sample_rate=LOG_PROMPT_SAMPLE_RATE, response_sample_rate=LOG_RESPONSE_SAMPLE_RATE)
+    return stats
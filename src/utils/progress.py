@@ -0,0 +1,55 @@
+import threading
+import time
+from typing import Dict
+
+
+class ProgressReport:
+    """
+    Báo cáo tiến độ cho các tác vụ chạy lâu (nạp dữ liệu, tạo embedding): số dòng đã xong,
+    tốc độ (dòng/giây), số lỗi và thời gian còn lại ước tính. An toàn khi gọi từ nhiều luồng,
+    in ra tối đa một dòng mỗi `interval_seconds`.
+    """
+
+    def __init__(self, total: int, label: str = "Tiến độ", interval_seconds: float = 5.0):
+        self.total = total
+        self.label = label
+        self.interval_seconds = interval_seconds
+        self.done = 0
+        self.failures = 0
+        self._start = time.perf_counter()
+        self._last_print = self._start
+        self._lock = threading.Lock()
+
+    def update(self, ok: bool = True, count: int = 1):
+        with self._lock:
+            self.done += count
+            if not ok:
+                self.failures += count
+            now = time.perf_counter()
+            if now - self._last_print < self.interval_seconds or self.done >= self.total:
+                return
+            self._last_print = now
+            line = self._format(now)
+        print(line)
+
+    def _format(self, now: float) -> str:
+        elapsed = max(now - self._start, 1e-9)
+        rate = self.done / elapsed
+        remaining = (self.total - self.done) / rate if rate else 0.0
+        percent = self.done / self.total if self.total else 1.0
+        return (f"{self.label}: {self.done}/{self.total} ({percent:.0%}), {rate:.1f} dòng/s, "
+                f"{self.failures} lỗi, còn khoảng {remaining:.0f}s")
+
+    def finish(self) -> Dict:
+        with self._lock:
+            elapsed = time.perf_counter() - self._start
+            summary = {
+                "total": self.total,
+                "done": self.done,
+                "failures": self.failures,
+                "seconds": elapsed,
+                "rows_per_second": self.done / elapsed if elapsed else 0.0,
+            }
+        print(f"{self.label}: xong {summary['done']}/{self.total} trong {elapsed:.1f}s "
+              f"({summary['rows_per_second']:.1f} dòng/s), {self.failures} lỗi.")
+        return summary
@@ -0,0 +1,65 @@
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+from src.utils.jsonl_writer import BackgroundJsonlWriter
+
+# Span theo từng bước của lượt chat, ghi ra file JSONL theo cấu trúc span của OpenTelemetry
+# (traceId, spanId, parentSpanId, startTimeUnixNano, ...). Tắt mặc định; trace ID luôn được tạo
+# và trả về header X-Trace-Id để đối chiếu log.
+TRACING_ENABLED = os.environ.get("TRACING_ENABLED", "false").lower() in ("1", "true", "yes")
+TRACE_EXPORT_PATH = os.environ.get("TRACE_EXPORT_PATH", "cache/traces.jsonl")
+# Tỉ lệ lượt chat được ghi span (chọn theo trace ID)
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "1.0"))
+
+_TRACEPARENT = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+_writer = BackgroundJsonlWriter(TRACE_EXPORT_PATH, "tracing")
+
+
+def new_trace_id() -> str:
+    return os.urandom(16).hex()
+
+
+def new_span_id() -> str:
+    return os.urandom(8).hex()
+
+
+def parse_traceparent(header: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """(trace ID, span ID cha) từ header W3C traceparent; (None, None) nếu không có hoặc sai định dạng."""
+    match = _TRACEPARENT.match((header or "").strip().lower())
+    if not match or match.group(1) == "0" * 32:
+        return None, None
+    return match.group(1), match.group(2)
+
+
+def should_trace(trace_id: str) -> bool:
+    if not TRACING_ENABLED:
+        return False
+    return TRACE_SAMPLE_RATE >= 1 or int(trace_id[-8:], 16) / 0xFFFFFFFF < TRACE_SAMPLE_RATE
+
+
+def make_span(trace_id: str, span_id: str, parent_span_id: Optional[str], name: str, start_ns: int, end_ns: int,
+              attributes: Dict = None, error: bool = False) -> Dict:
+    return {
+        "traceId": trace_id,
+        "spanId": span_id,
+        "parentSpanId": parent_span_id or "",
+        "name": name,
+        "startTimeUnixNano": start_ns,
+        "endTimeUnixNano": end_ns,
+        "attributes": attributes or {},
+        "status": {"code": "ERROR" if error else "OK"},
+    }
+
+
+def export_spans(spans: List[Dict]):
+    """Đưa các span của một lượt vào hàng đợi ghi (không chặn)."""
+    for span in spans:
+        _writer.write(span)
+
+
+def get_tracing_stats() -> Dict:
+    stats = dict(_writer.stats)
+    stats.update(enabled=TRACING_ENABLED, path=TRACE_EXPORT_PATH, sample_rate=TRACE_SAMPLE_RATE, pending=_writer.pending())
+    return stats
@@ -0,0 +1,193 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional, Dict
+
+from src.utils.metrics import Counter, Gauge, Histogram
+from src.utils.tracing import new_trace_id, new_span_id, should_trace, make_span
+
+
+class TurnCancelled(BaseException):
+    """
+    Lượt chat đã bị hủy (client ngắt kết nối).
+    Kế thừa BaseException để các khối `except Exception` trong service không nuốt mất tín hiệu hủy.
+    """
+
+
+class Deadline:
+    """
+    Ngân sách thời gian của một lượt chat. Được tạo một lần trong chat_endpoint và
+    truyền qua mọi bước; mỗi bước lấy phần thời gian còn lại làm timeout và chọn
+    đường xử lý rẻ hơn khi không còn đủ thời gian.
+    """
+
+    def __init__(self, budget_seconds: float):
+        self.budget = budget_seconds
+        self.expires_at = time.monotonic() + budget_seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def has(self, seconds: float) -> bool:
+        """Còn ít nhất `seconds` giây hay không."""
+        return self.remaining() >= seconds
+
+    def timeout(self, cap: float = None) -> float:
+        """Timeout cho một lệnh gọi: phần thời gian còn lại, không vượt quá `cap`."""
+        remaining = self.remaining()
+        if cap is not None:
+            remaining = min(cap, remaining)
+        return max(0.1, remaining)
+
+
+class TurnContext:
+    """Trạng thái của một lượt chat đang xử lý, dùng chung giữa event loop và các luồng worker."""
+
+    def __init__(self, session_id: str, deadline: Deadline = None, trace_id: str = None, parent_span_id: str = None):
+        self.session_id = session_id
+        self.deadline = deadline
+        self.cancelled = False
+        self.tokens_used = 0
+        # Thời gian (ms) cộng dồn theo từng bước của pipeline, xem timed_stage
+        self.stage_ms: Dict[str, float] = {}
+        # Nhánh xử lý đã chọn và các ghi chú khác của lượt (degraded, ...), xem annotate_turn
+        self.annotations: Dict = {}
+        self.trace_id = trace_id or new_trace_id()
+        self.span_id = new_span_id()
+        self.parent_span_id = parent_span_id
+        # Span của các bước (None nếu lượt này không được ghi span, xem tracing.should_trace)
+        self.spans = [] if should_trace(self.trace_id) else None
+
+    def cancel(self):
+        self.cancelled = True
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise TurnCancelled(f"Lượt chat của session {self.session_id} đã bị hủy.")
+
+
+_current_turn: contextvars.ContextVar[Optional[TurnContext]] = contextvars.ContextVar("current_turn", default=None)
+
+_stats_lock = threading.Lock()
+STAGE_SECONDS = Histogram("chat_stage_duration_seconds", "Thời gian từng bước của lượt chat", ["stage"])
+STAGE_ERRORS = Counter("chat_stage_errors_total", "Số bước kết thúc bằng lỗi", ["stage"])
+STAGES_IN_FLIGHT = Gauge("chat_stages_in_flight", "Số bước đang chạy", ["stage"])
+_stats = {
+    "completed_turns": 0,
+    "cancelled_turns": 0,
+    "deadline_exceeded_turns": 0,
+    # Lượt kết thúc không có câu trả lời bình thường: không tra cứu được, lỗi trong pipeline, bị dừng giữa chừng
+    "search_unavailable_turns": 0,
+    "error_turns": 0,
+    "aborted_turns": 0,
+    "tokens_saved": 0,
+    "avg_tokens_per_turn": 0.0,
+}
+# Hệ số làm mượt cho trung bình token mỗi lượt (EMA)
+_AVG_SMOOTHING = 0.1
+
+
+def set_current_turn(turn: Optional[TurnContext]) -> contextvars.Token:
+    return _current_turn.set(turn)
+
+
+def reset_current_turn(token: contextvars.Token):
+    _current_turn.reset(token)
+
+
+def get_current_turn() -> Optional[TurnContext]:
+    return _current_turn.get()
+
+
+def raise_if_cancelled():
+    """Điểm kiểm tra trước mỗi lệnh gọi LLM / Elasticsearch."""
+    turn = _current_turn.get()
+    if turn is not None:
+        turn.raise_if_cancelled()
+
+
+@contextmanager
+def timed_stage(name: str):
+    """
+    Đo một bước của lượt chat: histogram chat_stage_duration_seconds, gauge số bước đang chạy,
+    cộng vào TurnContext.stage_ms và ghi span con của lượt (nếu lượt được ghi span).
+    """
+    turn = _current_turn.get()
+    STAGES_IN_FLIGHT.inc(stage=name)
+    start_ns = time.time_ns()
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        STAGE_ERRORS.inc(stage=name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGES_IN_FLIGHT.dec(stage=name)
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        if turn is not None:
+            turn.stage_ms[name] = turn.stage_ms.get(name, 0.0) + elapsed * 1000
+            if turn.spans is not None:
+                turn.spans.append(make_span(turn.trace_id, new_span_id(), turn.span_id, name, start_ns, time.time_ns(), {"stage": name}, error))
+
+
+def annotate_turn(**fields):
+    """Ghi chú cho lượt chat hiện tại, ví dụ annotate_turn(branch="more_products")."""
+    turn = _current_turn.get()
+    if turn is not None:
+        turn.annotations.update(fields)
+
+
+def estimate_tokens(text: str) -> int:
+    """Ước lượng số token (~4 ký tự/token), đủ dùng cho thống kê."""
+    if not text:
+        return 0
+    return max(1, len(str(text)) // 4)
+
+
+def note_llm_usage(prompt: str, response_text: str = None):
+    """Cộng dồn số token ước lượng đã dùng vào lượt chat hiện tại."""
+    turn = _current_turn.get()
+    if turn is not None:
+        turn.tokens_used += estimate_tokens(prompt) + estimate_tokens(response_text)
+
+
+def record_turn_completed(turn: TurnContext):
+    with _stats_lock:
+        _stats["completed_turns"] += 1
+        if _stats["completed_turns"] == 1:
+            _stats["avg_tokens_per_turn"] = float(turn.tokens_used)
+        else:
+            _stats["avg_tokens_per_turn"] += _AVG_SMOOTHING * (turn.tokens_used - _stats["avg_tokens_per_turn"])
+
+
+def record_turn_cancelled(turn: TurnContext):
+    """
+    Ghi nhận một lượt bị hủy. Số token tiết kiệm được ước lượng bằng
+    trung bình token của một lượt hoàn chỉnh trừ đi phần lượt này đã tiêu.
+    """
+    with _stats_lock:
+        _stats["cancelled_turns"] += 1
+        _stats["tokens_saved"] += max(0, int(_stats["avg_tokens_per_turn"]) - turn.tokens_used)
+
+
+def record_turn_deadline_exceeded(turn: TurnContext):
+    with _stats_lock:
+        _stats["deadline_exceeded_turns"] += 1
+
+
+def record_turn_failed(turn: TurnContext, outcome: str):
+    """Ghi nhận một lượt thất bại (`outcome`: search_unavailable, error hoặc aborted); không tính vào lượt hoàn chỉnh."""
+    with _stats_lock:
+        _stats[f"{outcome}_turns"] += 1
+
+
+def get_cancellation_stats() -> Dict:
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# settings.py đọc GEMINI_API_KEY lúc import; test không gọi Gemini nên dùng key giả
+os.environ.setdefault("GEMINI_API_KEY", '["test"]')
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
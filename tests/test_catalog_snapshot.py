@@ -0,0 +1,110 @@
+import os
+
+import numpy as np
+import pytest
+
+from src.utils import catalog_snapshot
+from src.utils.catalog_snapshot import (
+    CatalogSnapshot, SnapshotWriter, get_current_snapshot, open_current_snapshot,
+    publish_updated_snapshot, read_current_pointer, write_snapshot,
+)
+
+RECORDS = [
+    {"product_code": "P1", "product_name": "Máy hàn Quick 936", "category": "máy hàn", "properties": "220V",
+     "inventory": 5, "lifecare_price": 1250000.0, "link_product": "https://shop.vn/p1"},
+    {"product_code": "P2", "product_name": "Kính hiển vi", "category": None, "properties": "",
+     "inventory": None, "lifecare_price": None},
+    {"product_code": "P3", "product_name": "Tô vít 🔧", "category": "tô vít", "properties": "PH2",
+     "inventory": "3", "lifecare_price": "45000"},
+]
+
+
+@pytest.fixture
+def embeddings():
+    return np.random.default_rng(1).standard_normal((len(RECORDS), 16)).astype(np.float32)
+
+
+def test_round_trip_strings_numbers_and_nulls(tmp_path):
+    snapshot = CatalogSnapshot(write_snapshot(RECORDS, directory=str(tmp_path), version="v1"))
+    assert len(snapshot) == 3 and snapshot.version == "v1"
+    assert snapshot.embeddings is None and snapshot.embedding_dim == 0
+    first, second, third = list(snapshot)
+    assert first["product_name"] == "Máy hàn Quick 936"
+    assert first["link_product"] == "https://shop.vn/p1"
+    assert first["inventory"] == 5 and first["lifecare_price"] == 1250000.0
+    assert second["category"] is None and second["properties"] == ""
+    assert second["inventory"] == 0 and second["lifecare_price"] == 0.0
+    assert third["product_name"] == "Tô vít 🔧" and third["inventory"] == 3
+    assert snapshot[-1] == third
+    assert snapshot.strings("product_code") == ["P1", "P2", "P3"]
+
+
+def test_round_trip_float32_embeddings(tmp_path, embeddings):
+    mask = np.array([True, False, True])
+    snapshot = CatalogSnapshot(write_snapshot(RECORDS, embeddings, mask, directory=str(tmp_path)))
+    assert snapshot.embedding_dtype == "float32" and snapshot.embedding_dim == 16
+    np.testing.assert_array_equal(snapshot.embeddings, embeddings)
+    np.testing.assert_array_equal(snapshot.has_embedding, mask)
+    assert sorted(snapshot.embeddings_by_code()) == ["P1", "P3"]
+
+
+def test_round_trip_int8_embeddings(tmp_path, embeddings):
+    snapshot = CatalogSnapshot(write_snapshot(RECORDS, embeddings, embedding_dtype="int8", directory=str(tmp_path)))
+    assert snapshot.embeddings.dtype == np.int8
+    restored = snapshot.embeddings_by_code()
+    for i, record in enumerate(RECORDS):
+        np.testing.assert_allclose(restored[record["product_code"]], embeddings[i], atol=np.abs(embeddings[i]).max() / 127)
+
+
+def test_chunked_writer_matches_single_write(tmp_path, embeddings, monkeypatch):
+    whole = write_snapshot(RECORDS, embeddings, directory=str(tmp_path / "whole"), version="v")
+    writer = SnapshotWriter(16, directory=str(tmp_path / "chunked"), version="v")
+    writer.append(RECORDS[:1], embeddings[:1])
+    writer.append([], embeddings[:0])
+    writer.append(RECORDS[1:], embeddings[1:])
+    chunked = writer.commit()
+    with open(whole, "rb") as a, open(chunked, "rb") as b:
+        assert a.read() == b.read()
+    assert not [f for f in os.listdir(tmp_path / "chunked") if f.endswith((".part", ".tmp"))]
+
+
+def test_abort_leaves_published_snapshot_untouched(tmp_path):
+    write_snapshot(RECORDS, directory=str(tmp_path), version="v1")
+    writer = SnapshotWriter(directory=str(tmp_path), version="v2")
+    writer.append(RECORDS)
+    writer.abort()
+    assert read_current_pointer(str(tmp_path)) == "catalog-v1.snap"
+    assert sorted(os.listdir(tmp_path)) == ["CURRENT", "catalog-v1.snap"]
+
+
+def test_pointer_switch_and_pruning(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog_snapshot, "CATALOG_SNAPSHOT_KEEP", 2)
+    for version in ("v1", "v2", "v3"):
+        write_snapshot(RECORDS, directory=str(tmp_path), version=version)
+    assert read_current_pointer(str(tmp_path)) == "catalog-v3.snap"
+    assert sorted(f for f in os.listdir(tmp_path) if f.endswith(".snap")) == ["catalog-v2.snap", "catalog-v3.snap"]
+    assert open_current_snapshot(str(tmp_path)).version == "v3"
+
+
+def test_publish_updated_snapshot_changes_fields_and_keeps_embeddings(tmp_path, embeddings, monkeypatch):
+    monkeypatch.setattr(catalog_snapshot, "CATALOG_SNAPSHOT_DIR", str(tmp_path))
+    monkeypatch.setattr(catalog_snapshot, "CATALOG_SNAPSHOT_WRITE_ROWS", 2)
+    monkeypatch.setattr(catalog_snapshot, "_current", None)
+    monkeypatch.setattr(catalog_snapshot, "_state", {"filename": None, "last_check": 0.0, "swaps": 0})
+    write_snapshot(RECORDS, embeddings, embedding_dtype="int8", version="v1")
+    before = get_current_snapshot(refresh=True)
+
+    publish_updated_snapshot({"P2": {"inventory": 9, "lifecare_price": 99.0}}, before)
+    after = get_current_snapshot(refresh=True)
+    assert after.version != before.version
+    assert after[1]["inventory"] == 9 and after[1]["lifecare_price"] == 99.0
+    assert after[0] == before[0] and after[2] == before[2]
+    np.testing.assert_array_equal(after.embeddings, before.embeddings)
+    np.testing.assert_array_equal(after.embedding_scales, before.embedding_scales)
+
+
+def test_rejects_files_that_are_not_snapshots(tmp_path):
+    path = tmp_path / "catalog-bad.snap"
+    path.write_bytes(b"not a snapshot file")
+    with pytest.raises(ValueError):
+        CatalogSnapshot(str(path))
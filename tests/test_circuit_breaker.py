@@ -0,0 +1,146 @@
+import asyncio
+
+import pytest
+from elastic_transport import ConnectionError as TransportConnectionError
+
+from src.services import search_service
+from src.utils.circuit_breaker import CircuitBreaker
+
+
+def _open_breaker(threshold: int = 2) -> CircuitBreaker:
+    breaker = CircuitBreaker("test", failure_threshold=threshold, reset_timeout=0.0)
+    for _ in range(threshold):
+        assert breaker.allow_request()
+        breaker.record_failure()
+    assert breaker.state == "open"
+    return breaker
+
+
+def test_opens_after_threshold_consecutive_failures():
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=60.0)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow_request()
+    assert breaker.snapshot() == {"state": "open", "consecutive_failures": 3, "times_opened": 1}
+
+
+def test_half_open_allows_a_single_trial():
+    breaker = _open_breaker()
+    assert breaker.allow_request()
+    assert breaker.state == "half_open"
+    assert not breaker.allow_request()
+
+
+def test_half_open_trial_success_closes():
+    breaker = _open_breaker()
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.snapshot()["consecutive_failures"] == 0
+    assert breaker.allow_request() and breaker.allow_request()
+
+
+def test_half_open_trial_failure_reopens():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=60.0)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker._opened_at -= 61
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow_request()
+
+
+def test_release_trial_frees_the_slot_without_closing():
+    breaker = _open_breaker()
+    assert breaker.allow_request()
+    breaker.release_trial()
+    assert breaker.state == "half_open"
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+
+
+def test_release_trial_is_a_no_op_when_closed():
+    breaker = CircuitBreaker("test", failure_threshold=2)
+    breaker.release_trial()
+    assert breaker.state == "closed"
+    assert breaker.allow_request()
+
+
+class _FakeClient:
+    """Client Elasticsearch giả: mỗi lệnh search chạy `behaviour` (trả response, ném lỗi hoặc treo)."""
+
+    def __init__(self):
+        self.behaviour = None
+
+    def options(self, **kwargs):
+        return self
+
+    async def search(self, **kwargs):
+        return await self.behaviour()
+
+
+@pytest.fixture
+def fake_es(monkeypatch):
+    client = _FakeClient()
+    monkeypatch.setattr(search_service, "_breaker", CircuitBreaker("elasticsearch", failure_threshold=2, reset_timeout=0.0))
+    monkeypatch.setattr(search_service, "get_es_client", lambda: client)
+    return client
+
+
+def _open_search_breaker(fake_es):
+    async def fail():
+        raise TransportConnectionError("es down")
+
+    fake_es.behaviour = fail
+    for _ in range(2):
+        with pytest.raises(search_service.SearchUnavailableError):
+            asyncio.run(search_service._execute_search("test", body={}))
+    assert search_service._breaker.state == "open"
+
+
+async def _ok():
+    return {"took": 1, "hits": {"hits": []}}
+
+
+def test_cancelled_trial_search_does_not_wedge_breaker(fake_es):
+    _open_search_breaker(fake_es)
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    async def cancelled_trial():
+        task = asyncio.create_task(search_service._execute_search("test", body={}))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    fake_es.behaviour = hang
+    asyncio.run(cancelled_trial())
+    assert search_service._breaker.state == "half_open"
+
+    fake_es.behaviour = _ok
+    asyncio.run(search_service._execute_search("test", body={}))
+    assert search_service._breaker.state == "closed"
+
+
+def test_unexpected_error_in_trial_does_not_wedge_breaker(fake_es):
+    _open_search_breaker(fake_es)
+
+    async def broken():
+        raise ValueError("lỗi không rõ")
+
+    fake_es.behaviour = broken
+    with pytest.raises(ValueError):
+        asyncio.run(search_service._execute_search("test", body={}))
+
+    fake_es.behaviour = _ok
+    asyncio.run(search_service._execute_search("test", body={}))
+    assert search_service._breaker.state == "closed"
@@ -0,0 +1,48 @@
+import pytest
+
+from src.services.intent_service import extract_customer_info_locally
+from src.services.response_service import evaluate_and_choose_product_locally, evaluate_purchase_confirmation_locally
+
+CANDIDATES = [
+    {"product_name": "Máy hàn Quick 936", "properties": "220V", "inventory": 0},
+    {"product_name": "Máy hàn Quick 936", "properties": "220V", "inventory": 3},
+    {"product_name": "Máy khò Quick", "properties": "8512P", "inventory": 2},
+]
+
+
+@pytest.mark.parametrize("message, decision", [
+    ("ok em", "CONFIRM"),
+    ("chốt", "CONFIRM"),
+    ("dạ không ạ", "CANCEL"),
+    ("thôi em", "CANCEL"),
+    ("shop có bán cái khác không?", "UNCLEAR"),
+])
+def test_purchase_confirmation_keywords(message, decision):
+    assert evaluate_purchase_confirmation_locally(message)["decision"] == decision
+
+
+def test_customer_info_is_split_into_name_phone_address():
+    info = extract_customer_info_locally("Nguyễn Văn A, 0912345678, số 8 ngõ 117 Thái Hà, Hà Nội")
+    assert info == {"name": "Nguyễn Văn A", "phone": "0912345678", "address": "số 8 ngõ 117 Thái Hà, Hà Nội"}
+
+
+def test_local_product_choice_prefers_an_in_stock_exact_match():
+    evaluation = evaluate_and_choose_product_locally("máy hàn quick", "220v", CANDIDATES)
+    assert evaluation["type"] == "PERFECT_MATCH"
+    assert evaluation["product"] is CANDIDATES[1]
+
+
+def test_local_product_choice_suggests_first_hit_when_nothing_matches_exactly():
+    evaluation = evaluate_and_choose_product_locally("máy khò", "858D", CANDIDATES)
+    assert evaluation["type"] == "CLOSE_MATCH"
+    assert evaluation["product"] is CANDIDATES[0]
+
+
+def test_local_product_choice_accepts_a_confirmed_suggestion():
+    evaluation = evaluate_and_choose_product_locally("máy khò", "858D", CANDIDATES[2:], suggestion_confirmed=True)
+    assert evaluation["type"] == "PERFECT_MATCH"
+    assert evaluation["product"] is CANDIDATES[2]
+
+
+def test_local_product_choice_without_candidates():
+    assert evaluate_and_choose_product_locally("máy hàn", None, [])["type"] == "NO_MATCH"
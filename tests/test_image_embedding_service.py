@@ -0,0 +1,68 @@
+import time
+
+import pytest
+
+from src.services import image_embedding_service as service
+from src.utils.embedding_cache import EmbeddingCache
+
+IMAGES = {
+    "https://shop.vn/a.jpg": b"red-variant",
+    "https://cdn.khach.vn/a-copy.jpg": b"red-variant",
+    "https://shop.vn/b.jpg": b"blue-variant",
+}
+
+
+@pytest.fixture
+def fake_services(monkeypatch, tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite3"))
+    calls = {"embed": [], "download": []}
+    delays = {"embed": 0.0, "download": 0.0}
+
+    def fake_download(image_url, deadline=None):
+        calls["download"].append(image_url)
+        time.sleep(delays["download"])
+        return IMAGES[image_url]
+
+    def fake_embed(image_url, deadline=None):
+        calls["embed"].append(image_url)
+        time.sleep(delays["embed"])
+        return [float(len(calls["embed"])), 0.5]
+
+    monkeypatch.setattr(service, "_get_cache", lambda: cache)
+    monkeypatch.setattr(service, "_download_image", fake_download)
+    monkeypatch.setattr(service, "_call_embed_api", fake_embed)
+    return calls, delays
+
+
+def test_url_hit_skips_download_and_embed(fake_services):
+    calls, _ = fake_services
+    first = service.get_image_embedding("https://shop.vn/a.jpg")
+    again = service.get_image_embedding("https://shop.vn/a.jpg")
+    assert again == first
+    assert calls["embed"] == ["https://shop.vn/a.jpg"]
+    assert calls["download"] == ["https://shop.vn/a.jpg"]
+
+
+def test_same_bytes_under_another_url_reuse_the_embedding(fake_services):
+    calls, delays = fake_services
+    first = service.get_image_embedding("https://shop.vn/a.jpg")
+    delays["embed"] = 1.0
+    start = time.perf_counter()
+    copy = service.get_image_embedding("https://cdn.khach.vn/a-copy.jpg")
+    assert copy == first
+    # Trúng sha256 thì không chờ lệnh gọi dịch vụ đang chạy song song
+    assert time.perf_counter() - start < 0.5
+
+
+def test_different_image_content_is_never_reused(fake_services):
+    service.get_image_embedding("https://shop.vn/a.jpg")
+    other = service.get_image_embedding("https://shop.vn/b.jpg")
+    assert other == [2.0, 0.5]
+
+
+def test_download_and_embed_run_concurrently(fake_services):
+    _, delays = fake_services
+    delays["embed"] = delays["download"] = 0.3
+    start = time.perf_counter()
+    assert service.get_image_embedding("https://shop.vn/a.jpg") == [1.0, 0.5]
+    assert time.perf_counter() - start < 0.5
@@ -0,0 +1,130 @@
+import asyncio
+import time
+
+import numpy as np
+import pytest
+
+from src.services import image_index, search_service
+from src.services.image_index import ImageIndex
+from src.utils import catalog_snapshot
+from src.utils.catalog_snapshot import CatalogSnapshot, write_snapshot
+
+ROWS, DIM = 400, 32
+
+
+@pytest.fixture
+def embeddings():
+    rng = np.random.default_rng(7)
+    return rng.standard_normal((ROWS, DIM)).astype(np.float32)
+
+
+@pytest.fixture
+def snapshot(tmp_path, embeddings):
+    records = [{"product_code": f"P{i}", "product_name": f"Sản phẩm {i}", "inventory": 1} for i in range(ROWS)]
+    has_embedding = np.ones(ROWS, dtype=bool)
+    has_embedding[::10] = False
+    path = write_snapshot(records, embeddings, has_embedding, directory=str(tmp_path), version="test")
+    return CatalogSnapshot(path)
+
+
+def _rows(hits):
+    return [row for row, _ in hits]
+
+
+def test_exact_search_finds_the_query_row_first(snapshot, embeddings):
+    index = ImageIndex(snapshot)
+    hits = index.search(embeddings[3], top_k=5)
+    assert hits[0][0] == 3
+    assert hits[0][1] == pytest.approx(1.0, abs=1e-5)
+    assert [score for _, score in hits] == sorted((score for _, score in hits), reverse=True)
+
+
+def test_rows_without_embedding_are_never_returned(snapshot, embeddings):
+    index = ImageIndex(snapshot)
+    hits = index.search(embeddings[10], top_k=ROWS)
+    assert 10 not in _rows(hits)
+    assert not any(row % 10 == 0 for row in _rows(hits))
+
+
+def test_min_similarity_filters_hits(snapshot, embeddings):
+    index = ImageIndex(snapshot)
+    assert _rows(index.search(embeddings[3], top_k=10, min_similarity=0.99)) == [3]
+
+
+def test_int8_matches_exact_scores_closely(snapshot, embeddings):
+    exact = ImageIndex(snapshot)
+    quantized = ImageIndex(snapshot, dtype="int8")
+    assert quantized.dtype == "int8"
+    for query in (1, 57, 233):
+        exact_hits = exact.search(embeddings[query], top_k=10)
+        int8_hits = quantized.search(embeddings[query], top_k=10)
+        assert int8_hits[0][0] == query
+        assert len(set(_rows(exact_hits)) & set(_rows(int8_hits))) >= 8
+        exact_scores = dict(exact_hits)
+        for row, score in int8_hits:
+            if row in exact_scores:
+                assert score == pytest.approx(exact_scores[row], abs=0.01)
+
+
+def test_ivf_probing_every_list_equals_exact(snapshot, embeddings):
+    exact = ImageIndex(snapshot)
+    ivf = ImageIndex(snapshot, nlist=8, nprobe=8)
+    assert len(ivf.lists) == 8
+    assert sum(len(rows) for rows in ivf.lists) == len(exact.valid_rows)
+    queries = embeddings[[1, 57, 233]]
+    for exact_hits, ivf_hits in zip(exact.search_batch(queries, top_k=5), ivf.search_batch(queries, top_k=5)):
+        assert _rows(ivf_hits) == _rows(exact_hits)
+        assert [s for _, s in ivf_hits] == pytest.approx([s for _, s in exact_hits], abs=1e-6)
+
+
+def test_ivf_single_probe_still_finds_the_query_row(snapshot, embeddings):
+    ivf = ImageIndex(snapshot, nlist=8, nprobe=1)
+    for query in (1, 57, 233):
+        assert ivf.search(embeddings[query], top_k=1)[0][0] == query
+
+
+@pytest.fixture
+def local_image_backend(monkeypatch, tmp_path):
+    monkeypatch.setattr(search_service, "IMAGE_SEARCH_BACKEND", "local")
+    monkeypatch.setattr(catalog_snapshot, "CATALOG_SNAPSHOT_DIR", str(tmp_path))
+    monkeypatch.setattr(catalog_snapshot, "_current", None)
+    monkeypatch.setattr(catalog_snapshot, "_state", {"filename": None, "last_check": 0.0, "swaps": 0})
+    monkeypatch.setattr(image_index, "_index", None)
+    monkeypatch.setattr(image_index, "_state", {"building": False, "last_attempt": 0.0, "builds": 0, "queries": 0, "total_ms": 0.0})
+    es_calls = []
+
+    async def fake_execute_search(label, deadline=None, **kwargs):
+        es_calls.append(label)
+        return {"took": 1, "hits": {"hits": [{"_source": {"product_name": "từ ES"}}]}}, 1.0
+
+    monkeypatch.setattr(search_service, "_execute_search", fake_execute_search)
+    return es_calls
+
+
+def _wait_for_build():
+    deadline = time.monotonic() + 10
+    while image_index._state["building"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_image_search_falls_back_to_es_until_the_index_is_built(local_image_backend, tmp_path, embeddings):
+    es_calls = local_image_backend
+    hits = asyncio.run(search_service.search_products_by_image(embeddings[3].tolist()))
+    assert es_calls == ["search_products_by_image"]
+    assert [h["product_name"] for h in hits] == ["từ ES"]
+    _wait_for_build()
+    assert image_index._index is None
+
+    records = [{"product_code": f"P{i}", "product_name": f"Sản phẩm {i}"} for i in range(ROWS)]
+    write_snapshot(records, embeddings, directory=str(tmp_path))
+    # Lần thử dựng lại bị giới hạn theo IMAGE_INDEX_RETRY_SECONDS
+    asyncio.run(search_service.search_products_by_image(embeddings[3].tolist()))
+    assert len(es_calls) == 2
+    image_index._state["last_attempt"] -= image_index.IMAGE_INDEX_RETRY_SECONDS
+    asyncio.run(search_service.search_products_by_image(embeddings[3].tolist()))
+    assert len(es_calls) == 3
+    _wait_for_build()
+
+    hits = asyncio.run(search_service.search_products_by_image(embeddings[3].tolist()))
+    assert len(es_calls) == 3
+    assert [h["product_name"] for h in hits] == ["Sản phẩm 3"]
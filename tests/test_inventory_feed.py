@@ -0,0 +1,71 @@
+import pandas as pd
+
+from src.utils.inventory_feed import clean_inventory_frame, diff_inventory, load_inventory_feed, load_synced_state, save_synced_state
+
+
+def _frame(rows):
+    return clean_inventory_frame(pd.DataFrame(rows, columns=["product_code", "inventory", "lifecare_price"]))
+
+
+def test_clean_normalizes_codes_prices_and_duplicates():
+    frame = _frame([(1234.0, "5", "1,200,000"), ("  A1 ", None, 10), ("A1", 3, 12.5)])
+    assert list(frame.index) == ["1234", "A1"]
+    assert frame.loc["1234"].tolist() == [5, 1200000.0]
+    assert frame.loc["A1"].tolist() == [3, 12.5]
+
+
+def test_diff_without_previous_state_returns_everything():
+    current = _frame([("A", 1, 10.0), ("B", 2, 20.0)])
+    assert diff_inventory(current, None).index.tolist() == ["A", "B"]
+
+
+def test_diff_keeps_only_changed_and_new_codes():
+    previous = _frame([("A", 1, 10.0), ("B", 2, 20.0), ("C", 3, 30.0), ("GONE", 1, 1.0)])
+    current = _frame([("A", 1, 10.0), ("B", 5, 20.0), ("C", 3, 31.0), ("NEW", 0, 0.0)])
+    assert diff_inventory(current, previous).index.tolist() == ["B", "C", "NEW"]
+
+
+def test_diff_ignores_float_noise_in_prices():
+    previous = _frame([("A", 1, 0.1 + 0.2)])
+    current = _frame([("A", 1, 0.3)])
+    assert diff_inventory(current, previous).empty
+
+
+def test_save_synced_state_keeps_previous_values_for_failed_codes(tmp_path):
+    path = str(tmp_path / "state" / "inventory.parquet")
+    previous = _frame([("A", 1, 10.0), ("B", 2, 20.0)])
+    current = _frame([("A", 7, 11.0), ("B", 8, 21.0), ("C", 9, 30.0)])
+
+    state = save_synced_state(path, current, previous, failed_codes=["B"])
+    assert state.loc["A"].tolist() == [7, 11.0]
+    assert state.loc["B"].tolist() == [2, 20.0]
+    assert "C" in state.index
+
+    loaded = load_synced_state(path)
+    pd.testing.assert_frame_equal(loaded.sort_index(), state.sort_index())
+    # Mã lỗi vẫn khác trạng thái đã lưu nên lần đồng bộ sau gửi lại
+    assert diff_inventory(current, loaded).index.tolist() == ["B"]
+
+
+def test_failed_new_code_is_retried_next_time(tmp_path):
+    path = str(tmp_path / "inventory.parquet")
+    current = _frame([("A", 1, 10.0), ("C", 9, 30.0)])
+    state = save_synced_state(path, current, None, failed_codes={"C"})
+    assert state.index.tolist() == ["A"]
+    assert diff_inventory(current, load_synced_state(path)).index.tolist() == ["C"]
+
+
+def test_load_synced_state_missing_or_corrupt(tmp_path):
+    assert load_synced_state(str(tmp_path / "missing.parquet")) is None
+    corrupt = tmp_path / "corrupt.parquet"
+    corrupt.write_bytes(b"not parquet")
+    assert load_synced_state(str(corrupt)) is None
+
+
+def test_load_inventory_feed_formats(tmp_path):
+    rows = [{"product_code": "007", "inventory": 4, "lifecare_price": 99.5}]
+    pd.DataFrame(rows).to_csv(tmp_path / "feed.csv", index=False)
+    pd.DataFrame(rows).to_json(tmp_path / "feed.jsonl", orient="records", lines=True)
+    for name in ("feed.csv", "feed.jsonl"):
+        frame = load_inventory_feed(str(tmp_path / name))
+        assert frame.loc["007"].tolist() == [4, 99.5]
@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+
+from src.services import search_service
+from src.utils.circuit_breaker import CircuitBreaker
+from src.utils.result_cache import ResultCache
+
+
+def test_lru_eviction_by_entry_count():
+    cache = ResultCache("test", max_entries=2)
+    cache.put("a", 1, 10)
+    cache.put("b", 2, 10)
+    assert cache.get("a") == 1
+    cache.put("c", 3, 10)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.snapshot()["evictions"] == 1
+
+
+def test_eviction_by_total_bytes_and_oversized_values():
+    cache = ResultCache("test", max_entries=10, max_bytes=100)
+    cache.put("big", "x", 101)
+    assert cache.get("big") is None
+    cache.put("a", 1, 60)
+    cache.put("b", 2, 60)
+    assert cache.get("a") is None
+    assert cache.snapshot()["bytes"] == 60
+
+
+def test_expired_entries_are_misses(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("src.utils.result_cache.time.monotonic", lambda: now[0])
+    cache = ResultCache("test", ttl_seconds=5)
+    cache.put("a", 1, 1)
+    now[0] += 4
+    assert cache.get("a") == 1
+    now[0] += 2
+    assert cache.get("a") is None
+    assert cache.snapshot()["expired"] == 1
+
+
+def test_clear_counts_an_invalidation():
+    cache = ResultCache("test")
+    cache.put("a", 1, 1)
+    cache.clear()
+    assert cache.get("a") is None
+    stats = cache.snapshot()
+    assert stats["invalidations"] == 1 and stats["entries"] == 0 and stats["bytes"] == 0
+
+
+class _VersionedClient:
+    """Client giả: phiên bản catalog đổi được, mỗi lệnh search trả về tên sản phẩm theo phiên bản."""
+
+    def __init__(self):
+        self.version = "v1"
+        self.searches = 0
+
+    def options(self, **kwargs):
+        return self
+
+    async def get(self, **kwargs):
+        return {"_source": {"version": self.version}}
+
+    async def search(self, **kwargs):
+        self.searches += 1
+        return {"took": 1, "hits": {"hits": [{"_source": {"product_name": f"máy hàn {self.version}"}, "sort": [1]}]}}
+
+
+@pytest.fixture
+def versioned_es(monkeypatch):
+    client = _VersionedClient()
+    monkeypatch.setattr(search_service, "_breaker", CircuitBreaker("elasticsearch"))
+    monkeypatch.setattr(search_service, "get_es_client", lambda: client)
+    monkeypatch.setattr(search_service, "SEARCH_BACKEND", "elasticsearch")
+    monkeypatch.setattr(search_service, "SEARCH_CACHE_ENABLED", True)
+    monkeypatch.setattr(search_service, "CATALOG_VERSION_CHECK_SECONDS", 0.0)
+    monkeypatch.setattr(search_service, "_catalog", {"version": None, "last_check": 0.0})
+    search_service.invalidate_search_cache()
+    yield client
+    search_service.invalidate_search_cache()
+
+
+def _names(hits):
+    return [p["product_name"] for p in hits]
+
+
+def test_search_cache_is_invalidated_when_catalog_version_changes(versioned_es):
+    assert _names(asyncio.run(search_service.search_products("Máy  hàn"))) == ["máy hàn v1"]
+    # Truy vấn chuẩn hóa giống nhau (chữ hoa, khoảng trắng) dùng lại kết quả đã cache
+    assert _names(asyncio.run(search_service.search_products("máy hàn"))) == ["máy hàn v1"]
+    assert versioned_es.searches == 1
+
+    versioned_es.version = "v2"
+    assert _names(asyncio.run(search_service.search_products("máy hàn"))) == ["máy hàn v2"]
+    assert versioned_es.searches == 2
+    assert search_service._catalog["version"] == "v2"
+
+
+def test_cached_results_are_copies(versioned_es):
+    hits = asyncio.run(search_service.search_products("máy hàn"))
+    hits[0]["product_name"] = "đã sửa"
+    assert _names(asyncio.run(search_service.search_products("máy hàn"))) == ["máy hàn v1"]
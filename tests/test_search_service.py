@@ -0,0 +1,151 @@
+import asyncio
+
+import pytest
+from elastic_transport import ConnectionError as TransportConnectionError
+
+from src.services import search_service
+from src.utils.circuit_breaker import CircuitBreaker
+
+
+class _FakeClient:
+    """Client Elasticsearch giả: `down=True` thì mọi lệnh gọi lỗi kết nối."""
+
+    def __init__(self):
+        self.down = False
+        self.version = "v1"
+        self.calls = {"search": 0, "get": 0}
+
+    def options(self, **kwargs):
+        return self
+
+    async def search(self, **kwargs):
+        self.calls["search"] += 1
+        if self.down:
+            raise TransportConnectionError("es down")
+        return {"took": 1, "hits": {"hits": []}}
+
+    async def get(self, **kwargs):
+        self.calls["get"] += 1
+        if self.down:
+            raise TransportConnectionError("es down")
+        return {"_source": {"version": self.version}}
+
+
+@pytest.fixture
+def fake_es(monkeypatch):
+    client = _FakeClient()
+    monkeypatch.setattr(search_service, "_breaker", CircuitBreaker("elasticsearch", failure_threshold=2, reset_timeout=0.0))
+    monkeypatch.setattr(search_service, "get_es_client", lambda: client)
+    monkeypatch.setattr(search_service, "CATALOG_VERSION_CHECK_SECONDS", 0.0)
+    monkeypatch.setattr(search_service, "_catalog", {"version": None, "last_check": 0.0})
+    return client
+
+
+def _search():
+    return asyncio.run(search_service._execute_search("test", body={}))
+
+
+def _check_version():
+    asyncio.run(search_service._refresh_catalog_version())
+
+
+def test_version_checks_do_not_wedge_breaker_after_outage(fake_es):
+    breaker = search_service._breaker
+    _check_version()
+    assert search_service._catalog["version"] == "v1"
+
+    # Sự cố: các truy vấn lỗi mở breaker, kiểm tra phiên bản lỗi trong lúc đó không làm gì
+    fake_es.down = True
+    for _ in range(2):
+        _check_version()
+        with pytest.raises(search_service.SearchUnavailableError):
+            _search()
+    assert breaker.state == "open"
+
+    # Elasticsearch hồi phục; hết reset_timeout, kiểm tra phiên bản chạy trước truy vấn thử
+    fake_es.down = False
+    gets_before = fake_es.calls["get"]
+    _check_version()
+    _check_version()
+    assert fake_es.calls["get"] == gets_before
+    assert breaker.allow_request()
+    assert breaker.state == "half_open"
+    breaker.release_trial()
+    _check_version()
+
+    # Truy vấn thử vẫn được cho qua và đóng breaker
+    _search()
+    assert breaker.state == "closed"
+    _search()
+
+    fake_es.version = "v2"
+    _check_version()
+    assert search_service._catalog["version"] == "v2"
+    assert breaker.snapshot()["state"] == "closed"
+
+
+class _PagingClient:
+    """Client giả có PIT: trả `size` kết quả mỗi trang, ghi lại PIT đã mở / đóng."""
+
+    def __init__(self):
+        self.searches = []
+        self.opened = []
+        self.closed = []
+
+    def options(self, **kwargs):
+        return self
+
+    async def get(self, **kwargs):
+        return {"_source": {"version": "v1"}}
+
+    async def open_point_in_time(self, **kwargs):
+        self.opened.append(f"pit-{len(self.opened)}")
+        return {"id": self.opened[-1]}
+
+    async def close_point_in_time(self, id):
+        self.closed.append(id)
+
+    async def search(self, body=None, **kwargs):
+        self.searches.append(body)
+        start = body.get("search_after", [0])[0]
+        hits = [{"_source": {"product_name": f"p{i}"}, "sort": [i + 1]} for i in range(start, start + body["size"])]
+        response = {"took": 1, "hits": {"hits": hits}}
+        if "pit" in body:
+            response["pit_id"] = body["pit"]["id"]
+        return response
+
+
+@pytest.fixture
+def paging_es(monkeypatch):
+    client = _PagingClient()
+    monkeypatch.setattr(search_service, "_breaker", CircuitBreaker("elasticsearch"))
+    monkeypatch.setattr(search_service, "get_es_client", lambda: client)
+    monkeypatch.setattr(search_service, "SEARCH_BACKEND", "elasticsearch")
+    monkeypatch.setattr(search_service, "SEARCH_CACHE_ENABLED", True)
+    monkeypatch.setattr(search_service, "_catalog", {"version": None, "last_check": 0.0})
+    search_service.invalidate_search_cache()
+    yield client
+    search_service.invalidate_search_cache()
+
+
+def test_first_page_is_cached_without_pit_and_pit_opens_on_second_page(paging_es):
+    first = asyncio.run(search_service.search_products("máy hàn", size=3))
+    again = asyncio.run(search_service.search_products("máy hàn", size=3))
+    assert len(paging_es.searches) == 1
+    assert paging_es.opened == []
+    assert [p["product_name"] for p in again] == [p["product_name"] for p in first] == ["p0", "p1", "p2"]
+    assert again.cursor == {"pit_id": None, "search_after": [3]}
+
+    second = asyncio.run(search_service.search_products("máy hàn", size=3, cursor=again.cursor))
+    assert paging_es.opened == ["pit-0"]
+    assert paging_es.searches[-1]["pit"]["id"] == "pit-0"
+    assert [p["product_name"] for p in second] == ["p3", "p4", "p5"]
+    assert second.cursor["pit_id"] == "pit-0"
+
+
+def test_paginate_opens_pit_on_first_page_and_skips_cache(paging_es):
+    hits = asyncio.run(search_service.search_products("máy hàn", size=3, paginate=True))
+    assert paging_es.opened == ["pit-0"]
+    assert hits.cursor["pit_id"] == "pit-0"
+    asyncio.run(search_service.search_products("máy hàn", size=3, paginate=True))
+    assert len(paging_es.searches) == 2